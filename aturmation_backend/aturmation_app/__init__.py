@@ -1,52 +1,62 @@
 # aturmation_app/__init__.py
 from pyramid.config import Configurator
-from pyramid.renderers import JSON
-from pyramid.events import NewRequest
-from pyramid.response import Response
+from pyramid.tweens import INGRESS
 import logging
 
-# Konfigurasi logging
-logging.basicConfig(level=logging.DEBUG)
+from .logs import setup_logging
+from .pooling import server_threads
+
 logger = logging.getLogger(__name__)
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application."""
     
+    # Logging lewat antrean (lihat logging.* di .ini); handler diambil dari [handler_*]
+    setup_logging(settings)
+
+    # Pool koneksi mengikuti threads di [server:main]; db.pool.threads hanya override
+    threads = server_threads(global_config)
+    if threads is not None:
+        settings.setdefault('db.pool.threads', threads)
+
     try:
         with Configurator(settings=settings) as config:
             # Include basic components
             config.include('pyramid_jinja2')
+            config.include('.logs')
             config.include('.models')
+            config.include('.dbstats')
+            config.include('.replicas')
+            config.include('.pooling')
+            config.include('.cache')
+            config.include('.product_cache')
+            config.include('.counting')
+            config.include('.hashing')
+            config.include('.tokens')
+            config.include('.metrics')
+            config.include('.profiling')
+            config.include('.tracing')
+            config.include('.queryaudit')
             config.include('.routes')
             
-            # Konfigurasi CORS yang diperbarui
-            def add_cors_headers_response_callback(event):
-                def cors_headers(request, response):
-                    response.headers.update({
-                        'Access-Control-Allow-Origin': 'http://localhost:5173',  # Sesuaikan dengan frontend URL
-                        'Access-Control-Allow-Methods': 'POST,GET,DELETE,PUT,OPTIONS',
-                        'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization',
-                        'Access-Control-Allow-Credentials': 'true',
-                        'Access-Control-Max-Age': '1728000',
-                    })
-                event.request.add_response_callback(cors_headers)
-            
-            config.add_subscriber(add_cors_headers_response_callback, NewRequest)
-            
-            # Tambahkan route OPTIONS untuk preflight requests
-            def options_view(request):
-                return Response()
-            
-            config.add_route('cors_preflight', '{path:.*}')
-            config.add_view(options_view, route_name='cors_preflight', request_method='OPTIONS')
-            
+            # Urutan tween dari luar: tracing -> metrik -> CORS -> profiling -> session database -> excview
+            # Tracing paling luar: span tree per request (lihat tracing.* di .ini)
+            config.add_tween('aturmation_app.tracing.tracing_tween_factory', under=INGRESS)
+            # Metrik agar preflight juga terhitung (lihat metrics.* di .ini)
+            config.add_tween('aturmation_app.tweens.metrics_tween_factory',
+                             under='aturmation_app.tracing.tracing_tween_factory')
+            # CORS: preflight dijawab sebelum routing/auth/DB (lihat cors.* di .ini)
+            config.add_tween('aturmation_app.tweens.cors_tween_factory',
+                             under='aturmation_app.tweens.metrics_tween_factory')
+            # Profiling per request (header X-Profile, lihat profiling.* di .ini)
+            config.add_tween('aturmation_app.tweens.profiling_tween_factory',
+                             under='aturmation_app.tweens.cors_tween_factory')
             # Tambahkan tween untuk manajemen session database
-            config.add_tween('aturmation_app.tweens.db_session_tween_factory')
-            config.add_tween('aturmation_app.tweens.cors_tween_factory', over='pyramid.tweens.excview_tween_factory')
+            config.add_tween('aturmation_app.tweens.db_session_tween_factory',
+                             under='aturmation_app.tweens.profiling_tween_factory')
             
-            # Konfigurasi JSON renderer
-            json_renderer = JSON()
-            config.add_renderer('json', json_renderer)
+            # Konfigurasi JSON renderer (orjson jika terpasang)
+            config.include('.renderers')
             
             # Konfigurasi security
             from .security import JWTAuthenticationPolicy, RootFactory
@@ -59,8 +69,8 @@ def main(global_config, **settings):
             config.set_authorization_policy(authz_policy)
             config.set_root_factory(RootFactory)
             
-            # Tambahkan security request methods
-            config.add_request_method('.security.get_user', 'user', reify=True)
+            # Tambahkan security request methods (jwt_claims, user_snapshot, user)
+            config.include('.security')
             
             # Scan views
             config.scan()
@@ -0,0 +1,317 @@
+# aturmation_app/batch.py
+"""
+Set-based multi-row product updates and deletes.
+
+Items address a product by ``id`` or ``sku``. Updates resolve skus to ids
+first (one SELECT per chunk), are grouped by the set of fields they change,
+and each group becomes one
+``UPDATE products ... FROM (VALUES ...) WHERE products.id = v.id``
+per chunk of rows. Deletes are a single ``DELETE ... WHERE id = ANY(...)``
+(``IN (...)`` outside PostgreSQL). Everything runs in the caller's
+transaction. Each statement gets its own savepoint, and a statement the
+database rejects is retried item by item so one bad row only fails itself.
+
+``stock`` is an absolute set (a stock take). As in ``stock.set_stock``,
+the old stock is read by the UPDATE itself, under a row lock, and every
+changed stock gets a ``set`` row in ``stock_movements`` inside the same
+savepoint. Deltas go through POST /api/v1/products/stock-movements.
+"""
+import datetime
+import logging
+
+from sqlalchemy import Float, Integer, String, Text, any_, bindparam, column, delete, insert, literal, select, union_all, update, values
+from sqlalchemy.dialects import postgresql
+import sqlalchemy.exc
+
+from .models import Product, StockMovement
+from .queryaudit import bulk
+
+log = logging.getLogger(__name__)
+
+MAX_BATCH_ITEMS = 5000
+# Rows per UPDATE statement (SQLite caps compound SELECTs at 500 terms)
+STATEMENT_ROWS = 500
+
+FIELD_TYPES = {
+    'name': String,
+    'sku': String,
+    'description': Text,
+    'price': Float,
+    'stock': Integer,
+}
+KEY_TYPES = {
+    'id': Integer,
+    'sku': String,
+}
+
+
+class BatchError(ValueError):
+    """The batch as a whole is malformed"""
+
+
+def _result(index, status, message=None, **extra):
+    result = {'index': index, 'status': status}
+    result.update(extra)
+    if message:
+        result['message'] = message
+    return result
+
+
+def _integrity_message(error):
+    message = str(getattr(error, 'orig', error))
+    if 'unique' in message.lower() and 'sku' in message.lower():
+        return 'A product with this SKU already exists'
+    return message
+
+
+def parse_update_item(item):
+    """Return ``(key_field, key_value, changes)`` for one PATCH item or raise ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object')
+    if item.get('id') is not None:
+        try:
+            key_field, key_value = 'id', int(item['id'])
+        except (TypeError, ValueError):
+            raise ValueError('id must be an integer')
+    elif item.get('sku'):
+        key_field, key_value = 'sku', str(item['sku'])
+    else:
+        raise ValueError('Item needs an id or a sku')
+
+    changes = {}
+    for field in FIELD_TYPES:
+        if field not in item or (field == key_field):
+            continue
+        value = item[field]
+        if field in ('name', 'sku'):
+            if not value:
+                raise ValueError('%s cannot be empty' % field.capitalize())
+            value = str(value)
+        elif field == 'price':
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError('Price must be a number')
+        elif field == 'stock':
+            if isinstance(value, bool):
+                raise ValueError('Stock must be an integer')
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError('Stock must be an integer')
+        changes[field] = value
+    if not changes:
+        raise ValueError('Nothing to update')
+    return key_field, key_value, changes
+
+
+def parse_delete_item(item):
+    """Return ``(key_field, key_value)`` for one delete item or raise ValueError"""
+    if isinstance(item, dict) and item.get('id') is not None:
+        try:
+            return 'id', int(item['id'])
+        except (TypeError, ValueError):
+            raise ValueError('id must be an integer')
+    if isinstance(item, dict) and item.get('sku'):
+        return 'sku', str(item['sku'])
+    raise ValueError('Item needs an id or a sku')
+
+
+def _source(dialect_name, columns, rows):
+    """
+    Inline row source ``v`` over ``columns`` (name, type) pairs.
+
+    VALUES on PostgreSQL; SQLite cannot alias VALUES columns in a FROM
+    clause, so elsewhere it is a UNION ALL of one-row SELECTs.
+    """
+    if dialect_name == 'postgresql':
+        return values(*[column(name, type_()) for name, type_ in columns], name='v').data(rows)
+    selects = [
+        select(*[literal(value, type_()).label(name) for (name, type_), value in zip(columns, row)])
+        for row in rows
+    ]
+    if len(selects) == 1:
+        return selects[0].subquery('v')
+    return union_all(*selects).subquery('v')
+
+
+def _chunks(items, size=STATEMENT_ROWS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def resolve_skus(connection, skus):
+    """``{sku: id}`` for the existing products among ``skus``"""
+    table = Product.__table__
+    ids = {}
+    for keys in _chunks(list(skus)):
+        ids.update((sku, id) for id, sku in connection.execute(
+            select(table.c.id, table.c.sku).where(table.c.sku.in_(keys))
+        ))
+    return ids
+
+
+def _stock_ledger(rows, stock_before, created_by, now):
+    """``set`` ledger rows for the products whose stock the UPDATE changed"""
+    ledger = []
+    for row in rows:
+        before = row.stock_before if stock_before is None else stock_before[row.id]
+        if row.stock_after != before:
+            ledger.append({
+                'product_id': row.id,
+                'delta': row.stock_after - before,
+                'stock_after': row.stock_after,
+                'reason': 'set',
+                'reference': None,
+                'created_by': created_by,
+                'created_at': now,
+            })
+    return ledger
+
+
+def batch_update(connection, items, created_by=None):
+    """Apply PATCH ``items`` and return one result dict per item, in order"""
+    if len(items) > MAX_BATCH_ITEMS:
+        raise BatchError('At most %d items per batch' % MAX_BATCH_ITEMS)
+
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index,) + parse_update_item(item))
+        except ValueError as e:
+            results[index] = _result(index, 'invalid', str(e))
+
+    # Items keyed by sku are resolved to ids first, so one product addressed
+    # by id and by sku in the same batch is caught as a duplicate
+    ids_by_sku = resolve_skus(connection, set(
+        key_value for index, key_field, key_value, changes in parsed if key_field == 'sku'))
+    groups = {}
+    seen = set()
+    for index, key_field, key_value, changes in parsed:
+        product_id = ids_by_sku.get(key_value) if key_field == 'sku' else key_value
+        if product_id is None:
+            results[index] = _result(index, 'not_found', 'Product not found', **{key_field: key_value})
+            continue
+        if product_id in seen:
+            results[index] = _result(index, 'invalid', 'Duplicate item in batch', **{key_field: key_value})
+            continue
+        seen.add(product_id)
+        group = groups.setdefault(tuple(sorted(changes)), [])
+        group.append((index, product_id, changes, key_field, key_value))
+
+    table = Product.__table__
+    postgres = connection.dialect.name == 'postgresql'
+    now = datetime.datetime.utcnow()
+    for fields, group in groups.items():
+        columns = [('id', KEY_TYPES['id'])] + [(field, FIELD_TYPES[field]) for field in fields]
+
+        def run(chunk):
+            ids = [product_id for index, product_id, changes, key_field, key_value in chunk]
+            source = _source(
+                connection.dialect.name, columns,
+                [(product_id,) + tuple(changes[field] for field in fields)
+                 for index, product_id, changes, key_field, key_value in chunk]
+            )
+            statement = update(table).where(table.c.id == source.c.id).values(
+                updated_at=now, **{field: source.c[field] for field in fields}
+            )
+            returning = [table.c.id, table.c.sku]
+            stock_before = None
+            if 'stock' in fields and postgres:
+                # Old stock from a locked read inside the UPDATE, as in stock.set_stock
+                old = select(table.c.id, table.c.stock).where(table.c.id.in_(ids)).with_for_update().subquery('old')
+                statement = statement.where(table.c.id == old.c.id)
+                returning += [old.c.stock.label('stock_before'), table.c.stock.label('stock_after')]
+            elif 'stock' in fields:
+                returning.append(table.c.stock.label('stock_after'))
+            with connection.begin_nested():
+                if 'stock' in fields and not postgres:
+                    # SQLite: a no-op UPDATE takes the write lock and reads the current stock
+                    stock_before = dict(connection.execute(
+                        update(table).where(table.c.id.in_(ids)).values(stock=table.c.stock)
+                        .returning(table.c.id, table.c.stock)
+                    ).all())
+                rows = connection.execute(statement.returning(*returning)).fetchall()
+                if 'stock' in fields:
+                    ledger = _stock_ledger(rows, stock_before, created_by, now)
+                    if ledger:
+                        connection.execute(insert(StockMovement.__table__), ledger)
+            # SQLite's RETURNING cannot see ``v``, so map back through the id
+            return {row.id: row for row in rows}
+
+        for chunk in _chunks(group):
+            try:
+                matched = run(chunk)
+            except sqlalchemy.exc.DBAPIError as e:
+                log.warning("Batch update statement failed (%s), retrying item by item", e)
+                with bulk(connection):
+                    for entry in chunk:
+                        index, product_id, changes, key_field, key_value = entry
+                        try:
+                            single = run([entry])
+                        except sqlalchemy.exc.DBAPIError as item_error:
+                            results[index] = _result(index, 'error', _integrity_message(item_error),
+                                                     **{key_field: key_value})
+                            continue
+                        results[index] = _updated_or_missing(index, key_field, key_value, single.get(product_id))
+                continue
+            for index, product_id, changes, key_field, key_value in chunk:
+                results[index] = _updated_or_missing(index, key_field, key_value, matched.get(product_id))
+    return results
+
+
+def _updated_or_missing(index, key_field, key_value, row):
+    if row is None:
+        return _result(index, 'not_found', 'Product not found', **{key_field: key_value})
+    return _result(index, 'updated', id=row.id, sku=row.sku)
+
+
+def batch_delete(connection, items):
+    """Delete ``items`` in one statement and return one result dict per item"""
+    if len(items) > MAX_BATCH_ITEMS:
+        raise BatchError('At most %d items per batch' % MAX_BATCH_ITEMS)
+
+    results = [None] * len(items)
+    keys = {'id': [], 'sku': []}
+    for index, item in enumerate(items):
+        try:
+            key_field, key_value = parse_delete_item(item)
+        except ValueError as e:
+            results[index] = _result(index, 'invalid', str(e))
+            continue
+        keys[key_field].append((index, key_value))
+
+    table = Product.__table__
+    postgres = connection.dialect.name == 'postgresql'
+    deleted = {'id': {}, 'sku': {}}
+    for key_field, entries in keys.items():
+        if not entries:
+            continue
+        key_values = list(set(key_value for index, key_value in entries))
+        key_column = table.c[key_field]
+        if postgres:
+            array_type = postgresql.ARRAY(KEY_TYPES[key_field])
+            condition = key_column == any_(bindparam('keys', key_values, type_=array_type))
+        else:
+            condition = key_column.in_(key_values)
+        statement = delete(table).where(condition).returning(table.c.id, table.c.sku)
+        for row in connection.execute(statement):
+            deleted['id'][row.id] = row
+            deleted['sku'][row.sku] = row
+
+    for key_field, entries in keys.items():
+        for index, key_value in entries:
+            row = deleted[key_field].get(key_value)
+            if row is None:
+                results[index] = _result(index, 'not_found', 'Product not found', **{key_field: key_value})
+            else:
+                results[index] = _result(index, 'deleted', id=row.id, sku=row.sku)
+    return results
+
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
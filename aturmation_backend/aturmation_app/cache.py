@@ -0,0 +1,174 @@
+# aturmation_app/cache.py
+"""
+Small in-process result caches for derived product data (counts, dashboard
+stats). Every cache registered with ``register_product_cache`` is dropped by
+``invalidate_product_caches`` whenever a view writes products.
+
+``LRUCache`` is the bounded per-key cache used in front of the product read
+path (see ``aturmation_app.product_cache``).
+"""
+import collections
+import threading
+import time
+
+
+class ResultCache(object):
+    """Thread-safe key -> value map with TTL and write invalidation"""
+
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bumped on every write so a value computed before the write is never stored
+        self._generation = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            return None
+        return value
+
+    def set(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU map with a TTL per entry and hit/miss/eviction counters.
+
+    ``set`` takes the ``generation`` read before the value was loaded, like
+    ``ResultCache``, so a load racing an invalidation is dropped.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def register_product_cache(registry, cache):
+    """Have ``cache`` invalidated by every product write"""
+    registry['product_caches'].append(cache)
+    return cache
+
+
+def invalidate_product_caches(request, product_ids=None):
+    """
+    Drop cached product data after a write.
+
+    Invalidates now and again once the request has finished (after
+    ``db_session_tween`` committed), so a reader racing the commit cannot
+    leave a stale value behind.
+
+    ``product_ids`` are also dropped from the per-product read cache once the
+    transaction has committed (every product when None), see
+    ``commit_product_invalidations``.
+    """
+    caches = request.registry['product_caches']
+
+    def invalidate(request=None):
+        for cache in caches:
+            cache.invalidate()
+
+    invalidate()
+    request.add_finished_callback(invalidate)
+
+    pending = getattr(request, 'product_cache_pending', ())
+    if product_ids is None or pending is None:
+        request.product_cache_pending = None
+    else:
+        request.product_cache_pending = set(pending).union(product_ids)
+
+
+def commit_product_invalidations(request):
+    """Apply the invalidations scheduled on ``request``; called after commit"""
+    pending = getattr(request, 'product_cache_pending', ())
+    product_cache = request.registry.get('product_cache')
+    if product_cache is None or pending == ():
+        return
+    product_cache.invalidate(pending)
+
+
+def includeme(config):
+    settings = config.get_settings()
+    config.registry['product_caches'] = []
+    # Dashboard aggregates from GET /api/v1/products/stats
+    config.registry['stats_cache'] = register_product_cache(config.registry, ResultCache(
+        ttl=float(settings.get('products.stats.cache_ttl', 5)),
+        max_entries=64
+    ))
@@ -0,0 +1,82 @@
+# aturmation_app/conditional.py
+"""
+Conditional GET (ETag / Last-Modified) for any view.
+
+Use as a Pyramid view decorator with a validator function::
+
+    @view_config(..., decorator=conditional(my_validators))
+
+``my_validators(request)`` runs before the view and returns ``Validators``
+(or None to skip conditional handling, e.g. for a missing resource). When
+``If-None-Match`` / ``If-Modified-Since`` match, a 304 is returned without
+calling the view, so nothing is loaded or serialized.
+"""
+import collections
+import datetime
+import hashlib
+
+from pyramid.httpexceptions import HTTPNotModified
+
+Validators = collections.namedtuple('Validators', 'etag weak last_modified')
+
+
+def make_etag(*parts):
+    """Opaque ETag value from the string form of ``parts``"""
+    digest = hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _quoted(validators):
+    return ('W/"%s"' if validators.weak else '"%s"') % validators.etag
+
+
+def _http_datetime(value):
+    """Naive timestamps are stored in UTC, like HTTP dates"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc, microsecond=0)
+    return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def is_not_modified(request, validators):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # Weak comparison (RFC 7232 3.2); If-Modified-Since is then ignored
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"') == validators.etag:
+                return True
+        return False
+    if validators.last_modified is not None and request.if_modified_since is not None:
+        return _http_datetime(validators.last_modified) <= request.if_modified_since
+    return False
+
+
+def apply_validators(response, validators):
+    response.headers['ETag'] = _quoted(validators)
+    if validators.last_modified is not None:
+        response.last_modified = _http_datetime(validators.last_modified)
+    # Let clients keep the body but always revalidate it
+    response.cache_control = 'no-cache'
+
+
+def conditional(validator):
+    """View decorator adding ETag/Last-Modified and 304 handling"""
+    def decorator(view):
+        def conditional_view(context, request):
+            validators = validator(request)
+            if validators is None:
+                return view(context, request)
+            if is_not_modified(request, validators):
+                response = HTTPNotModified()
+                apply_validators(response, validators)
+                return response
+            response = view(context, request)
+            if 200 <= response.status_int < 300:
+                apply_validators(response, validators)
+            return response
+        return conditional_view
+    return decorator
@@ -0,0 +1,101 @@
+# aturmation_app/counting.py
+"""
+Count strategies for the product collection.
+
+``count=exact``     run the COUNT query (default)
+``count=cached``    reuse a recent exact count; product writes invalidate it
+``count=estimate``  ask the planner (pg_class.reltuples / EXPLAIN)
+``count=none``      skip counting entirely
+
+Settings:
+
+``products.count.default``    mode used when the client sends none
+``products.count.cache_ttl``  seconds a cached count may live (default 30)
+"""
+import json
+import logging
+
+from sqlalchemy import text
+
+from .cache import ResultCache, register_product_cache
+from .queries import count_rows
+
+log = logging.getLogger(__name__)
+
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_CACHED, COUNT_ESTIMATE, COUNT_NONE)
+
+
+def estimate_count(session, statement, filtered):
+    """
+    Return the planner's row estimate for ``statement`` or None if unavailable.
+
+    Unfiltered counts read ``pg_class.reltuples``; filtered ones run
+    ``EXPLAIN (FORMAT JSON)`` and take the top plan node's row estimate.
+    """
+    connection = session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    # Savepoint so a failed EXPLAIN does not abort the request's transaction
+    with session.begin_nested():
+        if not filtered:
+            reltuples = connection.execute(text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass"
+            )).scalar()
+            # -1 means the table was never vacuumed/analyzed
+            return int(reltuples) if reltuples is not None and reltuples >= 0 else None
+        compiled = statement.compile(dialect=connection.dialect)
+        plan = connection.exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+        ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_products(request, statement, mode, key):
+    """
+    Count the Core ``statement`` using ``mode``; ``key`` identifies the filter
+    (None when unfiltered).
+
+    Returns ``(total_items, mode_used)``. ``mode_used`` differs from
+    ``mode`` when a strategy is not available and we fell back to exact.
+    """
+    if mode == COUNT_NONE:
+        return None, COUNT_NONE
+
+    if mode == COUNT_ESTIMATE:
+        try:
+            estimate = estimate_count(request.dbsession, statement, key is not None)
+        except Exception as e:
+            log.warning("Count estimate failed, falling back to exact: %s", e)
+            estimate = None
+        if estimate is not None:
+            return estimate, COUNT_ESTIMATE
+        return count_rows(request.dbsession.connection(), statement), COUNT_EXACT
+
+    if mode == COUNT_CACHED:
+        cache = request.registry['count_cache']
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, COUNT_CACHED
+        generation = cache.generation
+        total_items = count_rows(request.dbsession.connection(), statement)
+        cache.set(key, total_items, generation)
+        return total_items, COUNT_EXACT
+
+    return count_rows(request.dbsession.connection(), statement), COUNT_EXACT
+
+
+def includeme(config):
+    settings = config.get_settings()
+    default = settings.get('products.count.default', COUNT_EXACT)
+    if default not in COUNT_MODES:
+        raise ValueError('products.count.default must be one of %s' % ', '.join(COUNT_MODES))
+    config.registry['count_default'] = default
+    config.registry['count_cache'] = register_product_cache(config.registry, ResultCache(
+        ttl=float(settings.get('products.count.cache_ttl', 30))
+    ))
@@ -0,0 +1,78 @@
+# aturmation_app/dbstats.py
+"""
+Database usage counters, per request and per process.
+
+``request.db_counters`` counts what one request did: sessions opened,
+connections checked out of the pool, COMMITs and ROLLBACKs. The same events
+are summed in ``registry['db_counters']`` together with the number of
+requests, so the share of requests that never touched the database is
+visible.
+
+Settings:
+
+``db.counters.header``  add ``X-DB-Counters`` to every response (default false)
+"""
+import threading
+
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
+from sqlalchemy import event
+
+COUNTERS = ('sessions', 'checkouts', 'commits', 'rollbacks')
+
+
+class DBCounters(object):
+    """Process-wide totals of the per-request counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(('requests', 'requests_without_db') + COUNTERS, 0)
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.totals[name] += amount
+
+    def finish_request(self, counters):
+        with self._lock:
+            self.totals['requests'] += 1
+            if not counters['sessions'] and not counters['checkouts']:
+                self.totals['requests_without_db'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.totals)
+
+
+def get_db_counters(request):
+    return dict.fromkeys(COUNTERS, 0)
+
+
+def count(name, request=None):
+    """Add one ``name`` event to the current request and the process totals"""
+    request = request or get_current_request()
+    if request is None:
+        return
+    totals = request.registry.get('db_counters')
+    if totals is None:
+        return
+    request.db_counters[name] += 1
+    totals.add(name)
+
+
+def format_counters(counters):
+    return ', '.join('%s=%d' % (name, counters[name]) for name in COUNTERS)
+
+
+def instrument_engine(engine):
+    """Count pool checkouts and transaction ends on ``engine`` for the current request"""
+    event.listen(engine, 'checkout', lambda *args: count('checkouts'))
+    event.listen(engine, 'commit', lambda connection: count('commits'))
+    event.listen(engine, 'rollback', lambda connection: count('rollbacks'))
+
+
+def includeme(config):
+    settings = config.get_settings()
+    config.registry['db_counters'] = DBCounters()
+    config.registry['db_counters_header'] = asbool(settings.get('db.counters.header', False))
+    config.add_request_method(get_db_counters, 'db_counters', reify=True)
+    instrument_engine(config.registry['dbengine'])
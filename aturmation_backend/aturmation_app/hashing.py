@@ -0,0 +1,177 @@
+# aturmation_app/hashing.py
+"""
+Password hashing off the request threads.
+
+bcrypt costs ~250 ms of CPU per call at the default work factor. Hashing
+and verification run in a small process pool instead of on the waitress
+thread, and at most ``max_pending`` calls may be queued or running at once:
+beyond that ``HashingBusy`` is raised and the login view answers 503 with
+``Retry-After``, so a login burst cannot take every server thread. A call
+that does not finish within ``timeout`` is cancelled (if it has not started)
+and answered the same way.
+
+When a verified hash was made with another work factor, the password is
+rehashed in the pool and stored after the login has been answered.
+
+Settings:
+
+``auth.bcrypt.rounds``      work factor for new hashes (default 12)
+``auth.hash.workers``       pool processes (default 2; 0 hashes inline)
+``auth.hash.max_pending``   queued + running calls admitted (default 2 x workers)
+``auth.hash.timeout``       seconds a request waits for its result (default 10)
+``auth.hash.retry_after``   Retry-After seconds sent with the 503 (default 2)
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+
+from passlib.context import CryptContext
+from sqlalchemy import update
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+
+_contexts = {}
+
+
+def get_context(rounds):
+    """The bcrypt ``CryptContext`` for ``rounds``, built once per process"""
+    context = _contexts.get(rounds)
+    if context is None:
+        context = _contexts[rounds] = CryptContext(
+            schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=rounds
+        )
+    return context
+
+
+def _hash(rounds, secret):
+    return get_context(rounds).hash(secret)
+
+
+def _verify(rounds, secret, hashed):
+    """Return ``(matches, needs_update)``; runs in a pool process"""
+    context = get_context(rounds)
+    matches = context.verify(secret, hashed)
+    return matches, matches and context.needs_update(hashed)
+
+
+class HashingBusy(Exception):
+    """Too many hashing calls are already queued"""
+
+    def __init__(self, retry_after, message='Password hashing queue is full'):
+        super(HashingBusy, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class PasswordHasher(object):
+    """Bounded process pool running bcrypt with admission control"""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=None, timeout=10.0, retry_after=2):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending or max(1, 2 * workers)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        # Created on first use so worker processes start in the serving process
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _submit(self, fn, *args):
+        """Run ``fn`` in the pool holding one admission slot until it finishes"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy(self.retry_after)
+        if self.workers <= 0:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+            return future
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def _result(self, future):
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # A call still queued is dropped; a running one keeps its slot until done
+            future.cancel()
+            self.timeouts += 1
+            raise HashingBusy(self.retry_after, 'Password hashing timed out')
+
+    def hash(self, secret):
+        return self._result(self._submit(_hash, self.rounds, secret))
+
+    def verify(self, secret, hashed):
+        """Return ``(matches, needs_update)``; raises ``HashingBusy`` when saturated or too slow"""
+        return self._result(self._submit(_verify, self.rounds, secret, hashed))
+
+    def rehash_later(self, session_factory, user_id, secret, old_hash):
+        """
+        Rehash ``secret`` in the background and store it for ``user_id``.
+
+        Skipped silently when the pool is busy (the next login retries), and
+        the stored hash is only replaced if it is still ``old_hash``.
+        """
+        from .models import User
+
+        def store(future):
+            try:
+                new_hash = future.result()
+                session = session_factory()
+                try:
+                    session.execute(
+                        update(User.__table__)
+                        .where(User.__table__.c.id == user_id)
+                        .where(User.__table__.c.hashed_password == old_hash)
+                        .values(hashed_password=new_hash)
+                    )
+                    session.commit()
+                finally:
+                    session.close()
+                log.info(f"Rehashed password for user {user_id} with {self.rounds} rounds")
+            except Exception as e:
+                log.error(f"Background rehash failed for user {user_id}: {e}")
+
+        try:
+            self._submit(_hash, self.rounds, secret).add_done_callback(store)
+        except HashingBusy:
+            pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def includeme(config):
+    settings = config.get_settings()
+    workers = int(settings.get('auth.hash.workers', 2))
+    config.registry['password_hasher'] = PasswordHasher(
+        rounds=int(settings.get('auth.bcrypt.rounds', DEFAULT_ROUNDS)),
+        workers=workers,
+        max_pending=int(settings.get('auth.hash.max_pending', 0)) or None,
+        timeout=float(settings.get('auth.hash.timeout', 10)),
+        retry_after=int(settings.get('auth.hash.retry_after', 2)),
+    )
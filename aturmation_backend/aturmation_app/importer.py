@@ -0,0 +1,305 @@
+# aturmation_app/importer.py
+"""
+Bulk product import with upsert on SKU.
+
+Records are parsed from CSV or NDJSON in chunks, validated one by one
+(invalid rows are reported, not fatal) and written per chunk with
+``INSERT ... ON CONFLICT (sku) DO UPDATE``. Within a chunk the last row of
+a SKU wins; the earlier ones are counted as ``duplicates``, so
+``received == upserted + failed + duplicates``.
+
+* PostgreSQL: the chunk is COPY'd into a temporary staging table and
+  upserted from there with one INSERT ... SELECT.
+* Other dialects (SQLite): one executemany upsert.
+
+Each chunk runs in a savepoint. If the database rejects a chunk, it is
+retried row by row so only the offending rows are reported.
+
+Stock the import changes is recorded in ``stock_movements`` (reason
+``import``) inside the same savepoint: the chunk's current stock is read
+first (``FOR UPDATE`` on PostgreSQL) and compared with what the upsert
+returns.
+"""
+import csv
+import datetime
+import io
+import itertools
+import json
+import logging
+import math
+import time
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import sqlite
+
+from .batch import _chunks
+from .models import Product, StockMovement
+from .queryaudit import bulk
+
+log = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+DEFAULT_CHUNK_SIZE = 5000
+# Keep the error report bounded for feeds that are wrong on every line
+MAX_REPORTED_ERRORS = 1000
+
+UPSERT_COLUMNS = ('name', 'sku', 'description', 'price', 'stock')
+# What undecodable bytes become; a record containing it fails on its own
+REPLACEMENT_CHARACTER = '\ufffd'
+
+
+class ImportResult(object):
+    def __init__(self):
+        self.received = 0
+        self.upserted = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, line, sku, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'sku': sku, 'message': message})
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self):
+        return {
+            'received': self.received,
+            'upserted': self.upserted,
+            'failed': self.failed,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.received / self.elapsed, 1) if self.elapsed else None,
+        }
+
+
+def parse_records(stream, fmt):
+    """
+    Yield ``(line_number, record_or_None, error_or_None)`` from a binary stream.
+
+    CSV needs a header row naming the columns; NDJSON is one object per line.
+    Invalid UTF-8 and malformed CSV fail the record they are in, not the
+    import.
+    """
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        while True:
+            # A record failing to parse starts on the line after the last one read
+            previous_line = reader.line_num
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield previous_line + 1, None, 'Invalid CSV: %s' % e
+                continue
+            if any(REPLACEMENT_CHARACTER in str(value) for value in record.values()):
+                yield reader.line_num, record, 'Invalid UTF-8'
+                continue
+            yield reader.line_num, record, None
+    for line_number, line in enumerate(text_stream, 1):
+        if not line.strip():
+            continue
+        if REPLACEMENT_CHARACTER in line:
+            yield line_number, None, 'Invalid UTF-8'
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, 'Invalid JSON: %s' % e
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, record, None
+
+
+def validate_record(record):
+    """Apply the create_product rules; return a row dict or raise ValueError"""
+    name = str(record.get('name') or '').strip()
+    sku = str(record.get('sku') or '').strip()
+    price = record.get('price')
+    stock = record.get('stock')
+    description = record.get('description') or None
+
+    errors = []
+    if not name:
+        errors.append('Name is required')
+    if not sku:
+        errors.append('SKU is required')
+    if price in (None, ''):
+        errors.append('Price is required')
+    else:
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            errors.append('Price must be a number')
+        else:
+            if not math.isfinite(price):
+                errors.append('Price must be a finite number')
+    try:
+        stock = int(stock) if stock not in (None, '') else 0
+    except (TypeError, ValueError):
+        errors.append('Stock must be an integer')
+    if errors:
+        raise ValueError('; '.join(errors))
+
+    return {
+        'name': name,
+        'sku': sku,
+        'description': description,
+        'price': price,
+        'stock': stock,
+    }
+
+
+class ProductImporter(object):
+    """Upsert validated product rows on ``connection`` chunk by chunk"""
+
+    def __init__(self, connection, chunk_size=DEFAULT_CHUNK_SIZE, created_by=None):
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.created_by = created_by
+        self.dialect = connection.dialect.name
+
+    def run(self, records):
+        """Import ``records`` from ``parse_records`` and return an ``ImportResult``"""
+        result = ImportResult()
+        records = iter(records)
+        # The same statements run once per chunk (and per row on retries)
+        with bulk(self.connection):
+            while True:
+                chunk = list(itertools.islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, result)
+                log.debug("Imported %d rows so far (%d failed)", result.upserted, result.failed)
+        return result.finish()
+
+    def _import_chunk(self, chunk, result):
+        # Last occurrence of a SKU wins; ON CONFLICT cannot touch a row twice
+        rows = {}
+        for line, record, error in chunk:
+            result.received += 1
+            if error is None:
+                try:
+                    row = validate_record(record)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                result.error(line, record.get('sku') if record else None, error)
+                continue
+            if row['sku'] in rows:
+                result.duplicates += 1
+                del rows[row['sku']]
+            rows[row['sku']] = (line, row)
+        if not rows:
+            return
+
+        try:
+            with self.connection.begin_nested():
+                self._upsert([row for line, row in rows.values()])
+            result.upserted += len(rows)
+        except Exception as e:
+            log.warning("Chunk upsert failed (%s), retrying row by row", e)
+            for line, row in rows.values():
+                try:
+                    with self.connection.begin_nested():
+                        self._upsert([row])
+                    result.upserted += 1
+                except Exception as row_error:
+                    result.error(line, row['sku'], str(getattr(row_error, 'orig', row_error)))
+
+    def _upsert(self, rows):
+        now = datetime.datetime.utcnow()
+        before = self._current_stock([row['sku'] for row in rows])
+        if self.dialect == 'postgresql':
+            written = self._copy_upsert(rows, now)
+        else:
+            for row in rows:
+                row['created_at'] = now
+                row['updated_at'] = now
+            statement = sqlite.insert(Product.__table__)
+            statement = statement.on_conflict_do_update(
+                index_elements=['sku'],
+                set_={column: statement.excluded[column]
+                      for column in UPSERT_COLUMNS + ('updated_at',) if column != 'sku'},
+            )
+            table = Product.__table__
+            written = self.connection.execute(
+                statement.returning(table.c.id, table.c.sku, table.c.stock), rows
+            ).all()
+        self._record_stock(before, written, now)
+
+    def _current_stock(self, skus):
+        """``{sku: stock}`` of the existing products among ``skus``, locked on PostgreSQL"""
+        table = Product.__table__
+        stock = {}
+        for keys in _chunks(skus):
+            statement = select(table.c.sku, table.c.stock).where(table.c.sku.in_(keys))
+            if self.dialect == 'postgresql':
+                statement = statement.with_for_update()
+            stock.update(self.connection.execute(statement).all())
+        return stock
+
+    def _record_stock(self, before, written, now):
+        ledger = []
+        for row in written:
+            delta = row.stock - before.get(row.sku, 0)
+            if delta:
+                ledger.append({
+                    'product_id': row.id,
+                    'delta': delta,
+                    'stock_after': row.stock,
+                    'reason': 'import',
+                    'reference': None,
+                    'created_by': self.created_by,
+                    'created_at': now,
+                })
+        if ledger:
+            self.connection.execute(insert(StockMovement.__table__), ledger)
+
+    def _copy_upsert(self, rows, now):
+        self.connection.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS products_import_staging ("
+            "name varchar(255), sku varchar(100), description text, "
+            "price double precision, stock integer) ON COMMIT DROP"
+        ))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in UPSERT_COLUMNS])
+        buffer.seek(0)
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY products_import_staging (name, sku, description, price, stock) "
+                "FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        finally:
+            cursor.close()
+        written = self.connection.execute(text(
+            "INSERT INTO products (name, sku, description, price, stock, created_at, updated_at) "
+            "SELECT name, sku, description, price, stock, :now, :now FROM products_import_staging "
+            "ON CONFLICT (sku) DO UPDATE SET name = excluded.name, "
+            "description = excluded.description, price = excluded.price, "
+            "stock = excluded.stock, updated_at = excluded.updated_at "
+            "RETURNING id, sku, stock"
+        ), {'now': now}).all()
+        self.connection.execute(text("TRUNCATE products_import_staging"))
+        return written
+
+
+def import_products(connection, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE, created_by=None):
+    """Parse ``stream`` as ``fmt`` and upsert it on ``connection``"""
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError('format must be one of: %s' % ', '.join(IMPORT_FORMATS))
+    return ProductImporter(connection, chunk_size, created_by).run(parse_records(stream, fmt))
@@ -0,0 +1,274 @@
+# aturmation_app/logs.py
+"""
+Logging that never blocks a request thread.
+
+``setup_logging(settings)`` (called from ``main()``) moves the handlers the
+root logger already has (from the ``[handler_*]`` sections of the .ini, or
+a stderr handler) behind a bounded queue: request threads only put records
+on the queue and a ``QueueListener`` thread does the formatting and the
+I/O. When the queue is full the record is dropped and counted rather than
+waiting for the disk.
+
+On the request thread, records first pass per-logger sampling (DEBUG/INFO
+only) and a per-logger rate limit, and get the id of the current request.
+The listener writes plain text or one JSON object per line.
+
+Settings (``logging.profile`` picks the defaults of the others):
+
+``logging.profile``      ``development`` (text, .ini levels) or ``production``
+``logging.format``       ``text`` or ``json``
+``logging.levels``       ``logger:LEVEL`` overrides, e.g. ``sqlalchemy.engine:WARNING``
+``logging.sample``       ``logger:rate`` share of DEBUG/INFO records kept, e.g. ``aturmation_app.tokens:0.1``
+``logging.rate_limit``   records per second per logger, 0 for no limit
+``logging.queue_size``   records buffered before dropping (default 10000)
+``logging.async``        false writes from the request threads as before
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+import uuid
+
+from pyramid.settings import asbool, aslist
+from pyramid.threadlocal import get_current_request
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-5.5s [%(name)s:%(lineno)s][%(threadName)s][%(request_id)s] %(message)s'
+
+PROFILES = {
+    'development': {
+        'logging.format': 'text',
+        'logging.levels': '',
+        'logging.sample': '',
+        'logging.rate_limit': '0',
+    },
+    'production': {
+        'logging.format': 'json',
+        'logging.levels': 'root:INFO aturmation_app:INFO sqlalchemy.engine:WARNING',
+        'logging.sample': '',
+        'logging.rate_limit': '100',
+    },
+}
+
+_listener = None
+_handler = None
+_sampling = None
+
+
+def get_request_id(request):
+    """The client's ``X-Request-ID`` when sane, else a new id (``request.request_id``)"""
+    request_id = request.headers.get('X-Request-ID', '')
+    if 0 < len(request_id) <= 64 and request_id.isprintable():
+        return request_id
+    return uuid.uuid4().hex
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request's id (runs on the request thread)"""
+
+    def filter(self, record):
+        request = get_current_request()
+        record.request_id = request.request_id if request is not None and \
+            hasattr(request, 'request_id') else '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of DEBUG/INFO records per logger, and at most ``rate_limit``
+    records per second per logger. The first record let through after some
+    were rate limited carries their count as ``suppressed``.
+    """
+
+    def __init__(self, rates=None, rate_limit=0):
+        super(SamplingFilter, self).__init__()
+        self.rates = rates or {}
+        self.rate_limit = rate_limit
+        self._rate_for = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def _rate(self, name):
+        # Longest configured prefix of the logger name, like logger levels
+        rate = self._rate_for.get(name)
+        if rate is None:
+            rate, prefix = 1.0, name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._rate_for[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.rates:
+            rate = self._rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(record.name, (self.rate_limit, now, 0))
+            tokens = min(self.rate_limit, tokens + (now - updated) * self.rate_limit)
+            if tokens < 1.0:
+                self._buckets[record.name] = (tokens, now, suppressed + 1)
+                self.rate_limited += 1
+                return False
+            self._buckets[record.name] = (tokens - 1.0, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` that drops (and counts) records when the queue is full"""
+
+    def __init__(self, queue):
+        super(NonBlockingQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Interpolate the message here, while its arguments are still what
+        # the caller passed; everything else is formatted by the listener.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                    .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'thread': record.threadName,
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """``TEXT_FORMAT`` that tolerates records without a request id"""
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+        return super(TextFormatter, self).format(record)
+
+
+def _pairs(value, name):
+    pairs = {}
+    for item in aslist(value or ''):
+        logger, sep, setting = item.rpartition(':')
+        if not sep or not logger:
+            raise ValueError('%s entries must look like logger:value' % name)
+        pairs[logger] = setting
+    return pairs
+
+
+def stop_logging():
+    """Flush the queue and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, NonBlockingQueueHandler):
+                root.removeHandler(handler)
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = None
+
+
+def setup_logging(settings):
+    """Apply the logging profile and put the root handlers behind a queue"""
+    global _listener, _handler, _sampling
+    profile = settings.get('logging.profile', 'development')
+    if profile not in PROFILES:
+        raise ValueError('logging.profile must be one of: %s' % ', '.join(sorted(PROFILES)))
+
+    def option(name):
+        return settings.get(name, PROFILES[profile][name])
+
+    for name, level in _pairs(option('logging.levels'), 'logging.levels').items():
+        logging.getLogger(None if name == 'root' else name).setLevel(level.upper())
+
+    stop_logging()
+    root = logging.getLogger()
+    handlers = list(root.handlers) or [logging.StreamHandler()]
+    formatter = JSONFormatter() if option('logging.format') == 'json' else TextFormatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    sampling = SamplingFilter(
+        {name: float(rate) for name, rate in _pairs(option('logging.sample'), 'logging.sample').items()},
+        int(option('logging.rate_limit')),
+    )
+    _sampling = sampling
+    if not asbool(settings.get('logging.async', True)):
+        _handler = None
+        for handler in handlers:
+            for existing in list(handler.filters):
+                if isinstance(existing, (RequestContextFilter, SamplingFilter)):
+                    handler.removeFilter(existing)
+            handler.addFilter(RequestContextFilter())
+            handler.addFilter(sampling)
+            if handler not in root.handlers:
+                root.addHandler(handler)
+        return None
+
+    handler = _handler = NonBlockingQueueHandler(queue.Queue(int(settings.get('logging.queue_size', 10000))))
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(sampling)
+    for existing in handlers:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    _listener = logging.handlers.QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return handler
+
+
+atexit.register(stop_logging)
+
+
+def logging_stats():
+    """Records queued, dropped on a full queue, sampled out and rate limited"""
+    return {
+        'queued': _handler.queue.qsize() if _handler is not None else 0,
+        'dropped': _handler.dropped if _handler is not None else 0,
+        'sampled_out': _sampling.sampled_out if _sampling is not None else 0,
+        'rate_limited': _sampling.rate_limited if _sampling is not None else 0,
+    }
+
+
+def includeme(config):
+    config.add_request_method(get_request_id, 'request_id', reify=True)
@@ -0,0 +1,236 @@
+# aturmation_app/metrics.py
+"""
+Request and SQL metrics in Prometheus text format.
+
+``tweens.metrics_tween_factory`` times every request and records, per route
+name: requests by status class, a latency histogram, bytes sent, and the
+number and time of SQL statements the request ran (from
+``before_cursor_execute``/``after_cursor_execute`` on every engine).
+
+Each thread writes to its own buckets, so recording takes no lock; a scrape
+of ``GET /metrics`` sums the buckets of all threads. Pool, password hashing
+and logging numbers are added at scrape time.
+
+Settings:
+
+``metrics.enabled``  record and serve metrics (default true)
+``metrics.token``    bearer token required by /metrics
+``metrics.allow``    client addresses allowed without a token (default loopback)
+"""
+import bisect
+import threading
+import time
+
+from pyramid.settings import asbool
+from sqlalchemy import event
+
+from .logs import logging_stats
+from .pooling import WAIT_BUCKETS_MS, engines
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+# Label for requests no route matched (404s, CORS preflight)
+UNMATCHED = '(unmatched)'
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class RouteStats(object):
+    """Counters for one route, written by one thread"""
+
+    __slots__ = ('statuses', 'latency', 'latency_sum', 'sql_counts', 'sql_statements',
+                 'sql_seconds', 'bytes_out')
+
+    def __init__(self):
+        self.statuses = [0] * len(STATUS_CLASSES)
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.sql_counts = [0] * (len(SQL_COUNT_BUCKETS) + 1)
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.bytes_out = 0
+
+    def merge(self, other):
+        for name in ('statuses', 'latency', 'sql_counts'):
+            mine = getattr(self, name)
+            for index, value in enumerate(getattr(other, name)):
+                mine[index] += value
+        self.latency_sum += other.latency_sum
+        self.sql_statements += other.sql_statements
+        self.sql_seconds += other.sql_seconds
+        self.bytes_out += other.bytes_out
+
+
+class Metrics(object):
+    """Per-thread route buckets plus the SQL timing of the request in progress"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._stores = []
+        self._lock = threading.Lock()
+
+    def _routes(self):
+        routes = getattr(self._local, 'routes', None)
+        if routes is None:
+            routes = self._local.routes = {}
+            with self._lock:
+                self._stores.append(routes)
+        return routes
+
+    def begin(self):
+        local = self._local
+        local.active = True
+        local.sql_statements = 0
+        local.sql_seconds = 0.0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.sql_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        local = self._local
+        if getattr(local, 'active', False):
+            local.sql_statements += 1
+            local.sql_seconds += time.perf_counter() - local.sql_started
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def observe(self, route, status, seconds, bytes_out):
+        """Record the request that ``begin`` started on this thread"""
+        local = self._local
+        local.active = False
+        routes = self._routes()
+        stats = routes.get(route)
+        if stats is None:
+            stats = routes[route] = RouteStats()
+        statements = local.sql_statements
+        stats.statuses[min(max(status // 100, 1), 5) - 1] += 1
+        # bisect_left: a value equal to a bound belongs to that bound's bucket (le=)
+        stats.latency[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.latency_sum += seconds
+        stats.sql_counts[bisect.bisect_left(SQL_COUNT_BUCKETS, statements)] += 1
+        stats.sql_statements += statements
+        stats.sql_seconds += local.sql_seconds
+        stats.bytes_out += bytes_out or 0
+
+    def snapshot(self):
+        """``{route: RouteStats}`` summed over all threads"""
+        with self._lock:
+            stores = list(self._stores)
+        totals = {}
+        for routes in stores:
+            for route, stats in list(routes.items()):
+                total = totals.get(route)
+                if total is None:
+                    total = totals[route] = RouteStats()
+                total.merge(stats)
+        return totals
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Writer(object):
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help_text):
+        self.lines.append('# HELP %s %s' % (name, help_text))
+        self.lines.append('# TYPE %s %s' % (name, kind))
+
+    def sample(self, name, labels, value):
+        if labels:
+            name = '%s{%s}' % (name, ','.join('%s="%s"' % (key, _label(val)) for key, val in labels))
+        self.lines.append('%s %s' % (name, repr(float(value)) if isinstance(value, float) else value))
+
+    def histogram(self, name, labels, bounds, counts, total):
+        cumulative = 0
+        for bound, count in zip(list(bounds) + ['+Inf'], counts):
+            cumulative += count
+            self.sample(name + '_bucket', labels + (('le', bound),), cumulative)
+        self.sample(name + '_sum', labels, total)
+        self.sample(name + '_count', labels, cumulative)
+
+
+def render(registry):
+    """The Prometheus exposition text for this process"""
+    out = _Writer()
+    routes = sorted(registry['metrics'].snapshot().items())
+
+    out.metric('aturmation_http_requests_total', 'counter', 'Requests by route and status class.')
+    for route, stats in routes:
+        for status, count in zip(STATUS_CLASSES, stats.statuses):
+            if count:
+                out.sample('aturmation_http_requests_total', (('route', route), ('status', status)), count)
+    out.metric('aturmation_http_request_duration_seconds', 'histogram', 'Request latency by route.')
+    for route, stats in routes:
+        out.histogram('aturmation_http_request_duration_seconds', (('route', route),),
+                      LATENCY_BUCKETS, stats.latency, stats.latency_sum)
+    out.metric('aturmation_http_response_bytes_total', 'counter', 'Response bytes with a known length.')
+    for route, stats in routes:
+        out.sample('aturmation_http_response_bytes_total', (('route', route),), stats.bytes_out)
+    out.metric('aturmation_sql_statements_per_request', 'histogram', 'SQL statements run per request.')
+    for route, stats in routes:
+        out.histogram('aturmation_sql_statements_per_request', (('route', route),),
+                      SQL_COUNT_BUCKETS, stats.sql_counts, stats.sql_statements)
+    out.metric('aturmation_sql_seconds_total', 'counter', 'Time spent executing SQL by route.')
+    for route, stats in routes:
+        out.sample('aturmation_sql_seconds_total', (('route', route),), stats.sql_seconds)
+
+    pools = [(name, getattr(engine.pool, 'monitor', None), engine.pool) for name, engine in engines(registry)]
+    pools = [(name, monitor.stats(pool)) for name, monitor, pool in pools if monitor is not None]
+    for key, kind, help_text in (
+        ('checked_out', 'gauge', 'Connections checked out of the pool.'),
+        ('idle', 'gauge', 'Idle connections in the pool.'),
+        ('overflow', 'gauge', 'Connections beyond pool_size.'),
+        ('timeouts', 'counter', 'Checkouts that timed out.'),
+    ):
+        name = 'aturmation_db_pool_%s' % key + ('_total' if kind == 'counter' else '')
+        out.metric(name, kind, help_text)
+        for engine, stats in pools:
+            out.sample(name, (('engine', engine),), stats[key])
+    out.metric('aturmation_db_pool_checkout_wait_seconds', 'histogram', 'Time waited for a pooled connection.')
+    for engine, stats in pools:
+        wait = stats['wait_ms']
+        out.histogram('aturmation_db_pool_checkout_wait_seconds', (('engine', engine),),
+                      [bound / 1000.0 for bound in WAIT_BUCKETS_MS], list(wait['buckets'].values()),
+                      wait['total'] / 1000.0)
+
+    counters = registry.get('db_counters')
+    if counters is not None:
+        out.metric('aturmation_db_events_total', 'counter', 'Sessions, checkouts, commits and rollbacks.')
+        for name, value in sorted(counters.stats().items()):
+            out.sample('aturmation_db_events_total', (('event', name),), value)
+    hasher = registry.get('password_hasher')
+    if hasher is not None:
+        out.metric('aturmation_password_hash_rejected_total', 'counter',
+                   'Hashing calls refused with 503, by reason.')
+        out.sample('aturmation_password_hash_rejected_total', (('reason', 'busy'),), hasher.rejected)
+        out.sample('aturmation_password_hash_rejected_total', (('reason', 'timeout'),), hasher.timeouts)
+    out.metric('aturmation_log_records_dropped_total', 'counter', 'Log records dropped or limited.')
+    for reason, value in sorted(logging_stats().items()):
+        if reason != 'queued':
+            out.sample('aturmation_log_records_dropped_total', (('reason', reason),), value)
+    return '\n'.join(out.lines) + '\n'
+
+
+def allowed(request):
+    """Whether ``request`` may read /metrics"""
+    settings = request.registry.settings
+    token = settings.get('metrics.token')
+    if token:
+        return request.headers.get('Authorization') == 'Bearer ' + token
+    allow = settings.get('metrics.allow', '127.0.0.1 ::1').split()
+    return request.remote_addr in allow
+
+
+def includeme(config):
+    settings = config.get_settings()
+    if not asbool(settings.get('metrics.enabled', True)):
+        config.registry['metrics'] = None
+        return
+    metrics = config.registry['metrics'] = Metrics()
+    for name, engine in engines(config.registry):
+        metrics.instrument_engine(engine)
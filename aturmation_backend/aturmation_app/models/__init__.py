@@ -3,10 +3,14 @@ from sqlalchemy import engine_from_config
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import configure_mappers
 
+from ..pooling import pool_options
+
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
 from .user import User  # flake8: noqa
 from .product import Product  # flake8: noqa
+from .stock_movement import StockMovement  # flake8: noqa
+from .revoked_token import RevokedToken  # flake8: noqa
 
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
@@ -14,7 +18,11 @@ configure_mappers()
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
-    return engine_from_config(settings, prefix)
+    # sqlalchemy.replica.* belongs to the read replicas, see aturmation_app.replicas
+    replica_prefix = prefix + 'replica.'
+    settings = {key: value for key, value in settings.items() if not key.startswith(replica_prefix)}
+    configured = {key[len(prefix):] for key in settings if key.startswith(prefix)}
+    return engine_from_config(settings, prefix, **pool_options(settings, settings[prefix + 'url'], configured))
 
 
 def get_session_factory(engine):
@@ -23,6 +31,11 @@ def get_session_factory(engine):
     return factory
 
 
+def get_open_dbsession(request):
+    """``request.dbsession`` if the request already opened it, else None"""
+    return request.__dict__.get('dbsession')
+
+
 def includeme(config):
     """
     Initialize the model for a Pyramid app.
@@ -33,13 +46,25 @@ def includeme(config):
     settings = config.get_settings()
 
     # create session factory and register it
-    session_factory = get_session_factory(get_engine(settings))
+    engine = get_engine(settings)
+    session_factory = get_session_factory(engine)
+    config.registry['dbengine'] = engine
     config.registry['dbsession_factory'] = session_factory
 
-    # make request.dbsession available for use in Pyramid views
-    config.add_request_method(
-        # Simple session factory without transaction manager
-        lambda r: session_factory(),
-        'dbsession',
-        reify=True
-    )
\ No newline at end of file
+    # pick the product search backend matching the database dialect, or
+    # ILIKE when its DDL was never installed
+    from ..search import VerifiedSearchBackend
+    config.registry['search_backend'] = VerifiedSearchBackend(engine)
+
+    # make request.dbsession available for use in Pyramid views; the session
+    # is only created when a view first touches it (see tweens.db_session_tween)
+    from ..dbstats import count
+
+    def dbsession(request):
+        count('sessions', request)
+        replicas = request.registry.get('db_replicas')
+        if replicas is not None:
+            return replicas.session_for(request, session_factory)
+        return session_factory()
+
+    config.add_request_method(dbsession, 'dbsession', reify=True)
\ No newline at end of file
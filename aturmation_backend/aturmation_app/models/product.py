@@ -6,6 +6,7 @@ from sqlalchemy import (
     Text,
     Float,
     DateTime,
+    Index,
     func
 )
 from sqlalchemy.ext.declarative import declarative_base
@@ -15,6 +16,15 @@ from .meta import Base
 
 class Product(Base):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Matches the (created_at DESC, id DESC) keyset used for cursor pagination
+        Index('ix_products_created_at_id', 'created_at', 'id'),
+        # Top-N lists on the dashboard (lowest stock, highest price)
+        Index('ix_products_stock', 'stock'),
+        Index('ix_products_price', 'price'),
+        # max(updated_at) validator for conditional GETs on the list
+        Index('ix_products_updated_at', 'updated_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
@@ -22,18 +32,30 @@ class Product(Base):
     description = Column(Text, nullable=True)
     price = Column(Float, nullable=False)
     stock = Column(Integer, nullable=False, default=0)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Python-side timestamps keep full precision on every backend (SQLite's
+    # CURRENT_TIMESTAMP drops microseconds), so keyset cursors compare exactly;
+    # naive UTC, as CURRENT_TIMESTAMP was
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
-    def to_dict(self):
-        """Convert product to dictionary for JSON serialization"""
-        return {
-            'id': self.id,
-            'name': self.name,
-            'sku': self.sku,
-            'description': self.description,
-            'price': float(self.price) if self.price is not None else None,  # Pastikan float
-            'stock': self.stock,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+    # Fields clients may request through ``fields=``, in output order
+    FIELDS = ('id', 'name', 'sku', 'description', 'price', 'stock', 'created_at', 'updated_at')
+    
+    def to_dict(self, fields=None):
+        """
+        Convert product to dictionary for JSON serialization.
+        
+        ``fields`` limits the output to those attributes; only they are
+        touched, so columns deferred with ``load_only`` stay unloaded.
+        """
+        if fields is None:
+            fields = self.FIELDS
+        data = {}
+        for field in fields:
+            value = getattr(self, field)
+            if field == 'price':
+                value = float(value) if value is not None else None  # Pastikan float
+            elif field in ('created_at', 'updated_at'):
+                value = value.isoformat() if value else None
+            data[field] = value
+        return data
@@ -0,0 +1,22 @@
+# aturmation_app/models/revoked_token.py
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+)
+import datetime
+
+from .meta import Base
+
+
+class RevokedToken(Base):
+    """JWT ids revoked before their expiry (logout, forced sign-out)"""
+    __tablename__ = 'revoked_tokens'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    jti = Column(String(64), nullable=False, unique=True)
+    user_id = Column(Integer, nullable=True)
+    # UTC, copied from the token's exp; rows past it can be purged
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False, index=True)
@@ -0,0 +1,33 @@
+# aturmation_app/models/stock_movement.py
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+    ForeignKey,
+    Index,
+)
+import datetime
+
+from .meta import Base
+
+
+class StockMovement(Base):
+    """Append-only ledger: one row per stock change of a product"""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        # History of one product, newest first
+        Index('ix_stock_movements_product_id_id', 'product_id', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    delta = Column(Integer, nullable=False)
+    # Stock right after this movement was applied
+    stock_after = Column(Integer, nullable=False)
+    reason = Column(String(50), nullable=False)
+    reference = Column(String(100), nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    FIELDS = ('id', 'product_id', 'delta', 'stock_after', 'reason', 'reference', 'created_by', 'created_at')
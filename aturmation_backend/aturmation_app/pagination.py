@@ -0,0 +1,57 @@
+# aturmation_app/pagination.py
+import base64
+import datetime
+import json
+
+from sqlalchemy import desc, tuple_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) position as an opaque, URL-safe cursor"""
+    payload = json.dumps(
+        [created_at.isoformat() if created_at else None, row_id],
+        separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by ``encode_cursor`` back to (created_at, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if created_at is None or not isinstance(row_id, int):
+            raise InvalidCursor(cursor)
+        return datetime.datetime.fromisoformat(created_at), row_id
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def keyset_order(query, model):
+    """Order newest first with ``id`` as tie-breaker, matching ix_products_created_at_id"""
+    return query.order_by(desc(model.created_at), desc(model.id))
+
+
+def keyset_seek(query, model, cursor):
+    """Restrict ``query`` to rows strictly after the position in ``cursor``"""
+    created_at, row_id = decode_cursor(cursor)
+    return query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+
+
+def next_cursor_for(rows, per_page):
+    """
+    Build the cursor for the page after ``rows``.
+
+    ``rows`` is expected to be fetched with ``limit(per_page + 1)`` so the
+    extra row tells us whether another page exists without counting.
+    """
+    if len(rows) <= per_page:
+        return None
+    last = rows[per_page - 1]
+    return encode_cursor(last.created_at, last.id)
@@ -0,0 +1,224 @@
+# aturmation_app/pooling.py
+"""
+Connection pool sizing, pre-warming and instrumentation.
+
+Unless set explicitly with ``sqlalchemy.pool_size`` / ``max_overflow`` /
+``pool_timeout`` / ``pool_pre_ping``, queue pools are sized from the number
+of server threads: one pooled connection per waitress thread, plus overflow
+for work off the request threads (background rehash, revocation refresh,
+health checks).
+
+Every queue pool records how long checkouts waited (including the connect
+for a new connection), how many connections are in use and how far into
+overflow the pool went. SQLAlchemy has no event before a checkout, so the
+wait is timed in a thin pool subclass; the rest comes from pool events.
+
+Settings:
+
+``db.pool.threads``   override of the thread count, which by default is ``threads``
+                      of the ``[server:main]`` section the app was loaded from (else 4)
+``db.pool.prewarm``   connections opened per engine at startup (default 0)
+"""
+import bisect
+import logging
+import threading
+import time
+
+import plaster
+from sqlalchemy import event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+log = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 4
+# Upper bounds (ms) of the checkout wait histogram; the last bucket is open
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMonitor(object):
+    """Checkout wait, in-use and overflow numbers for one engine's pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.peak_overflow = 0
+
+    def record_wait(self, seconds, overflow):
+        milliseconds = seconds * 1000.0
+        with self._lock:
+            self.peak_overflow = max(self.peak_overflow, overflow)
+            self.wait_total += milliseconds
+            self.wait_max = max(self.wait_max, milliseconds)
+            self.wait_counts[bisect.bisect_left(WAIT_BUCKETS_MS, milliseconds)] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def attach(self, pool_class):
+        """Listen to the events of every pool of ``pool_class``"""
+        event.listen(pool_class, 'connect', self._on_connect)
+        event.listen(pool_class, 'checkout', self._on_checkout)
+        event.listen(pool_class, 'checkin', self._on_checkin)
+        event.listen(pool_class, 'invalidate', self._on_invalidate)
+
+    def stats(self, pool=None):
+        with self._lock:
+            stats = {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'timeouts': self.timeouts,
+                'invalidated': self.invalidated,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'peak_overflow': max(0, self.peak_overflow),
+                'wait_ms': {
+                    'total': round(self.wait_total, 3),
+                    'max': round(self.wait_max, 3),
+                    'avg': round(self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                    'buckets': dict(zip(
+                        [str(bound) for bound in WAIT_BUCKETS_MS] + ['+Inf'], self.wait_counts
+                    )),
+                },
+            }
+        if pool is not None:
+            stats.update({
+                'pool_size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(0, pool.overflow()),
+            })
+        return stats
+
+
+def instrumented_pool_class(base, monitor):
+    """``base`` (a QueuePool) timing every checkout into ``monitor``"""
+
+    class InstrumentedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super(InstrumentedPool, self)._do_get()
+            except sa_exc.TimeoutError:
+                monitor.record_timeout()
+                raise
+            monitor.record_wait(time.perf_counter() - started, self.overflow())
+            return connection
+
+    InstrumentedPool.__name__ = 'Instrumented' + base.__name__
+    InstrumentedPool.monitor = monitor
+    monitor.attach(InstrumentedPool)
+    return InstrumentedPool
+
+
+def server_threads(global_config):
+    """
+    Request threads of the server the app runs under: ``threads`` from the
+    PasteDeploy defaults, else from the ``[server:main]`` section of the
+    .ini in ``global_config['__file__']``. None when neither says.
+    """
+    global_config = global_config or {}
+    threads = global_config.get('threads')
+    if threads is None and global_config.get('__file__'):
+        try:
+            threads = plaster.get_settings(global_config['__file__'], 'server:main').get('threads')
+        except Exception as e:
+            log.warning("Cannot read [server:main] threads from %s: %s", global_config['__file__'], e)
+    try:
+        return int(threads) if threads is not None else None
+    except ValueError:
+        log.warning("Ignoring non-numeric server threads %r", threads)
+        return None
+
+
+def pool_options(settings, url, configured):
+    """
+    Extra ``create_engine`` arguments for ``url``: thread-derived sizing for
+    options not in ``configured`` and an instrumented pool class.
+
+    Returns ``{}`` for dialects without a queue pool (e.g. SQLite ``:memory:``).
+    """
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url)
+    if not issubclass(pool_class, QueuePool):
+        return {}
+    threads = int(settings.get('db.pool.threads', DEFAULT_THREADS))
+    options = {
+        'pool_size': threads,
+        'max_overflow': max(2, threads // 2),
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+    }
+    options = {key: value for key, value in options.items() if key not in configured}
+    options['poolclass'] = instrumented_pool_class(pool_class, PoolMonitor())
+    return options
+
+
+def pool_stats(engine):
+    """Live numbers for ``engine``'s pool; None unless built with ``pool_options``"""
+    monitor = getattr(engine.pool, 'monitor', None)
+    return monitor.stats(engine.pool) if monitor is not None else None
+
+
+def prewarm(engine, count):
+    """Open ``count`` connections now and leave them idle in the pool"""
+    if count <= 0:
+        return 0
+    started = time.perf_counter()
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    except Exception as e:
+        log.error(f"Pool prewarm stopped after {len(connections)} connections: {e}")
+    finally:
+        for connection in connections:
+            connection.close()
+    log.info("Prewarmed %d connections for %s in %.1f ms", len(connections),
+             engine.url.render_as_string(hide_password=True), (time.perf_counter() - started) * 1000.0)
+    return len(connections)
+
+
+def engines(registry):
+    """``(name, engine)`` for the primary and every replica"""
+    result = [('primary', registry['dbengine'])]
+    replicas = registry.get('db_replicas')
+    if replicas is not None:
+        result.extend((replica.name, replica.engine) for replica in replicas.replicas)
+    return result
+
+
+def includeme(config):
+    settings = config.get_settings()
+    count = int(settings.get('db.pool.prewarm', 0))
+    for name, engine in engines(config.registry):
+        prewarm(engine, count)
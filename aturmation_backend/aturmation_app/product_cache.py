@@ -0,0 +1,310 @@
+# aturmation_app/product_cache.py
+"""
+Read-through cache for single products (``GET /api/v1/products/{id}``).
+
+Entries are the full ``Product.to_dict()`` keyed by id. Lookups go to the
+in-process ``LRUCache`` first, then to the optional shared backend, then
+to the database. Writes schedule invalidation with
+``invalidate_product_caches(request, product_ids)``; ``db_session_tween``
+applies it only after the transaction committed.
+
+The shared store keeps a version per product (plus one epoch for "drop
+everything"). Invalidation bumps the version; a reader stores what it
+loaded only if the version is still the one it saw before loading, so a
+reader racing a write cannot put the old row back. Within one request a
+product is looked up once (conditional GET validators, then the view),
+misses included.
+
+Settings:
+
+``products.cache.enabled``      default true
+``products.cache.max_entries``  in-process LRU size (default 4096)
+``products.cache.ttl``          seconds an entry may live (default 60)
+``products.cache.redis_url``    optional Redis(-compatible) server shared by
+                                all workers; needs the ``redis`` package
+``products.cache.shared_path``  optional SQLite file shared by the workers
+                                of one host (no server needed); use instead
+                                of ``redis_url``
+``products.cache.local_ttl``    in-process TTL when a shared backend is set
+                                (default 1): other workers' invalidations
+                                only reach the shared store
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from pyramid.exceptions import ConfigurationError
+from pyramid.settings import asbool
+
+from .cache import LRUCache
+from .queries import fetch_product
+
+log = logging.getLogger(__name__)
+
+
+# Store ARGV[2] under KEYS[1] only if the product version and epoch are unchanged
+SET_IF_VERSION = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] and (redis.call('GET', KEYS[3]) or '0') == ARGV[2] then
+    return redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[4])
+end
+return false
+"""
+# Versions must outlive any reader that saw them
+VERSION_TTL = 86400
+
+
+class RedisBackend(object):
+    """Shared store on a Redis-compatible server, values as JSON"""
+
+    def __init__(self, url, ttl, prefix='aturmation:product:'):
+        try:
+            import redis
+        except ImportError:
+            raise ConfigurationError('products.cache.redis_url needs the "redis" package')
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.epoch_key = prefix.rstrip(':') + '-epoch'
+        self._set_if_version = self.client.register_script(SET_IF_VERSION)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.stale_sets = 0
+
+    def _key(self, product_id):
+        return '%s%s' % (self.prefix, product_id)
+
+    def _version_key(self, product_id):
+        return '%s-version:%s' % (self.prefix.rstrip(':'), product_id)
+
+    def get(self, product_id):
+        """``(value_or_None, version)``; version is None when the server is unavailable"""
+        try:
+            raw, version, epoch = self.client.mget(
+                self._key(product_id), self._version_key(product_id), self.epoch_key)
+        except Exception as e:
+            self.errors += 1
+            log.warning(f"Shared product cache unavailable: {e}")
+            return None, None
+        version = (int(version or 0), int(epoch or 0))
+        if raw is None:
+            self.misses += 1
+            return None, version
+        self.hits += 1
+        return json.loads(raw), version
+
+    def set(self, product_id, value, version):
+        """Store ``value`` unless the product was invalidated since ``get`` returned ``version``"""
+        try:
+            stored = self._set_if_version(
+                keys=[self._key(product_id), self._version_key(product_id), self.epoch_key],
+                args=[version[0], version[1], json.dumps(value), max(1, int(self.ttl))])
+        except Exception as e:
+            self.errors += 1
+            log.warning(f"Shared product cache unavailable: {e}")
+            return
+        if not stored:
+            self.stale_sets += 1
+
+    def delete(self, product_ids):
+        pipe = self.client.pipeline()
+        for product_id in product_ids:
+            pipe.incr(self._version_key(product_id))
+            pipe.expire(self._version_key(product_id), VERSION_TTL)
+            pipe.delete(self._key(product_id))
+        pipe.execute()
+
+    def clear(self):
+        self.client.incr(self.epoch_key)
+        keys = list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                'stale_sets': self.stale_sets}
+
+
+class SQLiteBackend(object):
+    """Shared store in a local SQLite file (WAL), same contract as ``RedisBackend``"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS entries (id TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+    )
+    GET = (
+        "SELECT (SELECT value FROM entries WHERE id = ? AND expires > ?),"
+        " (SELECT version FROM versions WHERE key = ?),"
+        " (SELECT version FROM versions WHERE key = 'epoch')"
+    )
+    # Atomic check-and-set, like SET_IF_VERSION
+    SET_IF_VERSION = (
+        "INSERT OR REPLACE INTO entries (id, value, expires) SELECT ?, ?, ?"
+        " WHERE COALESCE((SELECT version FROM versions WHERE key = ?), 0) = ?"
+        " AND COALESCE((SELECT version FROM versions WHERE key = 'epoch'), 0) = ?"
+    )
+    BUMP = (
+        "INSERT INTO versions (key, version) VALUES (?, 1)"
+        " ON CONFLICT (key) DO UPDATE SET version = version + 1"
+    )
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.stale_sets = 0
+        connection = self._connection()
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+
+    def _connection(self):
+        # sqlite3 connections stay on the thread that opened them
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=0.25, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def get(self, product_id):
+        """``(value_or_None, version)``; version is None when the file is unavailable"""
+        key = str(product_id)
+        try:
+            raw, version, epoch = self._connection().execute(
+                self.GET, (key, time.time(), 'product:' + key)).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning(f"Shared product cache unavailable: {e}")
+            return None, None
+        version = (version or 0, epoch or 0)
+        if raw is None:
+            self.misses += 1
+            return None, version
+        self.hits += 1
+        return json.loads(raw), version
+
+    def set(self, product_id, value, version):
+        """Store ``value`` unless the product was invalidated since ``get`` returned ``version``"""
+        key = str(product_id)
+        try:
+            stored = self._connection().execute(
+                self.SET_IF_VERSION,
+                (key, json.dumps(value), time.time() + self.ttl, 'product:' + key,
+                 version[0], version[1])).rowcount
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning(f"Shared product cache unavailable: {e}")
+            return
+        if not stored:
+            self.stale_sets += 1
+
+    def delete(self, product_ids):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for product_id in product_ids:
+                connection.execute(self.BUMP, ('product:%s' % product_id,))
+                connection.execute('DELETE FROM entries WHERE id = ?', (str(product_id),))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(self.BUMP, ('epoch',))
+            connection.execute('DELETE FROM entries')
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                'stale_sets': self.stale_sets}
+
+
+class ProductCache(object):
+    """In-process LRU in front of an optional shared backend"""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def load(self, product_id, loader):
+        """Return the cached product dict, calling ``loader()`` on a miss"""
+        value = self.local.get(product_id)
+        if value is not None:
+            return value
+        generation = self.local.generation
+        version = None
+        if self.shared is not None:
+            value, version = self.shared.get(product_id)
+        if value is None:
+            value = loader()
+            if value is None:
+                return None
+            if version is not None:
+                self.shared.set(product_id, value, version)
+        self.local.set(product_id, value, generation)
+        return value
+
+    def invalidate(self, product_ids=None):
+        """Drop ``product_ids`` (every product when None) from both tiers"""
+        if product_ids is None:
+            self.local.invalidate()
+        else:
+            self.local.delete(*product_ids)
+        if self.shared is None:
+            return
+        try:
+            if product_ids is None:
+                self.shared.clear()
+            else:
+                self.shared.delete(product_ids)
+        except Exception as e:
+            log.error(f"Failed to invalidate shared product cache: {e}")
+
+    def stats(self):
+        stats = self.local.stats()
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
+
+
+def load_product(request, product_id):
+    """
+    Product dict for ``product_id`` through the cache, or None if missing.
+
+    The answer is kept on the request, so the detail view does not repeat
+    the lookup (or the SELECT of a missing id) its validators just made.
+    """
+    lookups = request.__dict__.setdefault('product_lookups', {})
+    if product_id not in lookups:
+        def loader():
+            return fetch_product(request.dbsession.connection(), product_id)
+        lookups[product_id] = request.registry['product_cache'].load(product_id, loader)
+    return lookups[product_id]
+
+
+def includeme(config):
+    settings = config.get_settings()
+    if not asbool(settings.get('products.cache.enabled', True)):
+        config.registry['product_cache'] = None
+        return
+    ttl = float(settings.get('products.cache.ttl', 60))
+    shared = None
+    redis_url = settings.get('products.cache.redis_url')
+    shared_path = settings.get('products.cache.shared_path')
+    if redis_url and shared_path:
+        raise ConfigurationError('Set products.cache.redis_url or products.cache.shared_path, not both')
+    if redis_url:
+        shared = RedisBackend(redis_url, ttl)
+    elif shared_path:
+        shared = SQLiteBackend(shared_path, ttl)
+    if shared is not None:
+        ttl = float(settings.get('products.cache.local_ttl', 1))
+    config.registry['product_cache'] = ProductCache(
+        LRUCache(max_entries=int(settings.get('products.cache.max_entries', 4096)), ttl=ttl),
+        shared
+    )
@@ -0,0 +1,230 @@
+# aturmation_app/profiling.py
+"""
+Profiling in production: one request on demand, or all threads by sampling.
+
+On demand: with ``profiling.enabled``, a request that carries
+``X-Profile: <profiling.token>`` runs under cProfile and the result is
+stored in ``profiling.dir`` as ``request-<time>-<route>-<id>.prof`` (pstats,
+for ``python -m pstats``/snakeviz) plus a ``.txt`` of the top functions by
+cumulative time. The response names the files in ``X-Profile-Id``. One
+request is profiled at a time; others asking meanwhile get
+``X-Profile-Id: busy`` and run normally.
+
+Sampling: with ``profiling.sampler.enabled``, a daemon thread takes a
+``sys._current_frames()`` snapshot every ``interval`` seconds, keeps the
+stacks of threads that are serving a request, and every ``flush`` seconds
+writes the counts as ``samples-<pid>-<time>.collapsed``: one
+``frame;frame;frame count`` line per stack, the input of flamegraph.pl and
+speedscope.
+
+Settings:
+
+``profiling.enabled``           honour X-Profile (default false)
+``profiling.token``             value X-Profile must carry (required when enabled)
+``profiling.dir``               output directory (default ./profiles)
+``profiling.keep``              request profiles kept, oldest deleted first (default 50)
+``profiling.sampler.enabled``   run the sampling profiler (default false)
+``profiling.sampler.interval``  seconds between snapshots (default 0.01)
+``profiling.sampler.flush``     seconds per .collapsed file (default 60)
+``profiling.sampler.idle``      also keep stacks of idle threads (default false)
+"""
+import atexit
+import collections
+import cProfile
+import glob
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+from pyramid.settings import asbool
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+TOP_FUNCTIONS = 40
+# A thread is serving a request while the Pyramid router is on its stack
+_ROUTER_FILE = os.path.join('pyramid', 'router.py')
+
+
+def _safe(value):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', value)[:64]
+
+
+class RequestProfiler(object):
+    """cProfile for single requests that present the token"""
+
+    def __init__(self, token, directory, keep=50):
+        self.token = token.encode('utf-8')
+        self.directory = directory
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def wanted(self, request):
+        value = request.headers.get(PROFILE_HEADER)
+        return value is not None and hmac.compare_digest(value.encode('utf-8'), self.token)
+
+    def run(self, handler, request):
+        if not self._busy.acquire(blocking=False):
+            response = handler(request)
+            response.headers['X-Profile-Id'] = 'busy'
+            return response
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler (e.g. a debugger) owns the hook
+                log.warning("Cannot profile request: %s", e)
+                return handler(request)
+            try:
+                response = handler(request)
+            finally:
+                profile.disable()
+            name = self.save(profile, request)
+            if name is not None:
+                response.headers['X-Profile-Id'] = name
+            return response
+        finally:
+            self._busy.release()
+
+    def save(self, profile, request):
+        route = getattr(request, 'matched_route', None)
+        name = 'request-%s-%s-%s' % (
+            time.strftime('%Y%m%dT%H%M%S'),
+            _safe(route.name if route is not None else request.path),
+            _safe(request.request_id)[:12],
+        )
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(path + '.prof')
+            text = io.StringIO()
+            stats = pstats.Stats(profile, stream=text)
+            text.write('%s %s\n\n' % (request.method, request.path_qs))
+            stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            with open(path + '.txt', 'w') as f:
+                f.write(text.getvalue())
+            self.prune()
+        except Exception as e:
+            log.error(f"Failed to store request profile {path}: {e}")
+            return None
+        log.info("Stored request profile %s", path + '.prof')
+        return name
+
+    def prune(self):
+        profiles = sorted(glob.glob(os.path.join(self.directory, 'request-*.prof')), key=os.path.getmtime)
+        for path in profiles[:max(0, len(profiles) - self.keep)]:
+            for stale in (path, path[:-len('.prof')] + '.txt'):
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+
+class SamplingProfiler(object):
+    """Periodic stack snapshots of the request threads, folded into collapsed stacks"""
+
+    def __init__(self, directory, interval=0.01, flush=60.0, idle=False):
+        self.directory = directory
+        self.interval = interval
+        self.flush_every = flush
+        self.idle = idle
+        self.samples = 0
+        self._counts = collections.Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            module = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+            label = self._labels[code] = ('%s:%s:%d' % (module, code.co_name, code.co_firstlineno)) \
+                .replace(';', '_').replace(' ', '_')
+        return label
+
+    def sample(self):
+        """Take one snapshot of every other thread"""
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if not self.idle and not any(code.co_filename.endswith(_ROUTER_FILE) for code in codes):
+                continue
+            self._counts[';'.join(self._label(code) for code in reversed(codes))] += 1
+            self.samples += 1
+
+    def flush(self):
+        counts, self._counts = self._counts, collections.Counter()
+        if not counts:
+            return None
+        path = os.path.join(self.directory, 'samples-%d-%s.collapsed' % (
+            os.getpid(), time.strftime('%Y%m%dT%H%M%S')))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'w') as f:
+                for stack, count in counts.most_common():
+                    f.write('%s %d\n' % (stack, count))
+        except Exception as e:
+            log.error(f"Failed to write profile samples {path}: {e}")
+            return None
+        return path
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_every
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                log.error(f"Sampling profiler error: {e}")
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_every
+        self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+def includeme(config):
+    settings = config.get_settings()
+    directory = os.path.abspath(settings.get('profiling.dir', 'profiles'))
+
+    profiler = None
+    if asbool(settings.get('profiling.enabled', False)):
+        token = settings.get('profiling.token')
+        if not token:
+            raise ValueError('profiling.token must be set when profiling.enabled is true')
+        profiler = RequestProfiler(token, directory, int(settings.get('profiling.keep', 50)))
+    config.registry['request_profiler'] = profiler
+
+    sampler = None
+    if asbool(settings.get('profiling.sampler.enabled', False)):
+        sampler = SamplingProfiler(
+            directory,
+            interval=float(settings.get('profiling.sampler.interval', 0.01)),
+            flush=float(settings.get('profiling.sampler.flush', 60)),
+            idle=asbool(settings.get('profiling.sampler.idle', False)),
+        )
+        sampler.start()
+        log.info("Sampling profiler writing to %s every %ss", directory, sampler.flush_every)
+    config.registry['sampling_profiler'] = sampler
@@ -0,0 +1,46 @@
+# aturmation_app/queries.py
+"""
+Read-only product queries on SQLAlchemy Core.
+
+The listing and detail GETs select just the columns they need and run the
+statement on the session's connection, so no ``Product`` instance is built,
+nothing enters the identity map and no attribute instrumentation runs. Rows
+come back as SQLAlchemy ``Row`` objects (slotted, named tuples) that
+``RowList`` encodes directly.
+"""
+from sqlalchemy import func, select
+
+from .models import Product
+from .renderers import RowList
+
+products = Product.__table__
+
+
+def product_columns(fields=None, *required):
+    """Columns for ``fields`` in order, followed by any missing ``required`` ones"""
+    names = list(fields or Product.FIELDS)
+    names.extend(name for name in required if name not in names)
+    return [products.c[name] for name in names]
+
+
+def select_products(fields=None, *required):
+    """``SELECT <fields> FROM products``; filters and ordering are added by the caller"""
+    return select(*product_columns(fields, *required))
+
+
+def count_rows(connection, statement):
+    """Exact row count of ``statement`` without its ordering and paging"""
+    statement = statement.limit(None).offset(None).order_by(None)
+    return connection.execute(
+        select(func.count()).select_from(statement.subquery())
+    ).scalar()
+
+
+def fetch_product(connection, product_id, fields=None):
+    """One product as a JSON-ready dict (``Product.to_dict`` shape) or None"""
+    row = connection.execute(
+        select_products(fields).where(products.c.id == product_id)
+    ).first()
+    if row is None:
+        return None
+    return RowList(Product, fields or Product.FIELDS, [row]).to_dicts()[0]
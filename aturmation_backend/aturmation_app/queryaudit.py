@@ -0,0 +1,259 @@
+# aturmation_app/queryaudit.py
+"""
+Per-request SQL analysis: repeated queries, slow statements, query budgets.
+
+Every statement a request runs is counted by fingerprint (the SQL with
+literals and parameters replaced by ``?``, see ``tracing.fingerprint``) in
+``request.query_audit``. When the request ends, the DB session tween calls
+``QueryAuditor.check``, which logs:
+
+* N+1 suspects: one fingerprint run ``repeat_threshold`` times or more
+  (a loop issuing the same query per row),
+* duplicates: the same statement with the same parameters run twice
+  (parameters are compared by hash; executemany batches are skipped),
+* requests over their route's query budget.
+
+Chunked bulk work (imports, batch retries) repeats its statements by
+design; code doing it runs them inside ``bulk(connection)`` so they count
+towards the budget but are neither N+1 suspects nor duplicates.
+
+Statements slower than ``slow_ms`` are logged as they finish, with the
+database's plan for SELECTs (``EXPLAIN``; SQLite ``EXPLAIN QUERY PLAN``),
+at most once per fingerprint per ``explain_interval`` seconds.
+
+With ``db.audit.strict`` (meant for the test suite), N+1 suspects and
+budget overruns raise ``QueryBudgetExceeded`` instead, so the request and
+the test using it fail.
+
+Settings:
+
+``db.audit.enabled``            analyse queries (default true)
+``db.audit.slow_ms``            log statements at least this slow, 0 = off (default 200)
+``db.audit.explain``            add the plan to slow statement logs (default true)
+``db.audit.explain_interval``   seconds between plans of one fingerprint (default 300)
+``db.audit.repeat_threshold``   runs of one fingerprint flagged as N+1 (default 5)
+``db.audit.budgets``            ``route:max_statements`` pairs
+``db.audit.default_budget``     budget of routes not listed, 0 = none (default 0)
+``db.audit.strict``             raise instead of logging (default false)
+"""
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from pyramid.settings import asbool, aslist
+from pyramid.threadlocal import get_current_request
+from sqlalchemy import event
+
+from .pooling import engines
+from .tracing import fingerprint
+
+log = logging.getLogger(__name__)
+
+EXPLAIN_PREFIX = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+BULK_KEY = 'query_audit_bulk'
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more (or more repeated) statements than allowed in strict mode"""
+
+
+class QueryAudit(object):
+    """Statements of one request by fingerprint (``request.query_audit``)"""
+
+    __slots__ = ('total', 'seconds', 'fingerprints', 'texts', 'exact')
+
+    def __init__(self):
+        self.total = 0
+        self.seconds = 0.0
+        self.fingerprints = collections.Counter()
+        self.texts = {}
+        self.exact = collections.Counter()
+
+    def add(self, statement, parameters, seconds, executemany=False, bulk=False):
+        self.total += 1
+        self.seconds += seconds
+        if bulk:
+            return
+        text, fingerprint_id = fingerprint(statement)
+        self.fingerprints[fingerprint_id] += 1
+        self.texts[fingerprint_id] = text
+        if not executemany:
+            self.exact[(statement, _parameters_hash(parameters))] += 1
+
+    def problems(self, repeat_threshold):
+        """``(n_plus_one, duplicates)`` as lists of ``(count, sql)``"""
+        n_plus_one = [(count, self.texts[fingerprint_id])
+                      for fingerprint_id, count in self.fingerprints.most_common()
+                      if count >= repeat_threshold]
+        duplicates = [(count, fingerprint(statement)[0])
+                      for (statement, parameters), count in self.exact.most_common()
+                      if count >= 2]
+        return n_plus_one, duplicates
+
+
+def _parameters_hash(parameters):
+    try:
+        return hash(parameters)
+    except TypeError:
+        # dict (psycopg2) or list parameters
+        return hash(repr(parameters))
+
+
+@contextlib.contextmanager
+def bulk(connection):
+    """Run the enclosed statements on ``connection`` as chunked bulk work (see module doc)"""
+    previous = connection.info.get(BULK_KEY, False)
+    connection.info[BULK_KEY] = True
+    try:
+        yield connection
+    finally:
+        connection.info[BULK_KEY] = previous
+
+
+def get_query_audit(request):
+    return QueryAudit()
+
+
+class QueryAuditor(object):
+    """Settings and cursor listeners of the query analysis"""
+
+    def __init__(self, slow_ms=200.0, explain=True, explain_interval=300.0, repeat_threshold=5,
+                 budgets=None, default_budget=0, strict=False):
+        self.slow = slow_ms / 1000.0
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.repeat_threshold = repeat_threshold
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.strict = strict
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['audit_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info.pop('audit_started', time.perf_counter())
+        request = get_current_request()
+        if request is not None:
+            request.query_audit.add(statement, parameters, seconds, executemany, conn.info.get(BULK_KEY, False))
+        if self.slow and seconds >= self.slow:
+            self.log_slow(conn, statement, parameters, executemany, seconds, request)
+
+    def instrument_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _should_explain(self, fingerprint_id):
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(fingerprint_id)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained[fingerprint_id] = now
+            return True
+
+    def plan(self, conn, statement, parameters):
+        """The database's plan for ``statement`` as text, or None"""
+        prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+        if prefix is None:
+            return None
+        postgres = conn.dialect.name == 'postgresql'
+        cursor = conn.connection.cursor()
+        try:
+            # A failed EXPLAIN must not abort the request's transaction
+            if postgres:
+                cursor.execute('SAVEPOINT query_audit_explain')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception:
+                if postgres:
+                    cursor.execute('ROLLBACK TO SAVEPOINT query_audit_explain')
+                raise
+            if postgres:
+                cursor.execute('RELEASE SAVEPOINT query_audit_explain')
+        finally:
+            cursor.close()
+        return '\n'.join(' | '.join(str(value) for value in row) for row in rows)
+
+    def log_slow(self, conn, statement, parameters, executemany, seconds, request):
+        text, fingerprint_id = fingerprint(statement)
+        route = _route_name(request)
+        plan = None
+        if self.explain and not executemany and text.lstrip().upper().startswith(('SELECT', 'WITH')) \
+                and self._should_explain(fingerprint_id):
+            try:
+                plan = self.plan(conn, statement, parameters)
+            except Exception as e:
+                log.error(f"EXPLAIN failed for slow query {fingerprint_id}: {e}")
+        if plan:
+            log.warning("Slow query (%.1f ms) on %s [%s]: %s\nPlan:\n%s",
+                        seconds * 1000.0, route, fingerprint_id, text, plan)
+        else:
+            log.warning("Slow query (%.1f ms) on %s [%s]: %s", seconds * 1000.0, route, fingerprint_id, text)
+
+    def budget(self, route):
+        return self.budgets.get(route, self.default_budget)
+
+    def check(self, request):
+        """Report (or in strict mode raise for) the request's query problems"""
+        audit = request.__dict__.get('query_audit')
+        if audit is None:
+            return
+        route = _route_name(request)
+        n_plus_one, duplicates = audit.problems(self.repeat_threshold)
+        budget = self.budget(route)
+        over_budget = budget and audit.total > budget
+        for count, text in n_plus_one:
+            log.warning("Possible N+1 on %s: %d x %s", route, count, text)
+        for count, text in duplicates:
+            log.warning("Duplicate query on %s: %d x %s", route, count, text)
+        if over_budget:
+            log.warning("Query budget exceeded on %s: %d statements (budget %d)", route, audit.total, budget)
+        if self.strict and (n_plus_one or over_budget):
+            details = ['%d x %s' % item for item in n_plus_one]
+            raise QueryBudgetExceeded('%s ran %d statements (budget %s)%s' % (
+                route, audit.total, budget or 'none', ''.join('\n  ' + line for line in details)))
+
+
+def _route_name(request):
+    route = getattr(request, 'matched_route', None) if request is not None else None
+    if route is not None:
+        return route.name
+    return request.path if request is not None else '(no request)'
+
+
+def parse_budgets(value):
+    budgets = {}
+    for item in aslist(value or ''):
+        route, sep, limit = item.rpartition(':')
+        if not sep or not route:
+            raise ValueError('db.audit.budgets entries must look like route:max_statements')
+        budgets[route] = int(limit)
+    return budgets
+
+
+def includeme(config):
+    settings = config.get_settings()
+    config.add_request_method(get_query_audit, 'query_audit', reify=True)
+    if not asbool(settings.get('db.audit.enabled', True)):
+        config.registry['query_auditor'] = None
+        return
+    auditor = config.registry['query_auditor'] = QueryAuditor(
+        slow_ms=float(settings.get('db.audit.slow_ms', 200)),
+        explain=asbool(settings.get('db.audit.explain', True)),
+        explain_interval=float(settings.get('db.audit.explain_interval', 300)),
+        repeat_threshold=int(settings.get('db.audit.repeat_threshold', 5)),
+        budgets=parse_budgets(settings.get('db.audit.budgets')),
+        default_budget=int(settings.get('db.audit.default_budget', 0)),
+        strict=asbool(settings.get('db.audit.strict', False)),
+    )
+    for name, engine in engines(config.registry):
+        auditor.instrument_engine(engine)
@@ -0,0 +1,166 @@
+# aturmation_app/renderers.py
+"""
+Fast JSON renderer, registered as ``json`` in ``main()``.
+
+Views can put a ``RowList`` anywhere in their result instead of building a
+list of dicts: the rows (ORM instances or result tuples with named columns)
+are encoded straight from their attributes with per-model field encoders
+computed once per ``(model, fields)``.
+
+``orjson`` is used when installed (it also handles datetimes natively); set
+``json.accelerated = false`` to force the stdlib encoder.
+"""
+import datetime
+import decimal
+import functools
+import json
+import operator
+
+from pyramid.settings import asbool
+from sqlalchemy import Date, DateTime, Numeric
+
+from .tracing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional accelerator
+    orjson = None
+
+_encoders = {}
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def field_encoders(model, fields, native_datetimes=False):
+    """
+    Per-field conversion functions (None = pass through) for ``model``.
+
+    Mirrors the ``to_dict`` rules: numeric columns become floats and
+    dates/datetimes ISO strings. ``Float`` columns already load as floats
+    and need nothing. Cached per model, field tuple and encoder.
+    """
+    key = (model, fields, native_datetimes)
+    encoders = _encoders.get(key)
+    if encoders is None:
+        encoders = []
+        for field in fields:
+            column_type = model.__table__.c[field].type
+            if isinstance(column_type, (Date, DateTime)):
+                encoders.append(None if native_datetimes else _isoformat)
+            elif isinstance(column_type, Numeric) and column_type.asdecimal:
+                encoders.append(_float)
+            else:
+                encoders.append(None)
+        encoders = _encoders[key] = tuple(encoders)
+    return encoders
+
+
+class RowList(object):
+    """
+    Rows to be encoded as a JSON array of ``fields`` objects.
+
+    Result rows whose leading columns are ``fields`` are zipped as tuples
+    (trailing extra columns are dropped); anything else (ORM instances,
+    other rows) is read by attribute.
+    """
+
+    __slots__ = ('model', 'fields', 'rows')
+
+    def __init__(self, model, fields, rows):
+        self.model = model
+        self.fields = tuple(fields)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_dicts(self, native_datetimes=False):
+        fields = self.fields
+        encoders = field_encoders(self.model, fields, native_datetimes)
+        if not self.rows:
+            return []
+        if tuple(getattr(self.rows[0], '_fields', ())[:len(fields)]) == fields:
+            getter = tuple
+        elif len(fields) == 1:
+            getter = lambda row, get=operator.attrgetter(fields[0]): (get(row),)  # noqa: E731
+        else:
+            getter = operator.attrgetter(*fields)
+        if not any(encoders):
+            return [dict(zip(fields, getter(row))) for row in self.rows]
+        pairs = tuple(zip(fields, encoders))
+        return [
+            {field: (encode(value) if encode is not None else value)
+             for (field, encode), value in zip(pairs, getter(row))}
+            for row in self.rows
+        ]
+
+
+def _stdlib_default(value, request=None):
+    if isinstance(value, RowList):
+        return value.to_dicts()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, '__json__'):
+        return value.__json__(request)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def _orjson_default(value, request=None):
+    if isinstance(value, RowList):
+        return value.to_dicts(native_datetimes=True)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, '__json__'):
+        return value.__json__(request)
+    raise TypeError
+
+
+def stdlib_dumps(value, request=None):
+    default = functools.partial(_stdlib_default, request=request)
+    return json.dumps(value, default=default, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(value, request=None):
+    # __json__(request) like pyramid.renderers.JSON; OPT_NON_STR_KEYS: json.dumps accepts int dict keys too
+    default = functools.partial(_orjson_default, request=request)
+    return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def get_dumps(accelerated=True):
+    """Return the fastest available ``(value, request=None) -> bytes`` encoder"""
+    if accelerated and orjson is not None:
+        return orjson_dumps
+    return stdlib_dumps
+
+
+class FastJSON(object):
+    """Renderer factory with the same contract as ``pyramid.renderers.JSON``"""
+
+    def __init__(self, accelerated=True):
+        self.dumps = get_dumps(accelerated)
+
+    def __call__(self, info):
+        dumps = self.dumps
+
+        def _render(value, system):
+            request = system.get('request')
+            if request is not None:
+                response = request.response
+                if response.content_type == response.default_content_type:
+                    response.content_type = 'application/json'
+            with span('render'):
+                return dumps(value, request)
+        return _render
+
+
+def includeme(config):
+    settings = config.get_settings()
+    config.add_renderer('json', FastJSON(asbool(settings.get('json.accelerated', True))))
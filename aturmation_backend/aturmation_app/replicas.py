@@ -0,0 +1,251 @@
+# aturmation_app/replicas.py
+"""
+Read replicas for safe read-only views, with read-your-writes pinning.
+
+Views opt in with the ``replica_read`` decorator::
+
+    @view_config(..., decorator=(replica_read(), conditional(my_validators)))
+
+When such a view is the first to open ``request.dbsession``, the session is
+bound to a healthy replica chosen round-robin instead of the primary. A
+background thread per replica pings it every ``db.replica.check_interval``
+seconds, so a dead replica never adds connect latency to a request; it is
+skipped while down, and also while a ping has been hanging for longer than
+``db.replica.check_timeout``. With no healthy replica the primary is used.
+
+After a successful write request the response carries a signed "last write"
+time, as the ``aturmation_last_write`` cookie and the ``X-Last-Write``
+header. A client sending either back within ``db.replica.pin_seconds`` is
+served from the primary, so it always sees its own writes.
+
+Reads from a replica never fill the user snapshot cache, which has to stay
+as fresh as the primary.
+
+Settings:
+
+``sqlalchemy.replica.url``       replica URLs, one per line (none: disabled)
+``sqlalchemy.replica.*``         other engine options for every replica
+``db.replica.check_interval``    seconds between health checks (default 10)
+``db.replica.check_timeout``     seconds a ping may hang before the replica counts as down (default 2)
+``db.replica.pin_seconds``       read-your-writes window (default 5)
+``db.replica.secret``            key signing the last-write value (default ``jwt.secret``)
+"""
+import atexit
+import itertools
+import logging
+import threading
+import time
+
+from pyramid.settings import aslist
+from sqlalchemy import engine_from_config, event, text
+from webob.cookies import SignedSerializer
+
+from .dbstats import instrument_engine
+from .pooling import pool_options
+from .tokens import FALLBACK_SECRET
+
+log = logging.getLogger(__name__)
+
+LAST_WRITE_COOKIE = 'aturmation_last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+REPLICA_PREFIX = 'sqlalchemy.replica.'
+
+
+class Replica(object):
+    """One replica engine and its health"""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.sessions = 0
+        self.failures = 0
+        self._checking_since = None
+        self._stop = threading.Event()
+        self._thread = None
+        event.listen(engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark_down('connection lost')
+
+    def mark_down(self, reason):
+        if self.healthy:
+            log.warning(f"Replica {self.name} marked down: {reason}")
+        self.healthy = False
+        self.failures += 1
+
+    def check(self):
+        """Ping the replica and record the outcome; runs on the checker thread"""
+        self._checking_since = time.monotonic()
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            if not self.healthy:
+                log.info(f"Replica {self.name} is back")
+            self.healthy = True
+        except Exception as e:
+            self.mark_down(e)
+        finally:
+            self._checking_since = None
+
+    def available(self, check_timeout):
+        """Whether to route to this replica; never touches the network"""
+        checking_since = self._checking_since
+        if checking_since is not None and time.monotonic() - checking_since > check_timeout:
+            return False
+        return self.healthy
+
+    def _run(self, check_interval):
+        while not self._stop.wait(check_interval):
+            self.check()
+
+    def start(self, check_interval):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(check_interval,),
+                                            name='replica-check-%s' % self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+
+class ReplicaSet(object):
+    """Round-robin choice among healthy replicas plus last-write pinning"""
+
+    def __init__(self, replicas, secret, check_interval=10.0, pin_seconds=5.0, check_timeout=2.0):
+        self.replicas = replicas
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.pin_seconds = pin_seconds
+        self._serializer = SignedSerializer(secret, 'aturmation.last-write')
+        self._counter = itertools.count()
+        self.pinned = 0
+        self.fallbacks = 0
+
+    def choose(self):
+        """A healthy replica, or None when all are down"""
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.available(self.check_timeout):
+                return replica
+        return None
+
+    def start_checks(self):
+        """Start the health check threads (stopped at exit)"""
+        for replica in self.replicas:
+            replica.start(self.check_interval)
+        atexit.register(self.stop_checks)
+
+    def stop_checks(self):
+        for replica in self.replicas:
+            replica.stop()
+
+    def last_write(self, request):
+        """Wall-clock time of the client's last write, if it sent a valid one"""
+        value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+        if not value:
+            return None
+        try:
+            return float(self._serializer.loads(value.encode('ascii')))
+        except (ValueError, TypeError, UnicodeEncodeError):
+            return None
+
+    def is_pinned(self, request):
+        written = self.last_write(request)
+        return written is not None and time.time() - written < self.pin_seconds
+
+    def mark_write(self, response):
+        """Pin the client to the primary for ``pin_seconds`` after a write"""
+        value = self._serializer.dumps(time.time()).decode('ascii')
+        response.set_cookie(LAST_WRITE_COOKIE, value, max_age=int(self.pin_seconds) or 1,
+                            httponly=True, samesite='Lax')
+        response.headers[LAST_WRITE_HEADER] = value
+
+    def session_for(self, request, session_factory):
+        """A session on a replica when the request may use one, else on the primary"""
+        if not getattr(request, 'prefer_replica', False):
+            return session_factory()
+        if self.is_pinned(request):
+            self.pinned += 1
+            return session_factory()
+        replica = self.choose()
+        if replica is None:
+            self.fallbacks += 1
+            return session_factory()
+        replica.sessions += 1
+        session = session_factory(bind=replica.engine)
+        session.info['replica'] = replica.name
+        return session
+
+    def stats(self):
+        return {
+            'replicas': [{
+                'name': replica.name,
+                'url': replica.engine.url.render_as_string(hide_password=True),
+                'healthy': replica.healthy,
+                'sessions': replica.sessions,
+                'failures': replica.failures,
+            } for replica in self.replicas],
+            'pinned': self.pinned,
+            'fallbacks': self.fallbacks,
+        }
+
+
+def replica_read(unless=None):
+    """
+    View decorator: let the view's DB reads go to a replica.
+
+    Only GET/HEAD are routed. ``unless(request)`` returning true keeps the
+    request on the primary.
+    """
+    def decorator(view):
+        def wrapper(context, request):
+            if request.method in ('GET', 'HEAD') and not (unless and unless(request)):
+                request.prefer_replica = True
+            return view(context, request)
+        return wrapper
+    return decorator
+
+
+def reads_from_replica(request):
+    """Whether ``request.dbsession`` is open and bound to a replica"""
+    session = request.__dict__.get('dbsession')
+    return session is not None and 'replica' in session.info
+
+
+def replica_engines(settings):
+    """Engines for ``sqlalchemy.replica.url``, sharing the other ``sqlalchemy.replica.*`` options"""
+    urls = aslist(settings.get(REPLICA_PREFIX + 'url', ''), flatten=False)
+    options = {
+        key[len(REPLICA_PREFIX):]: value for key, value in settings.items()
+        if key.startswith(REPLICA_PREFIX) and key != REPLICA_PREFIX + 'url'
+    }
+    return [
+        engine_from_config(dict(options, url=url), prefix='', **pool_options(settings, url, options))
+        for url in urls
+    ]
+
+
+def includeme(config):
+    settings = config.get_settings()
+    engines = replica_engines(settings)
+    if not engines:
+        config.registry['db_replicas'] = None
+        return
+    if config.registry.get('db_counters') is not None:
+        for engine in engines:
+            instrument_engine(engine)
+    secret = settings.get('db.replica.secret') or settings.get('jwt.secret') or FALLBACK_SECRET
+    replicas = config.registry['db_replicas'] = ReplicaSet(
+        [Replica('replica%d' % index, engine) for index, engine in enumerate(engines, 1)],
+        secret,
+        check_interval=float(settings.get('db.replica.check_interval', 10)),
+        pin_seconds=float(settings.get('db.replica.pin_seconds', 5)),
+        check_timeout=float(settings.get('db.replica.check_timeout', 2)),
+    )
+    replicas.start_checks()
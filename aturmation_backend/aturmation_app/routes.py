@@ -6,12 +6,25 @@ def includeme(config):
     config.add_route('api_auth_register', '/api/v1/auth/register')
     config.add_route('api_auth_login', '/api/v1/auth/login')
     config.add_route('api_auth_me', '/api/v1/auth/me')
+    config.add_route('api_auth_logout', '/api/v1/auth/logout')
 
     # Rute untuk User Profile
     config.add_route('api_user_profile_update', '/api/v1/users/me/profile')
 
     # Rute untuk Products
     config.add_route('api_products_collection', '/api/v1/products')
+    # Fixed sub-paths must be registered before the {id} pattern
+    config.add_route('api_products_stats', '/api/v1/products/stats')
+    config.add_route('api_products_export', '/api/v1/products/export')
+    config.add_route('api_products_import', '/api/v1/products/import')
+    config.add_route('api_products_batch_delete', '/api/v1/products/delete')
+    config.add_route('api_products_stock_movements', '/api/v1/products/stock-movements')
     config.add_route('api_product_detail', '/api/v1/products/{id}')
+    config.add_route('api_product_stock_movements', '/api/v1/products/{id}/stock-movements')
+
+    # Rute internal (monitoring, hanya admin)
+    config.add_route('api_internal_db_stats', '/api/v1/internal/db')
+    # Prometheus scrape (token atau alamat di metrics.*, bukan JWT)
+    config.add_route('metrics', '/metrics')
 
     config.scan('.views')
\ No newline at end of file
@@ -0,0 +1,97 @@
+# aturmation_app/scripts/import_products.py
+import gzip
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+
+from pyramid.scripts.common import parse_vars
+from pyramid.settings import asbool
+
+from ..models import get_engine
+from ..importer import DEFAULT_CHUNK_SIZE, IMPORT_FORMATS, import_products
+from ..product_cache import RedisBackend
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <file|-> [format=csv|ndjson] [chunk_size=N] [var=value]\n'
+          '(example: "%s development.ini supplier_feed.csv.gz")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def open_input(path):
+    if path == '-':
+        return sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def invalidate_caches(settings):
+    """
+    Drop the shared product cache so running servers reload imported rows.
+
+    Their in-process caches cannot be reached from here: without
+    ``products.cache.redis_url`` they serve cached products for up to
+    ``products.cache.ttl`` seconds (and counts for ``products.count.cache_ttl``).
+    """
+    redis_url = settings.get('products.cache.redis_url')
+    if not asbool(settings.get('products.cache.enabled', True)):
+        return
+    if not redis_url:
+        print("Running servers may serve cached products for up to %s s (products.cache.ttl)" %
+              settings.get('products.cache.ttl', 60))
+        return
+    try:
+        RedisBackend(redis_url, 0).clear()
+    except Exception as e:
+        print("Could not clear the shared product cache: %s" % e)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 3:
+        usage(argv)
+    config_uri = argv[1]
+    path = argv[2]
+    options = parse_vars(argv[3:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+
+    fmt = options.get('format') or guess_format(path)
+    if fmt not in IMPORT_FORMATS:
+        print('Cannot tell the file format, pass format=csv or format=ndjson')
+        sys.exit(1)
+    chunk_size = int(options.get('chunk_size', DEFAULT_CHUNK_SIZE))
+
+    engine = get_engine(settings)
+    stream = open_input(path)
+    try:
+        # One transaction; every chunk is a savepoint inside it
+        with engine.begin() as connection:
+            result = import_products(connection, stream, fmt, chunk_size)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    invalidate_caches(settings)
+
+    print("Received %d rows: %d upserted, %d failed, %d duplicates in %.1fs (%.0f rows/s)" % (
+        result.received, result.upserted, result.failed, result.duplicates, result.elapsed,
+        result.received / result.elapsed if result.elapsed else 0))
+    for error in result.errors:
+        print("  line %s (sku %s): %s" % (error['line'], error['sku'], error['message']))
+    if result.failed > len(result.errors):
+        print("  ... %d more errors not shown" % (result.failed - len(result.errors)))
@@ -19,6 +19,7 @@ from ..models import (
     get_engine,
     get_session_factory,
 )
+from ..search import install_search
 
 
 def usage(argv):
@@ -38,6 +39,9 @@ def main(argv=sys.argv):
 
     engine = get_engine(settings)
     Base.metadata.create_all(engine)
+    # create_all skips existing tables, so (re)install search explicitly
+    with engine.begin() as connection:
+        install_search(connection)
     
     # Create a simple session without transaction manager
     session_factory = get_session_factory(engine)
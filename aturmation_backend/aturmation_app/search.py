@@ -0,0 +1,245 @@
+# aturmation_app/search.py
+"""
+Product search backends.
+
+The backend is picked from the engine dialect:
+
+* PostgreSQL: a generated ``search_vector`` tsvector column with a GIN
+  index for words, plus ``pg_trgm`` GIN indexes on ``name``/``sku``/
+  ``description`` for substring and SKU fragments.
+* SQLite: an external-content FTS5 table (``products_fts``, trigram
+  tokenizer) kept in sync by triggers.
+* Anything else: the plain ILIKE scan we used before.
+
+All backends rank results by relevance; the DDL is idempotent and is run
+by ``Base.metadata.create_all`` and ``initialize_aturmation_db``.
+
+The app uses ``VerifiedSearchBackend``: before the first search it checks
+that the dialect's DDL is installed and otherwise logs an error and falls
+back to the ILIKE scan, instead of failing every search.
+"""
+import logging
+import threading
+
+from sqlalchemy import event, func, literal_column, or_, table, column, text
+
+from .models import Product
+
+log = logging.getLogger(__name__)
+
+
+class LikeSearchBackend(object):
+    """Fallback: unindexed ILIKE across name, sku and description"""
+    name = 'like'
+
+    def install(self, connection):
+        pass
+
+    def installed(self, connection):
+        """Whether the DDL this backend needs exists on ``connection``'s database"""
+        return True
+
+    def filter(self, query, term):
+        return query.filter(
+            or_(
+                Product.name.icontains(term, autoescape=True),
+                Product.sku.icontains(term, autoescape=True),
+                Product.description.icontains(term, autoescape=True),
+            )
+        )
+
+    def rank(self, term):
+        # Exact SKU hits first, then name prefix matches
+        return (func.lower(Product.sku) == term.lower()) * 2 + \
+            Product.name.istartswith(term, autoescape=True)
+
+    def order(self, query, term):
+        """Order a filtered ``query`` by relevance, best match first"""
+        return query.order_by(self.rank(term).desc())
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    name = 'postgresql'
+    config = 'simple'
+
+    DDL = (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(sku, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+        ") STORED",
+        "CREATE INDEX IF NOT EXISTS ix_products_search_vector "
+        "ON products USING GIN (search_vector)",
+        "CREATE INDEX IF NOT EXISTS ix_products_name_trgm "
+        "ON products USING GIN (name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_products_sku_trgm "
+        "ON products USING GIN (sku gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_products_description_trgm "
+        "ON products USING GIN (description gin_trgm_ops)",
+    )
+
+    search_vector = literal_column('products.search_vector')
+
+    def install(self, connection):
+        for statement in self.DDL:
+            connection.execute(text(statement))
+
+    def installed(self, connection):
+        return bool(connection.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'products' AND column_name = 'search_vector' "
+            "AND table_schema = ANY (current_schemas(false))) "
+            "AND EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        )).scalar())
+
+    def _tsquery(self, term):
+        return func.websearch_to_tsquery(self.config, term)
+
+    def filter(self, query, term):
+        # ILIKE on name/sku/description is served by the trigram indexes
+        return query.filter(
+            or_(
+                self.search_vector.op('@@')(self._tsquery(term)),
+                Product.name.icontains(term, autoescape=True),
+                Product.sku.icontains(term, autoescape=True),
+                Product.description.icontains(term, autoescape=True),
+            )
+        )
+
+    def rank(self, term):
+        return func.ts_rank(self.search_vector, self._tsquery(term)) + \
+            func.greatest(func.similarity(Product.name, term), func.similarity(Product.sku, term))
+
+
+class SqliteSearchBackend(LikeSearchBackend):
+    name = 'sqlite'
+
+    # The trigram tokenizer cannot match fragments shorter than this
+    MIN_TERM_LENGTH = 3
+
+    DDL = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+        "name, sku, description, content='products', content_rowid='id', "
+        "tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, sku, description) "
+        "VALUES (new.id, new.name, new.sku, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, sku, description) "
+        "VALUES ('delete', old.id, old.name, old.sku, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, sku, description) "
+        "VALUES ('delete', old.id, old.name, old.sku, old.description); "
+        "INSERT INTO products_fts(rowid, name, sku, description) "
+        "VALUES (new.id, new.name, new.sku, new.description); END",
+    )
+
+    fts = table('products_fts', column('rowid'), column('products_fts'), column('rank'))
+
+    def install(self, connection):
+        for statement in self.DDL:
+            connection.execute(text(statement))
+        # Index rows that existed before the FTS table did
+        connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+    def installed(self, connection):
+        # The table and its three sync triggers
+        return connection.execute(text(
+            "SELECT count(*) FROM sqlite_master WHERE name IN "
+            "('products_fts', 'products_fts_ai', 'products_fts_ad', 'products_fts_au')"
+        )).scalar() == 4
+
+    @staticmethod
+    def _phrase(term):
+        return '"%s"' % term.replace('"', '""')
+
+    def filter(self, query, term):
+        if len(term) < self.MIN_TERM_LENGTH:
+            return super(SqliteSearchBackend, self).filter(query, term)
+        return query.join(self.fts, self.fts.c.rowid == Product.id).filter(
+            self.fts.c.products_fts.match(self._phrase(term))
+        )
+
+    def order(self, query, term):
+        if len(term) < self.MIN_TERM_LENGTH:
+            return super(SqliteSearchBackend, self).order(query, term)
+        # The hidden rank column is bm25(), lower-is-better. Unlike calling
+        # bm25() directly it is still usable next to a window function.
+        return query.order_by(self.fts.c.rank)
+
+
+_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(dialect_name):
+    """Return the search backend for a SQLAlchemy dialect name"""
+    return _BACKENDS.get(dialect_name, LikeSearchBackend)()
+
+
+class VerifiedSearchBackend(object):
+    """
+    The dialect's backend once ``installed`` confirmed its DDL, else ILIKE.
+
+    Checked lazily on the first search (the schema may be created after the
+    app starts, as in the tests) and remembered; a check that cannot reach
+    the database is retried on the next search.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.preferred = get_search_backend(engine.dialect.name)
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    return self._verify()
+        return self._backend
+
+    def _verify(self):
+        try:
+            with self.engine.connect() as connection:
+                installed = self.preferred.installed(connection)
+        except Exception as e:
+            log.error(f"Cannot check '{self.preferred.name}' search DDL, using ILIKE for now: {e}")
+            return LikeSearchBackend()
+        if installed:
+            self._backend = self.preferred
+        else:
+            log.error(f"'{self.preferred.name}' product search is not installed (run "
+                      f"initialize_aturmation_db); falling back to unindexed ILIKE search")
+            self._backend = LikeSearchBackend()
+        return self._backend
+
+    def filter(self, query, term):
+        return self.backend.filter(query, term)
+
+    def rank(self, term):
+        return self.backend.rank(term)
+
+    def order(self, query, term):
+        return self.backend.order(query, term)
+
+
+def install_search(connection):
+    """Create search columns, indexes and triggers for ``connection``'s dialect"""
+    backend = get_search_backend(connection.dialect.name)
+    log.info("Installing '%s' product search", backend.name)
+    backend.install(connection)
+
+
+@event.listens_for(Product.__table__, 'after_create')
+def _install_search_after_create(target, connection, **kw):
+    install_search(connection)
@@ -1,7 +1,8 @@
 # aturmation_app/security.py
+import collections
 import os
 import datetime
-import jwt
+import itertools
 import logging
 from pyramid.authentication import CallbackAuthenticationPolicy
 from pyramid.security import (
@@ -9,117 +10,140 @@ from pyramid.security import (
     Everyone,
     Allow,
 )
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
 
-log = logging.getLogger(__name__)
+from .cache import LRUCache
+from .models.user import UserRole
+from .replicas import reads_from_replica
+from .tracing import span
 
-# JWT settings
-JWT_SECRET = 'aturmation-secret-key'  # Idealnya dari settings
-JWT_ALGORITHM = 'HS256'
+log = logging.getLogger(__name__)
 
-def create_jwt_token(user_id, username):
-    """Create a JWT token for authentication"""
-    try:
-        payload = {
-            'sub': str(user_id),
-            'username': username,
-            'iat': datetime.datetime.utcnow(),
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
-        }
-        token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-        # JWT library returns bytes in some versions, string in others
-        if isinstance(token, bytes):
-            return token.decode('utf-8')
-        return token
-    except Exception as e:
-        log.error(f"Error creating JWT token: {e}")
-        raise
-
-def parse_jwt_token(token):
-    """Parse a JWT token and return the payload"""
-    try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except jwt.ExpiredSignatureError:
-        log.warning("Token expired")
-        return None
-    except jwt.InvalidTokenError as e:
-        log.warning(f"Invalid token: {e}")
-        return None
-    except Exception as e:
-        log.error(f"Unexpected error parsing token: {e}")
-        return None
+def get_jwt_claims(request):
+    """
+    Verified JWT payload of the request, or None.
 
-def get_user(request):
-    """Get the current user from the request"""
-    # Avoid circular imports
-    from .models import User
-    
-    # PENTING: Periksa apakah ini adalah request untuk /api/v1/auth/me
-    # untuk mencegah rekursi tak terhingga
-    if request.path == '/api/v1/auth/me' and hasattr(request, '_get_user_recursion'):
-        return None
-    
-    # Set flag untuk menghindari rekursi
-    request._get_user_recursion = True
-    
-    # Check if user is already in request (menggunakan nama yang berbeda untuk menghindari konflik)
-    cached_user = getattr(request, '_cached_user', None)
-    if cached_user is not None:
-        return cached_user
-    
-    # Extract token from header
+    Reified as ``request.jwt_claims`` so the token is checked once per
+    request no matter how many places need it; see ``aturmation_app.tokens``.
+    """
     auth_header = request.headers.get('Authorization', '')
     if not auth_header.startswith('Bearer '):
         return None
-    
     token = auth_header.split(' ', 1)[1]
-    payload = parse_jwt_token(token)
-    if payload is None:
-        return None
-    
-    user_id = payload.get('sub')
-    if not user_id:
+    with span('auth.jwt'):
+        return request.registry['token_service'].verify(token)
+
+
+# Cached view of the signed-in user; enough for principals and /auth/me
+UserSnapshot = collections.namedtuple('UserSnapshot', 'id username role name email photo')
+
+# Permissions granted per User.role (principal ``role:<role>``)
+ROLE_PERMISSIONS = {
+    UserRole.ADMIN: ('view', 'create', 'edit', 'delete', 'internal'),
+    UserRole.STAFF: ('view', 'create', 'edit', 'delete'),
+}
+
+
+def _load_snapshot(request, user_id):
+    from .models import User
+    row = request.dbsession.connection().execute(
+        select(User.id, User.username, User.role, User.name, User.email, User.photo)
+        .where(User.id == user_id)
+    ).first()
+    return UserSnapshot(*row) if row is not None else None
+
+
+def get_user_snapshot(request):
+    """
+    ``UserSnapshot`` for the token's ``sub`` (``request.user_snapshot``).
+
+    Served from ``registry['user_cache']`` when warm; a miss reads one row.
+    Returns None without a valid token or when the user no longer exists.
+    """
+    claims = request.jwt_claims
+    if not claims:
         return None
-    
-    # Get user from database
     try:
-        user = request.dbsession.query(User).filter_by(id=user_id).first()
-        if user:
-            # Store user in request to avoid multiple database lookups
-            # Gunakan nama yang berbeda untuk menghindari konflik
-            request._cached_user = user
-        return user
-    except Exception as e:
-        log.error(f"Error getting user from database: {e}")
+        user_id = int(claims.get('sub'))
+    except (TypeError, ValueError):
         return None
+    cache = request.registry['user_cache']
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        generation = cache.generation
+        try:
+            snapshot = _load_snapshot(request, user_id)
+        except Exception as e:
+            log.error(f"Error getting user from database: {e}")
+            return None
+        # A replica may lag behind a role change: only cache primary reads
+        if snapshot is not None and not reads_from_replica(request):
+            cache.set(user_id, snapshot, generation)
+    return snapshot
+
+
+def get_user(request):
+    """The current ``User`` ORM instance (``request.user``); prefer ``request.user_snapshot``"""
+    from .models import User
+    snapshot = request.user_snapshot
+    if snapshot is None:
+        return None
+    return request.dbsession.query(User).filter_by(id=snapshot.id).first()
+
+
+def _track_user_changes(session, flush_context):
+    """Remember users changed or deleted in this session (after_flush listener)"""
+    from .models import User
+    changed = session.info.setdefault('changed_user_ids', set())
+    for obj in itertools.chain(session.dirty, session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+
+
+# Snapshot invalidation follows ORM changes to users in any session
+event.listen(Session, 'after_flush', _track_user_changes)
+
+
+def commit_user_invalidations(request, session):
+    """Drop cached snapshots of users ``session`` changed; called after commit"""
+    changed = session.info.pop('changed_user_ids', None)
+    if changed:
+        request.registry['user_cache'].delete(*changed)
+
 
 class JWTAuthenticationPolicy(CallbackAuthenticationPolicy):
     def unauthenticated_userid(self, request):
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return None
-        
-        token = auth_header.split(' ', 1)[1]
-        payload = parse_jwt_token(token)
-        if payload is None:
+        claims = request.jwt_claims
+        if claims is None:
             return None
-            
-        return payload.get('sub')
+        return claims.get('sub')
     
     def callback(self, userid, request):
-        # Simplified for testing - all authenticated users get all permissions
-        if userid:
-            return ['view', 'create', 'edit', 'delete']
-        return []
+        """Principals from the user's role; None (unauthenticated) if the user is gone"""
+        snapshot = request.user_snapshot
+        if snapshot is None or str(snapshot.id) != str(userid):
+            return None
+        return ['user:%s' % snapshot.id, 'role:%s' % snapshot.role]
 
 # Root factory to define ACLs
 class RootFactory(object):
     """Root factory for ACL"""
     __acl__ = [
-        (Allow, Authenticated, 'view'),
-        (Allow, Authenticated, 'create'),
-        (Allow, Authenticated, 'edit'),
-        (Allow, Authenticated, 'delete'),
+        (Allow, 'role:%s' % role, permissions)
+        for role, permissions in ROLE_PERMISSIONS.items()
     ]
     
     def __init__(self, request):
-        pass
\ No newline at end of file
+        pass
+
+
+def includeme(config):
+    settings = config.get_settings()
+    config.registry['user_cache'] = LRUCache(
+        max_entries=int(settings.get('auth.user_cache.max_entries', 4096)),
+        ttl=float(settings.get('auth.user_cache.ttl', 60))
+    )
+    config.add_request_method(get_jwt_claims, 'jwt_claims', reify=True)
+    config.add_request_method(get_user_snapshot, 'user_snapshot', reify=True)
+    config.add_request_method(get_user, 'user', reify=True)
@@ -0,0 +1,200 @@
+# aturmation_app/stock.py
+"""
+Atomic stock adjustments with an append-only ledger.
+
+Movements carry a ``delta`` instead of an absolute stock value and are
+applied with ``UPDATE products SET stock = stock + v.delta ... RETURNING``,
+so concurrent terminals never lose each other's updates and no row is read
+into Python first. Movements for the same product within one call are
+netted into a single row of the UPDATE. Every applied movement gets a
+``stock_movements`` row, inserted in one executemany at the end.
+
+Unless negative stock is allowed, a product whose net delta would take it
+below zero is left untouched and all of its movements fail with
+``insufficient_stock``.
+
+``set_stock`` records absolute sets (PUT ``stock``) the same way: the old
+and new stock come from the UPDATE itself, never from a value read earlier.
+Batch PATCH ``stock`` does the same per chunk (``aturmation_app.batch``).
+Both run on the caller's connection, so the stock UPDATE and its ledger rows
+commit or roll back together with the request.
+"""
+import collections
+import datetime
+import logging
+
+from sqlalchemy import Integer, insert, select, update
+
+from .batch import KEY_TYPES, _chunks, _result, _source
+from .models import Product, StockMovement
+
+log = logging.getLogger(__name__)
+
+MAX_MOVEMENTS = 5000
+DEFAULT_REASON = 'adjustment'
+
+StockChange = collections.namedtuple('StockChange', 'id sku stock_before stock updated_at')
+
+
+class StockError(ValueError):
+    """The movement batch as a whole is malformed"""
+
+
+def parse_movement(item):
+    """Return ``(key_field, key_value, delta, reason, reference)`` or raise ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('Movement must be an object')
+    if item.get('product_id', item.get('id')) is not None:
+        try:
+            key_field, key_value = 'id', int(item.get('product_id', item.get('id')))
+        except (TypeError, ValueError):
+            raise ValueError('product_id must be an integer')
+    elif item.get('sku'):
+        key_field, key_value = 'sku', str(item['sku'])
+    else:
+        raise ValueError('Movement needs a product_id or a sku')
+
+    delta = item.get('delta')
+    if isinstance(delta, bool):
+        raise ValueError('delta must be an integer')
+    try:
+        delta = int(delta)
+    except (TypeError, ValueError):
+        raise ValueError('delta must be an integer')
+    if delta == 0:
+        raise ValueError('delta cannot be zero')
+
+    reason = str(item.get('reason') or DEFAULT_REASON)
+    reference = item.get('reference')
+    if len(reason) > 50:
+        raise ValueError('reason is limited to 50 characters')
+    if reference is not None:
+        reference = str(reference)
+        if len(reference) > 100:
+            raise ValueError('reference is limited to 100 characters')
+    return key_field, key_value, delta, reason, reference
+
+
+def apply_movements(connection, items, created_by=None, allow_negative=False):
+    """Apply movement ``items`` on ``connection``; one result dict per item, in order"""
+    if len(items) > MAX_MOVEMENTS:
+        raise StockError('At most %d movements per batch' % MAX_MOVEMENTS)
+
+    results = [None] * len(items)
+    # key_field -> key_value -> [(index, delta, reason, reference)] in request order
+    groups = {'id': {}, 'sku': {}}
+    for index, item in enumerate(items):
+        try:
+            key_field, key_value, delta, reason, reference = parse_movement(item)
+        except ValueError as e:
+            results[index] = _result(index, 'invalid', str(e))
+            continue
+        groups[key_field].setdefault(key_value, []).append((index, delta, reason, reference))
+
+    table = Product.__table__
+    now = datetime.datetime.utcnow()
+    # result index -> ledger row, so the ledger is written in request order
+    ledger = {}
+    for key_field, movements in groups.items():
+        if not movements:
+            continue
+        key_column = table.c[key_field]
+        columns = [(key_field, KEY_TYPES[key_field]), ('delta', Integer)]
+        for keys in _chunks(list(movements)):
+            source = _source(
+                connection.dialect.name, columns,
+                [(key_value, sum(delta for index, delta, reason, reference in movements[key_value]))
+                 for key_value in keys]
+            )
+            statement = update(table).where(key_column == source.c[key_field]).values(
+                stock=table.c.stock + source.c.delta, updated_at=now
+            )
+            if not allow_negative:
+                statement = statement.where(table.c.stock + source.c.delta >= 0)
+            rows = connection.execute(
+                statement.returning(table.c.id, table.c.sku, table.c.stock)
+            ).fetchall()
+            applied = {getattr(row, key_field): row for row in rows}
+
+            missing = [key_value for key_value in keys if key_value not in applied]
+            existing = set()
+            if missing:
+                existing = set(connection.execute(
+                    select(key_column).where(key_column.in_(missing))
+                ).scalars())
+
+            for key_value in keys:
+                row = applied.get(key_value)
+                if row is None:
+                    if key_value in existing:
+                        status, message = 'insufficient_stock', 'Not enough stock'
+                    else:
+                        status, message = 'not_found', 'Product not found'
+                    for index, delta, reason, reference in movements[key_value]:
+                        results[index] = _result(index, status, message, delta=delta,
+                                                 **{key_field: key_value})
+                    continue
+                # Walk back from the final stock to each movement's stock_after
+                stock_after = row.stock
+                for index, delta, reason, reference in reversed(movements[key_value]):
+                    results[index] = _result(index, 'applied', id=row.id, sku=row.sku,
+                                             delta=delta, stock=stock_after)
+                    ledger[index] = {
+                        'product_id': row.id,
+                        'delta': delta,
+                        'stock_after': stock_after,
+                        'reason': reason,
+                        'reference': reference,
+                        'created_by': created_by,
+                        'created_at': now,
+                    }
+                    stock_after -= delta
+
+    if ledger:
+        connection.execute(insert(StockMovement.__table__), [ledger[index] for index in sorted(ledger)])
+    return results
+
+
+def set_stock(connection, product_id, stock, reason='set', created_by=None):
+    """
+    Set a product's stock to ``stock`` and record the difference in the ledger.
+
+    Returns a ``StockChange`` or None when the product does not exist. On
+    PostgreSQL one ``UPDATE ... FROM (SELECT ... FOR UPDATE) RETURNING``
+    yields the old and the new stock. SQLite's RETURNING cannot see the FROM
+    clause, so there a no-op UPDATE first takes the write lock and reads the
+    current stock, which no other writer can change before the set.
+    """
+    table = Product.__table__
+    now = datetime.datetime.utcnow()
+    if connection.dialect.name == 'postgresql':
+        old = select(table.c.id, table.c.stock).where(table.c.id == product_id).with_for_update().subquery('old')
+        row = connection.execute(
+            update(table).where(table.c.id == old.c.id).values(stock=stock, updated_at=now)
+            .returning(table.c.id, table.c.sku, old.c.stock.label('stock_before'),
+                       table.c.stock.label('stock_after'))
+        ).first()
+        if row is None:
+            return None
+        stock_before = row.stock_before
+    else:
+        stock_before = connection.execute(
+            update(table).where(table.c.id == product_id).values(stock=table.c.stock)
+            .returning(table.c.stock)
+        ).scalar()
+        if stock_before is None:
+            return None
+        row = connection.execute(
+            update(table).where(table.c.id == product_id).values(stock=stock, updated_at=now)
+            .returning(table.c.id, table.c.sku, table.c.stock.label('stock_after'))
+        ).first()
+    if row.stock_after != stock_before:
+        connection.execute(insert(StockMovement.__table__).values(
+            product_id=row.id,
+            delta=row.stock_after - stock_before,
+            stock_after=row.stock_after,
+            reason=reason,
+            created_by=created_by,
+            created_at=now,
+        ))
+    return StockChange(row.id, row.sku, stock_before, row.stock_after, now)
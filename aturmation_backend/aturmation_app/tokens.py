@@ -0,0 +1,311 @@
+# aturmation_app/tokens.py
+"""
+JWT issuing and verification with key rotation, a verified-token cache and
+a revocation list.
+
+* Keys come from settings. New tokens are signed with ``jwt.secret`` and
+  carry its ``kid`` in the header. Retired keys listed in ``jwt.old_keys``
+  are still accepted until their tokens expire.
+* Verified payloads are kept in an LRU keyed by the SHA-256 of the token
+  and are dropped once past ``exp``, so a warm token costs one hash and a
+  dict lookup instead of an HMAC check and a JSON decode.
+* Revoked ``jti``s live in the ``revoked_tokens`` table and in an in-memory
+  bloom filter. A filter miss (almost every request) needs no query; a hit
+  is confirmed against the table. The filter is loaded at startup, then a
+  daemon thread adds the rows revoked since the last load (minus
+  ``jwt.revocation.margin``, for transactions that committed late) every
+  ``jwt.revocation.refresh`` seconds and rebuilds it from the unexpired rows
+  every ``jwt.revocation.rebuild`` seconds, which drops expired entries.
+  Requests never wait for a reload. A revocation reaches the local filter
+  only once its transaction has committed.
+* Until a load has succeeded (e.g. ``revoked_tokens`` is missing, which is
+  logged at startup), every token is checked against the table and refused
+  when that check fails.
+
+Settings:
+
+``jwt.secret``               signing key (required)
+``jwt.kid``                  id of the signing key (default ``main``)
+``jwt.old_keys``             retired keys still accepted, one ``kid:secret`` per line
+``jwt.ttl``                  token lifetime in seconds (default 86400)
+``jwt.cache.max_entries``    verified-token LRU size (default 8192)
+``jwt.revocation.capacity``  expected live revocations (default 100000)
+``jwt.revocation.refresh``   seconds between revocation reloads (default 5)
+``jwt.revocation.margin``    seconds of revocations re-read on each reload (default 60)
+``jwt.revocation.rebuild``   seconds between full filter rebuilds (default 600)
+"""
+import atexit
+import datetime
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+
+import jwt
+from pyramid.settings import aslist
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .models import RevokedToken
+
+log = logging.getLogger(__name__)
+
+JWT_ALGORITHM = 'HS256'
+# Used only when jwt.secret is missing, for parity with the old module constant
+FALLBACK_SECRET = 'aturmation-secret-key'
+
+
+class BloomFilter(object):
+    """Fixed-size bloom filter over strings (double hashing on one BLAKE2b digest)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        """Add ``value``; returns False when it (or a collision) was already in"""
+        added = False
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class RevocationList(object):
+    """Revoked ``jti``s: bloom filter in memory, ``revoked_tokens`` as the source of truth"""
+
+    def __init__(self, engine, capacity=100000, refresh=5.0, margin=60.0, rebuild=600.0):
+        self.engine = engine
+        self.capacity = capacity
+        self.refresh = refresh
+        self.margin = datetime.timedelta(seconds=margin)
+        self.rebuild = rebuild
+        self.filter = BloomFilter(capacity)
+        self.loaded = False
+        self.failing = False
+        self._since = None
+        self._next_rebuild = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.confirmations = 0
+
+    def _load(self, full=False):
+        """
+        Add revocations made since the last load (by any worker), or with
+        ``full`` rebuild the filter from every unexpired revocation.
+        """
+        table = RevokedToken.__table__
+        query = select(table.c.jti, table.c.revoked_at) \
+            .where(table.c.expires_at > datetime.datetime.utcnow())
+        if not full and self._since is not None:
+            # Re-read a margin: a row revoked earlier may have committed later
+            query = query.where(table.c.revoked_at >= self._since - self.margin)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).all()
+        target = BloomFilter(self.capacity) if full else self.filter
+        since = self._since
+        for row in rows:
+            target.add(row.jti)
+            if since is None or row.revoked_at > since:
+                since = row.revoked_at
+        self.filter = target
+        self._since = since
+        if target.count > self.capacity:
+            log.warning("Revocation list holds %d entries, above jwt.revocation.capacity; "
+                        "more lookups will hit the database", target.count)
+
+    def reload(self):
+        """Load new revocations (rebuilding when due); True on success. Logs only state changes."""
+        now = time.monotonic()
+        full = not self.loaded or now >= self._next_rebuild
+        try:
+            self._load(full)
+        except Exception as e:
+            if not self.failing:
+                log.error(f"Failed to load token revocations: {e}")
+            self.failing = True
+            return False
+        if full:
+            self._next_rebuild = now + self.rebuild
+        if self.failing:
+            log.info("Token revocations loaded again")
+        self.failing = False
+        self.loaded = True
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.refresh):
+            self.reload()
+
+    def start(self):
+        """Load now, then keep reloading on a daemon thread (stopped at exit)"""
+        if not self.reload():
+            log.error("Token revocations are not loaded: every token is checked against "
+                      "revoked_tokens and refused while that fails (run initialize_aturmation_db?)")
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+    def is_revoked(self, jti):
+        if self.loaded and jti not in self.filter:
+            return False
+        # Possible false positive, or nothing loaded yet: ask the table
+        self.confirmations += 1
+        table = RevokedToken.__table__
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(
+                    select(table.c.id).where(table.c.jti == jti)
+                ).first() is not None
+        except Exception as e:
+            # Fail closed: a token that cannot be checked is refused
+            log.error(f"Cannot check token revocation: {e}")
+            return True
+
+    def revoke(self, session, jti, expires_at, user_id=None):
+        """Record ``jti`` in ``session`` (the caller commits); filtered locally after the commit"""
+        session.execute(insert(RevokedToken.__table__).values(
+            jti=jti, user_id=user_id, expires_at=expires_at,
+            revoked_at=datetime.datetime.utcnow()
+        ))
+        session.info.setdefault('pending_revocations', []).append((self, jti))
+
+
+def _apply_revocations(session):
+    for revocations, jti in session.info.pop('pending_revocations', ()):
+        revocations.filter.add(jti)
+
+
+def _discard_revocations(session):
+    session.info.pop('pending_revocations', None)
+
+
+event.listen(Session, 'after_commit', _apply_revocations)
+event.listen(Session, 'after_rollback', _discard_revocations)
+
+
+class TokenService(object):
+    """Issue and verify access tokens"""
+
+    def __init__(self, keys, current_kid, revocations, ttl=86400, cache_size=8192):
+        self.keys = keys
+        self.current_kid = current_kid
+        self.revocations = revocations
+        self.ttl = ttl
+        self.cache = LRUCache(max_entries=cache_size, ttl=ttl)
+
+    def issue(self, user_id, username):
+        now = datetime.datetime.utcnow()
+        payload = {
+            'sub': str(user_id),
+            'username': username,
+            'jti': uuid.uuid4().hex,
+            'iat': now,
+            'exp': now + datetime.timedelta(seconds=self.ttl),
+        }
+        token = jwt.encode(payload, self.keys[self.current_kid], algorithm=JWT_ALGORITHM,
+                           headers={'kid': self.current_kid})
+        return token.decode('utf-8') if isinstance(token, bytes) else token
+
+    def _decode(self, token):
+        kid = jwt.get_unverified_header(token).get('kid')
+        # Tokens from before rotation support carry no kid: current key
+        key = self.keys.get(kid or self.current_kid)
+        if key is None:
+            raise jwt.InvalidTokenError('Unknown key id %r' % kid)
+        return jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+
+    def verify(self, token):
+        """Return the payload of a valid, unexpired, unrevoked token, else None"""
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        payload = self.cache.get(digest)
+        if payload is None:
+            generation = self.cache.generation
+            try:
+                payload = self._decode(token)
+            except jwt.ExpiredSignatureError:
+                log.info("Token expired")
+                return None
+            except jwt.InvalidTokenError as e:
+                log.warning("Invalid token: %s", e)
+                return None
+            self.cache.set(digest, payload, generation)
+        elif payload.get('exp') is not None and payload['exp'] <= time.time():
+            self.cache.delete(digest)
+            return None
+        jti = payload.get('jti')
+        if jti and self.revocations.is_revoked(jti):
+            return None
+        return payload
+
+    def revoke(self, session, payload):
+        """Revoke the token ``payload`` belongs to, when ``session`` commits"""
+        if not payload.get('jti'):
+            return False
+        expires_at = datetime.datetime.utcfromtimestamp(payload['exp']) if payload.get('exp') \
+            else datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        user_id = int(payload['sub']) if str(payload.get('sub', '')).isdigit() else None
+        self.revocations.revoke(session, payload['jti'], expires_at, user_id)
+        return True
+
+
+def parse_keys(settings):
+    """``(keys, current_kid)`` from ``jwt.secret``/``jwt.kid``/``jwt.old_keys``"""
+    current_kid = settings.get('jwt.kid', 'main')
+    secret = settings.get('jwt.secret')
+    if not secret:
+        log.warning("jwt.secret is not set; using the built-in development key")
+        secret = FALLBACK_SECRET
+    keys = {}
+    for line in aslist(settings.get('jwt.old_keys', ''), flatten=False):
+        kid, sep, old_secret = line.partition(':')
+        if not sep or not kid.strip() or not old_secret.strip():
+            raise ValueError('jwt.old_keys entries must look like kid:secret')
+        keys[kid.strip()] = old_secret.strip()
+    keys[current_kid] = secret
+    return keys, current_kid
+
+
+def includeme(config):
+    settings = config.get_settings()
+    keys, current_kid = parse_keys(settings)
+    revocations = RevocationList(
+        config.registry['dbengine'],
+        capacity=int(settings.get('jwt.revocation.capacity', 100000)),
+        refresh=float(settings.get('jwt.revocation.refresh', 5)),
+        margin=float(settings.get('jwt.revocation.margin', 60)),
+        rebuild=float(settings.get('jwt.revocation.rebuild', 600)),
+    )
+    revocations.start()
+    config.registry['token_service'] = TokenService(
+        keys, current_kid, revocations,
+        ttl=int(settings.get('jwt.ttl', 86400)),
+        cache_size=int(settings.get('jwt.cache.max_entries', 8192)),
+    )
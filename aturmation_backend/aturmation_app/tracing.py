@@ -0,0 +1,462 @@
+# aturmation_app/tracing.py
+"""
+Per-request span trees: tweens, auth, view, render, SQL and commit.
+
+The tracing tween (outermost) starts a trace for the request and a root
+``request`` span. Nested spans come from:
+
+* ``trace_tween`` on the CORS and DB session tweens,
+* ``span('auth.jwt')`` around token verification,
+* a view deriver (``view``, the view callable without rendering),
+* ``span('render')`` in the JSON renderer,
+* ``before/after_cursor_execute`` (``sql``, with the statement
+  fingerprint: literals and parameters replaced by ``?``),
+* ``span('db.commit')`` in the DB session tween.
+
+Which traces are exported: a share (``tracing.sample_rate``) chosen when
+the request starts, every request slower than ``tracing.slow_ms``, and
+requests whose ``traceparent`` header has the sampled flag. With neither
+a rate hit nor a latency threshold, spans are not recorded at all.
+
+Every response carries ``traceparent`` (W3C format) and ``X-Trace-Id``;
+an incoming ``traceparent`` is continued. Exporting happens on a
+background thread behind a bounded queue (full queue = trace dropped), as
+one JSON object per line in ``tracing.file`` or as OTLP/HTTP JSON posted to
+a local collector (``tracing.otlp.endpoint``, e.g. an OpenTelemetry
+Collector or Jaeger on port 4318).
+
+Settings:
+
+``tracing.enabled``         trace requests (default false)
+``tracing.sample_rate``     share of requests exported (default 0.01)
+``tracing.slow_ms``         also export requests at least this slow, 0 = off (default 500)
+``tracing.export``          ``jsonl`` or ``otlp`` (default jsonl)
+``tracing.file``            JSONL output (default ./traces.jsonl)
+``tracing.otlp.endpoint``   default http://127.0.0.1:4318/v1/traces
+``tracing.queue_size``      traces buffered for the exporter (default 1000)
+``tracing.service_name``    ``service.name`` of exported spans (default aturmation)
+"""
+import atexit
+import datetime
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import zlib
+
+from pyramid.settings import asbool
+from sqlalchemy import event
+
+from .pooling import engines
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# SQL fingerprints: the statement with literals and bound parameters as ?
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_PARAM = re.compile(r"%\(\w+\)s|%s|\?|\$\d+|\b\d+(?:\.\d+)?\b")
+_SQL_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SPACE = re.compile(r"\s+")
+MAX_STATEMENT = 500
+_fingerprints = {}
+
+
+def fingerprint(statement):
+    """``(normalized SQL, crc32 hex)`` for ``statement``, cached"""
+    result = _fingerprints.get(statement)
+    if result is None:
+        text = _SQL_STRING.sub('?', statement)
+        text = _SQL_PARAM.sub('?', text)
+        text = _SQL_LIST.sub('(?...)', text)
+        text = _SQL_SPACE.sub(' ', text).strip()[:MAX_STATEMENT]
+        result = (text, '%08x' % zlib.crc32(text.encode('utf-8')))
+        if len(_fingerprints) > 2000:
+            _fingerprints.clear()
+        _fingerprints[statement] = result
+    return result
+
+
+def _new_id(bits):
+    return '%0*x' % (bits // 4, random.getrandbits(bits))
+
+
+class Trace(object):
+    """Spans of one request: ``[span_id, parent, name, start_ns, end_ns, attributes]``"""
+
+    __slots__ = ('trace_id', 'parent_span_id', 'sampled', 'wall_ns', 'spans', '_stack')
+
+    def __init__(self, trace_id, parent_span_id=None, sampled=False):
+        self.trace_id = trace_id
+        self.parent_span_id = parent_span_id
+        self.sampled = sampled
+        self.wall_ns = time.time_ns() - time.perf_counter_ns()
+        self.spans = []
+        self._stack = []
+
+    def open(self, name, attributes):
+        record = [_new_id(64), self._stack[-1][0] if self._stack else self.parent_span_id,
+                  name, time.perf_counter_ns(), None, attributes]
+        self.spans.append(record)
+        self._stack.append(record)
+        return record
+
+    def close(self, record, error=None):
+        record[4] = time.perf_counter_ns()
+        if error is not None:
+            record[5]['error'] = error
+        if self._stack and self._stack[-1] is record:
+            self._stack.pop()
+        elif record in self._stack:
+            self._stack.remove(record)
+
+    def finish(self):
+        """End spans left open (e.g. a statement that raised) with the root"""
+        end = self.spans[0][4] or time.perf_counter_ns()
+        for record in self.spans:
+            if record[4] is None:
+                record[4] = end
+        self._stack = []
+
+    @property
+    def duration_ms(self):
+        root = self.spans[0]
+        return (root[4] - root[3]) / 1e6
+
+    def to_dict(self, service):
+        root = self.spans[0]
+        return {
+            'trace_id': self.trace_id,
+            'service': service,
+            'name': root[2],
+            'start': datetime.datetime.fromtimestamp((self.wall_ns + root[3]) / 1e9, datetime.timezone.utc)
+                             .isoformat(timespec='microseconds'),
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': root[5],
+            'spans': [{
+                'span_id': span_id,
+                'parent_id': parent,
+                'name': name,
+                'start_ms': round((start - root[3]) / 1e6, 3),
+                'duration_ms': round((end - start) / 1e6, 3),
+                'attributes': attributes,
+            } for span_id, parent, name, start, end, attributes in self.spans],
+        }
+
+    def to_otlp_spans(self):
+        spans = []
+        for span_id, parent, name, start, end, attributes in self.spans:
+            span = {
+                'traceId': self.trace_id,
+                'spanId': span_id,
+                'name': name,
+                'kind': 2 if parent == self.parent_span_id else 1,  # SERVER / INTERNAL
+                'startTimeUnixNano': str(self.wall_ns + start),
+                'endTimeUnixNano': str(self.wall_ns + end),
+                'attributes': [_otlp_attribute(key, value) for key, value in attributes.items()],
+                'status': {'code': 2} if 'error' in attributes else {},
+            }
+            if parent:
+                span['parentSpanId'] = parent
+            spans.append(span)
+        return spans
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class _Span(object):
+    __slots__ = ('trace', 'record')
+
+    def __init__(self, trace, record):
+        self.trace = trace
+        self.record = record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.close(self.record, exc_type.__name__ if exc_type is not None else None)
+        return False
+
+    def set(self, **attributes):
+        self.record[5].update(attributes)
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current_trace():
+    """The trace recording on this thread, or None"""
+    return getattr(_local, 'trace', None)
+
+
+def span(name, **attributes):
+    """Context manager recording a child span of the current one (no-op when not tracing)"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return NULL_SPAN
+    return _Span(trace, trace.open(name, attributes))
+
+
+def trace_tween(registry, name):
+    """Decorator for a tween function: record it as span ``name`` when tracing is on"""
+    def decorate(tween):
+        if registry.get('tracer') is None:
+            return tween
+
+        def traced_tween(request):
+            with span(name):
+                return tween(request)
+        return traced_tween
+    return decorate
+
+
+def traced_view(view, info):
+    """View deriver: the view callable (without rendering) as span ``view``"""
+    if info.registry.get('tracer') is None:
+        return view
+    name = getattr(info.original_view, '__name__', repr(info.original_view))
+
+    def traced(context, request):
+        with span('view', view=name):
+            return view(context, request)
+    return traced
+
+
+traced_view.options = ()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        text, fingerprint_id = fingerprint(statement)
+        conn.info['trace_span'] = trace.open('sql', {
+            'db.statement': text, 'db.fingerprint': fingerprint_id,
+        })
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = conn.info.pop('trace_span', None)
+    trace = getattr(_local, 'trace', None)
+    if record is not None and trace is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            record[5]['db.rows'] = cursor.rowcount
+        trace.close(record)
+
+
+def _handle_error(context):
+    connection = context.connection
+    record = connection.info.pop('trace_span', None) if connection is not None else None
+    trace = getattr(_local, 'trace', None)
+    if record is not None and trace is not None:
+        trace.close(record, type(context.original_exception).__name__)
+
+
+class Exporter(object):
+    """Background writer for finished traces (JSONL file or OTLP/HTTP JSON)"""
+
+    def __init__(self, mode, path=None, endpoint=None, service='aturmation', queue_size=1000):
+        if mode not in ('jsonl', 'otlp'):
+            raise ValueError('tracing.export must be jsonl or otlp')
+        self.mode = mode
+        self.path = path
+        self.endpoint = endpoint
+        self.service = service
+        self.queue = queue.Queue(queue_size)
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = None
+
+    def submit(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [trace for trace in batch if trace is not None]
+            if batch:
+                try:
+                    self.write(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    log.warning("Trace export failed (%d traces): %s", len(batch), e)
+            if stop:
+                return
+
+    def write(self, traces):
+        if self.mode == 'jsonl':
+            with open(self.path, 'a') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict(self.service), default=str) + '\n')
+            return
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.service)]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [span for trace in traces for span in trace.to_otlp_spans()],
+            }],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'exported': self.exported,
+                'dropped': self.dropped, 'failed': self.failed}
+
+
+class Tracer(object):
+    """Sampling decisions and trace start/finish for the tracing tween"""
+
+    def __init__(self, exporter, sample_rate=0.01, slow_ms=500.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ns = int(slow_ms * 1e6)
+
+    def start(self, request):
+        """``(trace_id, Trace or None)``; the trace is recording on this thread"""
+        trace_id, parent, sampled = None, None, False
+        match = _TRACEPARENT.match(request.headers.get('traceparent', ''))
+        if match is not None and match.group(1) != '0' * 32:
+            trace_id, parent = match.group(1), match.group(2)
+            sampled = bool(int(match.group(3), 16) & 1)
+        if trace_id is None:
+            trace_id = _new_id(128)
+        if not sampled and self.sample_rate and random.random() < self.sample_rate:
+            sampled = True
+        if not sampled and not self.slow_ns:
+            return trace_id, None
+        trace = _local.trace = Trace(trace_id, parent, sampled)
+        return trace_id, trace
+
+    def finish(self, trace):
+        """Stop recording; export when sampled or slow. Returns whether it was exported"""
+        _local.trace = None
+        trace.finish()
+        root = trace.spans[0]
+        if trace.sampled or (self.slow_ns and root[4] - root[3] >= self.slow_ns):
+            self.exporter.submit(trace)
+            return True
+        return False
+
+
+def tracing_tween_factory(handler, registry):
+    """
+    Tween tracing paling luar: membuat trace per request, meneruskan
+    ``traceparent`` dan mengekspor trace yang tersampel atau lambat.
+    """
+    tracer = registry.get('tracer')
+    if tracer is None:
+        return handler
+
+    def tracing_tween(request):
+        trace_id, trace = tracer.start(request)
+        if trace is None:
+            response = handler(request)
+            response.headers['X-Trace-Id'] = trace_id
+            response.headers['traceparent'] = '00-%s-%s-00' % (trace_id, _new_id(64))
+            return response
+
+        root = trace.open('request', {'http.method': request.method, 'http.path': request.path})
+        response = None
+        try:
+            response = handler(request)
+            return response
+        except Exception as e:
+            root[5]['error'] = type(e).__name__
+            raise
+        finally:
+            trace.close(root)
+            route = getattr(request, 'matched_route', None)
+            root[2] = '%s %s' % (request.method, route.name if route is not None else request.path)
+            if route is not None:
+                root[5]['http.route'] = route.name
+            if response is not None:
+                root[5]['http.status_code'] = response.status_code
+            exported = tracer.finish(trace)
+            if response is not None:
+                response.headers['X-Trace-Id'] = trace_id
+                response.headers['traceparent'] = '00-%s-%s-%s' % (trace_id, root[0], '01' if exported else '00')
+
+    return tracing_tween
+
+
+def includeme(config):
+    settings = config.get_settings()
+    # Under rendered_view: the span covers the view callable, ``render`` is separate
+    config.add_view_deriver(traced_view, under='rendered_view', over='mapped_view')
+    if not asbool(settings.get('tracing.enabled', False)):
+        config.registry['tracer'] = None
+        return
+    exporter = Exporter(
+        settings.get('tracing.export', 'jsonl'),
+        path=settings.get('tracing.file', 'traces.jsonl'),
+        endpoint=settings.get('tracing.otlp.endpoint', 'http://127.0.0.1:4318/v1/traces'),
+        service=settings.get('tracing.service_name', 'aturmation'),
+        queue_size=int(settings.get('tracing.queue_size', 1000)),
+    )
+    exporter.start()
+    config.registry['tracer'] = Tracer(
+        exporter,
+        sample_rate=float(settings.get('tracing.sample_rate', 0.01)),
+        slow_ms=float(settings.get('tracing.slow_ms', 500)),
+    )
+    for name, engine in engines(config.registry):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
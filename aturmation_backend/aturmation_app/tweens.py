@@ -1,71 +1,255 @@
 # aturmation_app/tweens.py
-from pyramid.settings import aslist
+from pyramid.settings import asbool, aslist
 import logging
+import time
+from pyramid.httpexceptions import HTTPException
 from pyramid.response import Response
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .cache import commit_product_invalidations
+from .dbstats import format_counters
+from .metrics import UNMATCHED
+from .models import get_open_dbsession
+from .security import commit_user_invalidations
+from .tracing import span, trace_tween
+
 log = logging.getLogger(__name__)
 
+DEFAULT_CORS_ORIGINS = 'http://localhost:5173'
+DEFAULT_CORS_METHODS = 'POST GET DELETE PUT PATCH OPTIONS'
+# X-Last-Write is sent back by clients for read-your-writes (see replicas.py)
+DEFAULT_CORS_HEADERS = 'Origin Content-Type Accept Authorization X-Last-Write'
+DEFAULT_CORS_EXPOSE_HEADERS = 'ETag Retry-After X-Last-Write'
+DEFAULT_CORS_MAX_AGE = 1728000
+
+
+class CORSPolicy(object):
+    """
+    Header sets for every allowed origin, built once from settings.
+
+    ``cors.manual.origins`` lists the allowed origins (``*`` allows any),
+    ``cors.credentials``, ``cors.methods``, ``cors.headers``,
+    ``cors.expose_headers`` and ``cors.max_age`` fill in the rest.
+    """
+
+    def __init__(self, origins, credentials=True, methods=DEFAULT_CORS_METHODS,
+                 headers=DEFAULT_CORS_HEADERS, expose_headers=DEFAULT_CORS_EXPOSE_HEADERS,
+                 max_age=DEFAULT_CORS_MAX_AGE):
+        self.any_origin = '*' in origins
+        self.credentials = credentials
+        self.methods = ','.join(m.upper() for m in aslist(methods))
+        self.headers = ', '.join(aslist(headers))
+        self.expose_headers = ', '.join(aslist(expose_headers))
+        self.max_age = str(max_age)
+        self.simple = {}
+        self.preflight = {}
+        for origin in origins:
+            if origin != '*':
+                self.simple[origin], self.preflight[origin] = self._build(origin)
+        if self.any_origin and not credentials:
+            self.simple['*'], self.preflight['*'] = self._build('*')
+
+    def _build(self, allow_origin):
+        simple = [('Access-Control-Allow-Origin', allow_origin)]
+        if self.credentials:
+            simple.append(('Access-Control-Allow-Credentials', 'true'))
+        if self.expose_headers:
+            simple.append(('Access-Control-Expose-Headers', self.expose_headers))
+        preflight = simple + [
+            ('Access-Control-Allow-Methods', self.methods),
+            ('Access-Control-Allow-Headers', self.headers),
+            ('Access-Control-Max-Age', self.max_age),
+        ]
+        return tuple(simple), tuple(preflight)
+
+    def lookup(self, origin):
+        """``(simple, preflight)`` header tuples for ``origin``, or None when not allowed"""
+        simple = self.simple.get(origin)
+        if simple is not None:
+            return simple, self.preflight[origin]
+        if not self.any_origin:
+            return None
+        if not self.credentials:
+            return self.simple['*'], self.preflight['*']
+        # Any origin with credentials: the origin has to be echoed back
+        return self._build(origin)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            aslist(settings.get('cors.manual.origins', DEFAULT_CORS_ORIGINS)),
+            credentials=asbool(settings.get('cors.credentials', True)),
+            methods=settings.get('cors.methods', DEFAULT_CORS_METHODS),
+            headers=settings.get('cors.headers', DEFAULT_CORS_HEADERS),
+            expose_headers=settings.get('cors.expose_headers', DEFAULT_CORS_EXPOSE_HEADERS),
+            max_age=int(settings.get('cors.max_age', DEFAULT_CORS_MAX_AGE)),
+        )
+
+
+def _vary_origin(response):
+    vary = response.vary
+    if not vary:
+        response.vary = ('Origin',)
+    elif 'Origin' not in vary:
+        response.vary = tuple(vary) + ('Origin',)
+
+
 def cors_tween_factory(handler, registry):
     """
-    Tween untuk menangani CORS secara lebih komprehensif
+    Tween CORS paling luar: preflight OPTIONS dijawab di sini sebelum
+    routing, auth dan session database; respons lain mendapat header
+    yang sudah dihitung saat startup.
     """
+    policy = CORSPolicy.from_settings(registry.settings)
+    # Header bergantung pada Origin kecuali semua origin dijawab dengan '*'
+    varies = not (policy.any_origin and not policy.credentials)
+
+    @trace_tween(registry, 'cors_tween')
     def cors_tween(request):
-        # Jika ini adalah OPTIONS request (preflight)
+        origin = request.headers.get('Origin')
+        headers = policy.lookup(origin) if origin else None
+
         if request.method == 'OPTIONS':
-            response = Response()
-            response.headers.update({
-                'Access-Control-Allow-Origin': 'http://localhost:5173',
-                'Access-Control-Allow-Methods': 'POST,GET,DELETE,PUT,OPTIONS',
-                'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization',
-                'Access-Control-Allow-Credentials': 'true',
-                'Access-Control-Max-Age': '1728000',
-            })
+            response = Response(status=204)
+            if headers is not None:
+                response.headerlist.extend(headers[1])
+            if varies:
+                response.headerlist.append(('Vary', 'Origin'))
             return response
-            
-        # Untuk request non-OPTIONS, proses seperti biasa
+
         response = handler(request)
-        
-        # Tambahkan header CORS ke semua respons
-        response.headers.update({
-            'Access-Control-Allow-Origin': 'http://localhost:5173',
-            'Access-Control-Allow-Methods': 'POST,GET,DELETE,PUT,OPTIONS',
-            'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization',
-            'Access-Control-Allow-Credentials': 'true',
-            'Access-Control-Max-Age': '1728000',
-        })
-        
+        if headers is not None:
+            response.headerlist.extend(headers[0])
+        if varies:
+            _vary_origin(response)
         return response
-        
+
     return cors_tween
 
+
+def metrics_tween_factory(handler, registry):
+    """
+    Tween metrik paling luar: mencatat latensi, kelas status, byte keluar
+    dan jumlah/waktu SQL per nama route (lihat metrics.py).
+    """
+    metrics = registry.get('metrics')
+    if metrics is None:
+        return handler
+
+    def metrics_tween(request):
+        started = time.perf_counter()
+        metrics.begin()
+        response = None
+        try:
+            response = handler(request)
+            return response
+        except HTTPException as e:
+            response = e
+            raise
+        finally:
+            route = getattr(request, 'matched_route', None)
+            metrics.observe(
+                route.name if route is not None else UNMATCHED,
+                response.status_code if response is not None else 500,
+                time.perf_counter() - started,
+                response.content_length if response is not None else 0,
+            )
+
+    return metrics_tween
+
+def profiling_tween_factory(handler, registry):
+    """
+    Tween profiling: request dengan header X-Profile yang benar dijalankan
+    di bawah cProfile dan hasilnya disimpan (lihat profiling.py).
+    """
+    profiler = registry.get('request_profiler')
+    if profiler is None:
+        return handler
+
+    def profiling_tween(request):
+        if profiler.wanted(request):
+            return profiler.run(handler, request)
+        return handler(request)
+
+    return profiling_tween
+
+# Requests with these methods only read unless the session holds ORM changes
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+def _has_writes(request, session):
+    """Whether ending the request needs a COMMIT rather than a plain close"""
+    if session.new or session.deleted or session.dirty:
+        return True
+    if not session.in_transaction():
+        return False
+    return request.method not in SAFE_METHODS or session.info.get('flushed', False)
+
+
+def _mark_flushed(session, flush_context):
+    session.info['flushed'] = True
+
+
+event.listen(Session, 'after_flush', _mark_flushed)
+
+
 def db_session_tween_factory(handler, registry):
     """
     Tween factory untuk mengelola session database.
-    Melakukan commit jika request berhasil, rollback jika ada exception.
+
+    Session hanya dibuat saat view memakai ``request.dbsession``; request
+    tanpa DB tidak membuka session maupun koneksi. Commit hanya dilakukan
+    jika ada perubahan (atau method tidak aman), rollback jika ada exception.
     """
+    counters_header = registry.get('db_counters_header', False)
+    replicas = registry.get('db_replicas')
+    auditor = registry.get('query_auditor')
+
+    @trace_tween(registry, 'db_session_tween')
     def db_session_tween(request):
         try:
-            # Process the request
             response = handler(request)
-            
-            # If there's a database session, commit changes
-            if hasattr(request, 'dbsession'):
+
+            # N+1, query duplikat dan budget query per route (lihat db.audit.* di .ini);
+            # dicek sebelum commit agar kegagalan mode strict tidak menyimpan tulisan
+            if auditor is not None:
+                auditor.check(request)
+            session = get_open_dbsession(request)
+            if session is not None and _has_writes(request, session):
                 try:
-                    request.dbsession.commit()
+                    with span('db.commit'):
+                        session.commit()
                 except Exception as e:
                     log.error(f"Error committing database session: {e}")
-                    request.dbsession.rollback()
+                    session.rollback()
                     raise
-            
+            # Hanya setelah commit berhasil, cache produk boleh dibuang
+            commit_product_invalidations(request)
+            if session is not None:
+                commit_user_invalidations(request, session)
+            # Baca-tulis konsisten: klien yang baru menulis dibaca dari primary
+            if replicas is not None and request.method not in SAFE_METHODS \
+                    and response.status_code < 400:
+                replicas.mark_write(response)
+
+            if counters_header:
+                response.headers['X-DB-Counters'] = format_counters(request.db_counters)
             return response
         except Exception:
             # If there's an exception, rollback any changes
-            if hasattr(request, 'dbsession'):
-                request.dbsession.rollback()
+            session = get_open_dbsession(request)
+            if session is not None:
+                session.rollback()
             raise
         finally:
-            # Close the session
-            if hasattr(request, 'dbsession'):
-                request.dbsession.close()
-    
-    return db_session_tween
\ No newline at end of file
+            # Close the session (returns its connection to the pool)
+            session = get_open_dbsession(request)
+            if session is not None:
+                session.close()
+            totals = registry.get('db_counters')
+            if totals is not None:
+                totals.finish_request(request.db_counters)
+
+    return db_session_tween
@@ -1,23 +1,32 @@
 import logging
 from pyramid.view import view_config
 from pyramid.response import Response
-from pyramid.httpexceptions import HTTPBadRequest, HTTPUnauthorized, HTTPInternalServerError
+from pyramid.httpexceptions import HTTPBadRequest, HTTPUnauthorized, HTTPInternalServerError, HTTPServiceUnavailable
 
 import sqlalchemy.exc
+from sqlalchemy import or_
 
 from ..models import User
 from ..models.user import UserRole
-from ..security import create_jwt_token
+from ..hashing import HashingBusy
+from ..replicas import replica_read
 
 log = logging.getLogger(__name__)
 
+
+def hashing_busy_response(e):
+    """503 asking the client to retry once the hashing queue has drained"""
+    return HTTPServiceUnavailable(json_body={
+        'status': 'error',
+        'message': 'Too many sign-in requests, please retry shortly'
+    }, headers={'Retry-After': str(e.retry_after)})
+
+
 @view_config(route_name='api_auth_register', request_method='POST', renderer='json')
 def auth_register_view(request):
     """Register a new user"""
-    log.debug("auth_register_view: Attempting to get JSON body...")
     try:
         data = request.json_body
-        log.debug(f"auth_register_view: Received JSON body (data): {data}")
     except ValueError:
         return Response(json_body={'status': 'error', 'message': 'Invalid JSON'}, status=400)
     except Exception as e:
@@ -33,7 +42,7 @@ def auth_register_view(request):
     email = data.get('email')
     password = data.get('password')
     
-    log.debug(f"auth_register_view: name='{name}', username='{username}', email='{email}', password='{bool(password)}'")
+    log.debug("auth_register_view: username=%r email=%r", username, email)
     
     # Basic validation
     if not all([name, username, email, password]):
@@ -43,34 +52,36 @@ def auth_register_view(request):
         }, status=400)
     
     try:
+        # Username dan email dicek dengan satu query
+        taken = request.dbsession.query(User.username, User.email).filter(
+            or_(User.username == username, User.email == email)
+        ).all()
+        
         # Check if username already exists
-        if request.dbsession.query(User).filter_by(username=username).first():
+        if any(row.username == username for row in taken):
             return Response(json_body={
                 'status': 'error', 
                 'message': 'Username already exists'
             }, status=400)
         
         # Check if email already exists
-        if request.dbsession.query(User).filter_by(email=email).first():
+        if taken:
             return Response(json_body={
                 'status': 'error', 
                 'message': 'Email already registered'
             }, status=400)
         
-        log.debug("auth_register_view: Basic validation passed. Proceeding to create user.")
-        
         # Create new user with staff role
         user = User(name=name, username=username, email=email)
-        user.set_password(password)
+        user.hashed_password = request.registry['password_hasher'].hash(password)
         user.role = UserRole.STAFF  # Use UserRole enum
         
         request.dbsession.add(user)
         request.dbsession.flush()  # To get the ID
-        log.debug(f"auth_register_view: Session flushed successfully. User ID: {user.id}")
+        log.debug("auth_register_view: created user %s", user.id)
         
         # Create and return JWT token
-        token = create_jwt_token(user.id, user.username)
-        log.debug("auth_register_view: JWT token created successfully.")
+        token = request.registry['token_service'].issue(user.id, user.username)
         
         return Response(json_body={
             'status': 'success',
@@ -78,6 +89,8 @@ def auth_register_view(request):
             'token': token,
             'user': user.to_dict()
         }, status=201)
+    except HashingBusy as e:
+        return hashing_busy_response(e)
     except sqlalchemy.exc.IntegrityError as e:
         log.error(f"auth_register_view: IntegrityError - {e}")
         return Response(json_body={
@@ -96,7 +109,6 @@ def auth_login_view(request):
     """Login a user"""
     try:
         data = request.json_body
-        log.debug(f"auth_login_view: Received JSON body: {data}")
     except ValueError:
         log.warning("auth_login_view: Invalid JSON")
         return Response(json_body={'status': 'error', 'message': 'Invalid JSON'}, status=400)
@@ -119,16 +131,22 @@ def auth_login_view(request):
     try:
         user = request.dbsession.query(User).filter_by(username=username).first()
         
-        if not user or not user.check_password(password):
-            log.warning(f"auth_login_view: Invalid login attempt for username '{username}'")
+        # bcrypt runs in the hashing pool, not on this thread
+        hasher = request.registry['password_hasher']
+        matches, needs_update = hasher.verify(password, user.hashed_password) if user else (False, False)
+        if not matches:
+            log.warning("auth_login_view: Invalid login attempt for username %r", username)
             return Response(json_body={
                 'status': 'error', 
                 'message': 'Invalid username or password'
             }, status=401)
         
+        if needs_update:
+            hasher.rehash_later(request.registry['dbsession_factory'], user.id, password, user.hashed_password)
+        
         # Create and return JWT token
-        token = create_jwt_token(user.id, user.username)
-        log.debug(f"auth_login_view: Login successful for '{username}'")
+        token = request.registry['token_service'].issue(user.id, user.username)
+        log.debug("auth_login_view: Login successful for %r", username)
         
         return Response(json_body={
             'status': 'success',
@@ -136,6 +154,9 @@ def auth_login_view(request):
             'token': token,
             'user': user.to_dict()
         })
+    except HashingBusy as e:
+        log.warning("auth_login_view: Hashing queue full, rejecting login for %r", username)
+        return hashing_busy_response(e)
     except Exception as e:
         log.error(f"auth_login_view: Error - {e}")
         return HTTPInternalServerError(json_body={
@@ -143,58 +164,58 @@ def auth_login_view(request):
             'message': 'Server error occurred'
         })
 
-@view_config(route_name='api_auth_me', renderer='json')
+@view_config(route_name='api_auth_logout', request_method='POST', renderer='json')
+def auth_logout_view(request):
+    """Revoke the bearer token; it stops working on every worker within jwt.revocation.refresh"""
+    claims = request.jwt_claims
+    if claims is None:
+        return Response(json_body={
+            'status': 'error',
+            'message': 'Not authenticated'
+        }, status=401)
+    try:
+        revoked = request.registry['token_service'].revoke(request.dbsession, claims)
+        return {
+            'status': 'success',
+            'message': 'Logged out' if revoked else 'Token cannot be revoked; it expires on its own'
+        }
+    except Exception as e:
+        log.error(f"auth_logout_view: Error - {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred'
+        })
+
+@view_config(route_name='api_auth_me', renderer='json', decorator=replica_read())
 def auth_me_view(request):
-    """Get the current authenticated user"""
+    """Get the current authenticated user (from the user cache when warm)"""
     try:
-        # Dapatkan user langsung dari token, bukan melalui request.user
-        auth_header = request.headers.get('Authorization', '')
-        if not auth_header.startswith('Bearer '):
-            return Response(json_body={
-                'status': 'error',
-                'message': 'Not authenticated'
-            }, status=401)
-        
-        token = auth_header.split(' ', 1)[1]
-        from ..security import parse_jwt_token
-        payload = parse_jwt_token(token)
-        if not payload:
+        if request.jwt_claims is None:
+            auth_header = request.headers.get('Authorization', '')
             return Response(json_body={
                 'status': 'error',
-                'message': 'Invalid token'
+                'message': 'Invalid token' if auth_header.startswith('Bearer ') else 'Not authenticated'
             }, status=401)
         
-        user_id = payload.get('sub')
-        if not user_id:
-            return Response(json_body={
-                'status': 'error',
-                'message': 'Invalid token payload'
-            }, status=401)
-        
-        from ..models import User
-        user = request.dbsession.query(User).filter_by(id=user_id).first()
-        
+        user = request.user_snapshot
         if not user:
             return Response(json_body={
                 'status': 'error',
                 'message': 'User not found'
             }, status=401)
         
-        # Buat dictionary user secara manual
-        user_data = {
-            'id': user.id,
-            'name': user.name,
-            'username': user.username,
-            'email': user.email,
-            'photo': user.photo
-        }
-        
         return Response(json_body={
             'status': 'success',
-            'user': user_data
+            'user': {
+                'id': user.id,
+                'name': user.name,
+                'username': user.username,
+                'email': user.email,
+                'role': user.role,
+                'photo': user.photo
+            }
         })
     except Exception as e:
-        log = logging.getLogger(__name__)
         log.error(f"auth_me_view: Error - {e}", exc_info=True)
         return HTTPInternalServerError(json_body={
             'status': 'error',
@@ -0,0 +1,97 @@
+# aturmation_app/views/batch_views.py
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPInternalServerError
+import logging
+
+from ..batch import BatchError, batch_delete, batch_update, summarize
+from ..cache import invalidate_product_caches
+from .product_views import DELETE_PERMISSION, EDIT_PERMISSION, _user_id
+
+log = logging.getLogger(__name__)
+
+
+def _changed_ids(results):
+    return [result['id'] for result in results if result['status'] in ('updated', 'deleted')]
+
+
+def _batch_items(request, shorthand=(), key='items'):
+    """
+    Read the item list from ``{"items": [...]}`` (or ``key``) or a bare JSON array.
+
+    ``shorthand`` names keys such as ``ids``/``skus`` that expand to items.
+    """
+    data = request.json_body
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON array or an object with "%s"' % key)
+    if not isinstance(data.get(key, []), list):
+        raise ValueError('"%s" must be an array' % key)
+    items = list(data.get(key) or [])
+    for name, field in shorthand:
+        items.extend({field: value} for value in data.get(name) or [])
+    return items
+
+
+@view_config(route_name='api_products_collection', request_method='PATCH', permission=EDIT_PERMISSION, renderer='json')
+def batch_update_products(request):
+    """Update many products, addressed by id or sku, in one transaction"""
+    try:
+        items = _batch_items(request)
+    except ValueError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e) or 'Invalid JSON'
+        })
+    try:
+        results = batch_update(request.dbsession.connection(), items, created_by=_user_id(request))
+        invalidate_product_caches(request, _changed_ids(results))
+        return {
+            'status': 'success',
+            'summary': summarize(results),
+            'results': results
+        }
+    except BatchError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e)
+        })
+    except Exception as e:
+        request.dbsession.rollback()
+        log.error(f"Error in batch_update_products: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while updating products'
+        })
+
+
+@view_config(route_name='api_products_batch_delete', request_method='POST', permission=DELETE_PERMISSION, renderer='json')
+def batch_delete_products(request):
+    """Delete many products by id or sku in one statement"""
+    try:
+        items = _batch_items(request, shorthand=(('ids', 'id'), ('skus', 'sku')))
+    except ValueError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e) or 'Invalid JSON'
+        })
+    try:
+        results = batch_delete(request.dbsession.connection(), items)
+        invalidate_product_caches(request, _changed_ids(results))
+        return {
+            'status': 'success',
+            'summary': summarize(results),
+            'results': results
+        }
+    except BatchError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e)
+        })
+    except Exception as e:
+        request.dbsession.rollback()
+        log.error(f"Error in batch_delete_products: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while deleting products'
+        })
@@ -0,0 +1,139 @@
+# aturmation_app/views/export_views.py
+from pyramid.view import view_config
+from pyramid.response import Response
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.settings import asbool
+from sqlalchemy import select
+import csv
+import io
+import json
+import logging
+import zlib
+
+from ..models import Product
+from .product_views import VIEW_PERMISSION, parse_fields
+
+log = logging.getLogger(__name__)
+
+# Rows fetched from the server-side cursor (and encoded) per chunk
+EXPORT_BATCH = 1000
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'products.ndjson'),
+    'csv': ('text/csv', 'products.csv'),
+}
+
+
+def _encode_row(fields, row):
+    """Match ``Product.to_dict`` value types for a Core result row"""
+    values = []
+    for field, value in zip(fields, row):
+        if value is not None:
+            if field == 'price':
+                value = float(value)
+            elif field in ('created_at', 'updated_at'):
+                value = value.isoformat()
+        values.append(value)
+    return values
+
+
+def stream_partitions(engine, fields, batch=EXPORT_BATCH):
+    """
+    Yield lists of product rows from a server-side cursor.
+
+    Uses its own connection rather than ``request.dbsession``: the WSGI
+    server iterates the body after ``db_session_tween`` has closed the
+    request session. The connection is released when the generator is
+    exhausted or closed.
+    """
+    statement = select(*[getattr(Product, field) for field in fields]).order_by(Product.id)
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=batch
+        ).execute(statement)
+        for partition in result.partitions():
+            yield partition
+
+
+def ndjson_chunks(partitions, fields):
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(fields, _encode_row(fields, row))), separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def csv_chunks(partitions, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in partitions:
+        writer.writerows(_encode_row(fields, row) for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a byte-chunk stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_body(engine, fmt, fields, compress=False):
+    """Build the streaming body iterator for an export"""
+    partitions = stream_partitions(engine, fields)
+    if fmt == 'csv':
+        chunks = csv_chunks(partitions, fields)
+    else:
+        chunks = ndjson_chunks(partitions, fields)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks
+
+
+@view_config(route_name='api_products_export', request_method='GET', permission=VIEW_PERMISSION)
+def export_products(request):
+    """
+    Stream the whole catalog as NDJSON or CSV.
+
+    ``format=ndjson|csv`` (default ndjson), ``fields=`` as for the list
+    endpoint, ``gzip=true`` (or ``Accept-Encoding: gzip``) compresses on
+    the fly. Memory stays flat regardless of table size.
+    """
+    fmt = request.params.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': 'format must be one of: %s' % ', '.join(sorted(EXPORT_FORMATS))
+        })
+    try:
+        fields = parse_fields(request) or Product.FIELDS
+    except ValueError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e)
+        })
+
+    # Without the header webob would accept anything, so only negotiate when it was sent
+    compress = asbool(request.params.get('gzip', False)) or (
+        'Accept-Encoding' in request.headers and
+        request.accept_encoding.best_match(['gzip', 'identity']) == 'gzip'
+    )
+    content_type, filename = EXPORT_FORMATS[fmt]
+
+    response = Response(
+        content_type=content_type,
+        charset='utf-8',
+        app_iter=export_body(request.registry['dbengine'], fmt, fields, compress),
+    )
+    response.content_disposition = 'attachment; filename="%s"' % filename
+    # The body depends on Accept-Encoding either way
+    response.vary = ('Accept-Encoding',)
+    if compress:
+        response.content_encoding = 'gzip'
+    return response
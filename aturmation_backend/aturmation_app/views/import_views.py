@@ -0,0 +1,59 @@
+# aturmation_app/views/import_views.py
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPInternalServerError
+import logging
+
+from ..cache import invalidate_product_caches
+from ..importer import DEFAULT_CHUNK_SIZE, IMPORT_FORMATS, import_products
+from .product_views import CREATE_PERMISSION, _user_id
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+@view_config(route_name='api_products_import', request_method='POST', permission=CREATE_PERMISSION, renderer='json')
+def import_products_view(request):
+    """
+    Bulk upsert products on SKU from a CSV or NDJSON request body.
+
+    The format comes from ``format=`` or the Content-Type. Invalid rows are
+    reported in ``import.errors`` without aborting the rest of the file.
+    Only the query string is read (``request.GET``): touching
+    ``request.params`` would consume the body as a form.
+    """
+    fmt = request.GET.get('format') or CONTENT_TYPE_FORMATS.get(request.content_type)
+    if fmt not in IMPORT_FORMATS:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': 'Send text/csv or application/x-ndjson, or pass format=csv|ndjson'
+        })
+    try:
+        chunk_size = int(request.GET.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    chunk_size = max(1, chunk_size)
+
+    try:
+        # Flushes nothing; just binds the import to the request transaction,
+        # which db_session_tween commits
+        connection = request.dbsession.connection()
+        result = import_products(connection, request.body_file, fmt, chunk_size, _user_id(request))
+        invalidate_product_caches(request)
+        log.info("Product import: %d received, %d upserted, %d failed, %d duplicates in %.1fs",
+                 result.received, result.upserted, result.failed, result.duplicates, result.elapsed)
+        return {
+            'status': 'success',
+            'import': result.to_dict()
+        }
+    except Exception as e:
+        request.dbsession.rollback()
+        log.error(f"Error in import_products_view: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while importing products'
+        })
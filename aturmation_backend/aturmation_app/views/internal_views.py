@@ -0,0 +1,38 @@
+# aturmation_app/views/internal_views.py
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPForbidden, HTTPNotFound
+from pyramid.response import Response
+from pyramid.security import NO_PERMISSION_REQUIRED
+import logging
+
+from .. import metrics
+from ..pooling import engines, pool_stats
+
+log = logging.getLogger(__name__)
+
+INTERNAL_PERMISSION = 'internal'
+
+
+@view_config(route_name='api_internal_db_stats', request_method='GET', permission=INTERNAL_PERMISSION, renderer='json')
+def db_stats(request):
+    """Live pool numbers per engine, replica health and per-process DB counters"""
+    registry = request.registry
+    replicas = registry.get('db_replicas')
+    counters = registry.get('db_counters')
+    return {
+        'status': 'success',
+        'pools': {name: pool_stats(engine) for name, engine in engines(registry)},
+        'replicas': replicas.stats() if replicas is not None else None,
+        'counters': counters.stats() if counters is not None else None,
+    }
+
+
+@view_config(route_name='metrics', request_method='GET', permission=NO_PERMISSION_REQUIRED)
+def prometheus_metrics(request):
+    """Request, SQL, pool and logging metrics in Prometheus text format"""
+    if request.registry.get('metrics') is None:
+        return HTTPNotFound()
+    if not metrics.allowed(request):
+        log.warning("Rejected /metrics scrape from %s", request.remote_addr)
+        return HTTPForbidden()
+    return Response(metrics.render(request.registry), content_type=metrics.CONTENT_TYPE, charset='utf-8')
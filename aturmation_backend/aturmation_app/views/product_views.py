@@ -3,11 +3,22 @@ from pyramid.view import view_config
 from pyramid.response import Response
 from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest, HTTPInternalServerError
 import sqlalchemy.exc
-from sqlalchemy import desc, or_
+from sqlalchemy import func, select
+from sqlalchemy.orm.attributes import set_committed_value
+import datetime
 import math
 import logging
 
-from ..models import Product
+from ..models import Product, StockMovement
+from ..cache import invalidate_product_caches
+from ..conditional import Validators, conditional, make_etag
+from ..product_cache import load_product
+from ..stock import set_stock
+from ..replicas import replica_read
+from ..queries import count_rows, fetch_product, select_products
+from ..renderers import RowList
+from ..counting import COUNT_EXACT, COUNT_MODES, count_products
+from ..pagination import InvalidCursor, keyset_order, keyset_seek, next_cursor_for
 
 log = logging.getLogger(__name__)
 
@@ -17,9 +28,92 @@ CREATE_PERMISSION = 'create'
 EDIT_PERMISSION = 'edit'
 DELETE_PERMISSION = 'delete'
 
-@view_config(route_name='api_products_collection', request_method='GET', renderer='json')
+# Larger dumps should use the streaming /api/v1/products/export
+MAX_PER_PAGE = 500
+
+
+def parse_fields(request):
+    """
+    Parse ``fields=name,sku,...`` into a tuple in ``Product.FIELDS`` order.
+
+    Returns None when the parameter is absent (full shape) and raises
+    ValueError listing any unknown field names.
+    """
+    raw = request.params.get('fields')
+    if not raw:
+        return None
+    requested = set(field.strip() for field in raw.split(',') if field.strip())
+    unknown = sorted(requested.difference(Product.FIELDS))
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(unknown))
+    return tuple(field for field in Product.FIELDS if field in requested)
+
+
+def _user_id(request):
+    try:
+        return int(request.authenticated_userid)
+    except (TypeError, ValueError):
+        return None
+
+
+def product_cache_enabled(request):
+    """Cache fills must come from the primary, so cached detail reads stay there"""
+    return request.registry['product_cache'] is not None
+
+
+def product_validators(request):
+    """Strong validators for one product: id, updated_at and the requested fields"""
+    try:
+        product_id = int(request.matchdict['id'])
+    except (TypeError, ValueError):
+        return None
+    if request.registry['product_cache'] is not None:
+        product = load_product(request, product_id)
+        updated_at = product and product['updated_at'] and \
+            datetime.datetime.fromisoformat(product['updated_at'])
+    else:
+        updated_at = request.dbsession.query(Product.updated_at).filter_by(id=product_id).scalar()
+    if not updated_at:
+        return None
+    etag = make_etag(product_id, updated_at.isoformat(), request.params.get('fields', ''))
+    return Validators(etag, False, updated_at)
+
+
+def collection_validators(request):
+    """
+    Weak validators for a list page: the query string plus max(updated_at)
+    and count(*) of the products its search matches, in one aggregate.
+
+    Both come from the database, so every worker derives the same ETag and
+    sees the others' writes: inserts and updates move max(updated_at), a
+    delete lowers the count.
+    """
+    query = select(func.max(Product.updated_at), func.count()).select_from(Product.__table__)
+    search = request.params.get('search', '')
+    if search:
+        query = request.registry['search_backend'].filter(query, search)
+    last_modified, total = request.dbsession.connection().execute(query).one()
+    etag = make_etag(
+        sorted(request.params.items()),
+        last_modified.isoformat() if last_modified else '',
+        total
+    )
+    # No Last-Modified: a delete does not move max(updated_at)
+    return Validators(etag, True, None)
+
+
+@view_config(route_name='api_products_collection', request_method='GET', renderer='json',
+             decorator=(replica_read(), conditional(collection_validators)))
 def get_products(request):
-    """Get all products with pagination"""
+    """
+    Get all products with pagination.
+
+    Supports the classic ``page``/``per_page`` offset contract and a keyset
+    mode: pass ``cursor`` (empty for the first page) and follow the returned
+    ``next_cursor``. Keyset pages cost the same no matter how deep they are.
+    ``count`` picks the total strategy, see ``aturmation_app.counting``.
+    ``fields`` limits the columns fetched and returned per product.
+    """
     try:
         try:
             page = int(request.params.get('page', 1))
@@ -29,54 +123,96 @@ def get_products(request):
             page = 1
             per_page = 10
             search = ''
+        cursor = request.params.get('cursor')
+        count_mode = request.params.get('count', request.registry['count_default'])
+        if count_mode not in COUNT_MODES:
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': 'count must be one of: %s' % ', '.join(COUNT_MODES)
+            })
+        try:
+            fields = parse_fields(request)
+        except ValueError as e:
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': str(e)
+            })
         
         if page < 1:
             page = 1
         if per_page < 1:
             per_page = 10
+        per_page = min(per_page, MAX_PER_PAGE)
         
-        query = request.dbsession.query(Product)
+        # Core select of just the needed columns; id and created_at are always
+        # selected because next_cursor is built from them
+        query = select_products(fields, 'id', 'created_at')
         
-        # Apply search filter if provided
+        # Search results are relevance-ranked in page mode; cursor mode keeps
+        # the (created_at, id) order so cursors stay valid
+        ranked = bool(search) and cursor is None
+        search_backend = request.registry['search_backend']
         if search:
-            query = query.filter(
-                or_(
-                    Product.name.ilike(f'%{search}%'),
-                    Product.sku.ilike(f'%{search}%'),
-                    Product.description.ilike(f'%{search}%')
-                )
-            )
+            query = search_backend.filter(query, search)
+        window_count = ranked and count_mode == COUNT_EXACT
+        if window_count:
+            # One round trip: the window count rides along with the page
+            query = query.add_columns(func.count().over().label('total_items'))
+        else:
+            # Count total items (before the keyset seek narrows the query)
+            total_items, count_mode = count_products(request, query, count_mode, search or None)
         
         # Apply ordering
-        query = query.order_by(desc(Product.created_at))
-        
-        # Count total items
-        total_items = query.count()
+        if ranked:
+            query = search_backend.order(query, search)
+        query = keyset_order(query, Product)
         
-        # Apply pagination
-        offset = (page - 1) * per_page
-        products = query.limit(per_page).offset(offset).all()
+        # Apply pagination, fetching one extra row to detect the next page
+        if cursor is not None:
+            page = None
+            if cursor:
+                try:
+                    query = keyset_seek(query, Product, cursor)
+                except InvalidCursor:
+                    return HTTPBadRequest(json_body={
+                        'status': 'error',
+                        'message': 'Invalid cursor'
+                    })
+            query = query.limit(per_page + 1)
+        else:
+            offset = (page - 1) * per_page
+            query = query.limit(per_page + 1).offset(offset)
+        connection = request.dbsession.connection()
+        rows = connection.execute(query).all()
         
-        total_pages = math.ceil(total_items / per_page) if total_items > 0 else 0
+        if window_count:
+            if rows:
+                total_items = rows[0].total_items
+            elif page > 1:
+                # Past the last match, so the window had nothing to count
+                total_items = count_rows(connection, query)
+            else:
+                total_items = 0
         
-        # Convert products to dict safely
-        product_list = []
-        for product in products:
-            try:
-                product_list.append(product.to_dict())
-            except Exception as e:
-                log.error(f"Error converting product to dict: {e}")
-                # Skip this product if there's an error
-                continue
+        products = rows[:per_page]
+        next_cursor = None if ranked else next_cursor_for(rows, per_page)
+        if total_items is None:
+            total_pages = None
+        else:
+            total_pages = math.ceil(total_items / per_page) if total_items > 0 else 0
         
         return {
             'status': 'success',
-            'products': product_list,
+            # Encoded by the fast renderer straight from the rows; extra
+            # trailing columns (created_at, total_items) are not emitted
+            'products': RowList(Product, fields or Product.FIELDS, products),
             'pagination': {
                 'total_items': total_items,
                 'page': page,
                 'per_page': per_page,
-                'total_pages': total_pages
+                'total_pages': total_pages,
+                'next_cursor': next_cursor,
+                'count_mode': count_mode
             }
         }
     except Exception as e:
@@ -86,12 +222,33 @@ def get_products(request):
             'message': 'Server error occurred while fetching products'
         })
 
-@view_config(route_name='api_product_detail', request_method='GET', renderer='json')
+@view_config(route_name='api_product_detail', request_method='GET', renderer='json',
+             decorator=(replica_read(unless=product_cache_enabled), conditional(product_validators)))
 def get_product(request):
-    """Get a single product by ID"""
+    """Get a single product by ID, optionally limited to ``fields``"""
     try:
-        product_id = request.matchdict['id']
-        product = request.dbsession.query(Product).filter_by(id=product_id).first()
+        try:
+            fields = parse_fields(request)
+        except ValueError as e:
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': str(e)
+            })
+        
+        try:
+            product_id = int(request.matchdict['id'])
+        except (TypeError, ValueError):
+            product_id = None
+        
+        if product_id is None:
+            product = None
+        elif request.registry['product_cache'] is not None:
+            # The read-through cache holds the full shape; trim it to ``fields``
+            product = load_product(request, product_id)
+            if product is not None and fields is not None:
+                product = {field: product[field] for field in fields}
+        else:
+            product = fetch_product(request.dbsession.connection(), product_id, fields)
         
         if not product:
             return HTTPNotFound(json_body={
@@ -101,7 +258,7 @@ def get_product(request):
         
         return {
             'status': 'success',
-            'product': product.to_dict()
+            'product': product
         }
     except Exception as e:
         log.error(f"Error in get_product: {e}")
@@ -155,6 +312,15 @@ def create_product(request):
         
         request.dbsession.add(product)
         request.dbsession.flush()
+        if product.stock:
+            request.dbsession.add(StockMovement(
+                product_id=product.id,
+                delta=product.stock,
+                stock_after=product.stock,
+                reason='initial',
+                created_by=_user_id(request)
+            ))
+        invalidate_product_caches(request, [product.id])
         
         return {
             'status': 'success',
@@ -214,10 +380,25 @@ def update_product(request):
             product.description = data['description']
         if 'price' in data:
             product.price = float(data['price'])  # Ensure price is float
-        if 'stock' in data:
-            product.stock = int(data['stock'])  # Ensure stock is integer
+        stock = int(data['stock']) if 'stock' in data else None  # Ensure stock is integer
         
         request.dbsession.flush()
+        if stock is not None:
+            # Absolute sets are still recorded in the ledger, with the old
+            # stock taken from the UPDATE itself; concurrent terminals should
+            # POST deltas to .../stock-movements instead
+            change = set_stock(request.dbsession.connection(), product.id, stock,
+                               created_by=_user_id(request))
+            if change is None:
+                # Deleted by another request since it was loaded
+                request.dbsession.rollback()
+                return HTTPNotFound(json_body={
+                    'status': 'error',
+                    'message': 'Product not found'
+                })
+            set_committed_value(product, 'stock', change.stock)
+            set_committed_value(product, 'updated_at', change.updated_at)
+        invalidate_product_caches(request, [product.id])
         
         return {
             'status': 'success',
@@ -261,6 +442,7 @@ def delete_product(request):
             })
         
         request.dbsession.delete(product)
+        invalidate_product_caches(request, [product.id])
         
         return {
             'status': 'success',
@@ -0,0 +1,121 @@
+# aturmation_app/views/stats_views.py
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPInternalServerError
+from sqlalchemy import Float, Integer, String, DateTime, case, cast, func, literal, null, select, union_all
+import datetime
+import logging
+
+from ..models import Product
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LOW_STOCK_THRESHOLD = 10
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 50
+
+# Columns shared by every branch of the stats UNION
+ROW_COLUMNS = ('kind', 'id', 'name', 'sku', 'price', 'stock', 'created_at', 'low_stock_count')
+
+
+def _top_n(kind, order_by, limit, where=None):
+    """One UNION branch: the first ``limit`` products by ``order_by``"""
+    inner = select(
+        literal(kind, String).label('kind'),
+        Product.id, Product.name, Product.sku, Product.price, Product.stock, Product.created_at,
+        cast(null(), Integer).label('low_stock_count'),
+    )
+    if where is not None:
+        inner = inner.where(where)
+    inner = inner.order_by(*order_by).limit(limit).subquery()
+    return select(*[inner.c[name] for name in ROW_COLUMNS])
+
+
+def _totals(low_stock_threshold):
+    """
+    Aggregate branch, reusing the product columns of the UNION:
+    id=product count, stock=total stock, price=inventory value.
+    """
+    low_stock = func.sum(case((Product.stock <= low_stock_threshold, 1), else_=0))
+    return select(
+        literal('totals', String).label('kind'),
+        func.count(Product.id).label('id'),
+        cast(null(), String).label('name'),
+        cast(null(), String).label('sku'),
+        cast(func.coalesce(func.sum(Product.price * Product.stock), 0), Float).label('price'),
+        cast(func.coalesce(func.sum(Product.stock), 0), Integer).label('stock'),
+        cast(null(), DateTime).label('created_at'),
+        cast(func.coalesce(low_stock, 0), Integer).label('low_stock_count'),
+    )
+
+
+def dashboard_stats(session, low_stock_threshold, limit):
+    """Compute every dashboard number in a single UNION ALL round trip"""
+    statement = union_all(
+        _totals(low_stock_threshold),
+        _top_n('low_stock', (Product.stock, Product.id), limit,
+               where=Product.stock <= low_stock_threshold),
+        _top_n('recent', (Product.created_at.desc(), Product.id.desc()), limit),
+        _top_n('top_priced', (Product.price.desc(), Product.id.desc()), limit),
+    )
+
+    stats = {
+        'totals': None,
+        'low_stock': [],
+        'recent': [],
+        'top_priced': [],
+    }
+    for row in session.execute(statement):
+        if row.kind == 'totals':
+            stats['totals'] = {
+                'total_products': row.id,
+                'total_stock': row.stock,
+                'inventory_value': float(row.price),
+                'low_stock_count': row.low_stock_count,
+            }
+            continue
+        stats[row.kind].append({
+            'id': row.id,
+            'name': row.name,
+            'sku': row.sku,
+            'price': float(row.price) if row.price is not None else None,
+            'stock': row.stock,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+        })
+    return stats
+
+
+@view_config(route_name='api_products_stats', request_method='GET', renderer='json')
+def get_product_stats(request):
+    """Dashboard aggregates: counts, stock, inventory value and top-N lists"""
+    try:
+        try:
+            threshold = int(request.params.get('low_stock_threshold', DEFAULT_LOW_STOCK_THRESHOLD))
+            limit = int(request.params.get('limit', DEFAULT_TOP_N))
+        except (ValueError, TypeError):
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': 'low_stock_threshold and limit must be integers'
+            })
+        limit = max(1, min(limit, MAX_TOP_N))
+
+        cache = request.registry['stats_cache']
+        key = (threshold, limit)
+        stats = cache.get(key)
+        cached = stats is not None
+        if not cached:
+            generation = cache.generation
+            stats = dashboard_stats(request.dbsession, threshold, limit)
+            stats['generated_at'] = datetime.datetime.utcnow().isoformat()
+            cache.set(key, stats, generation)
+
+        return {
+            'status': 'success',
+            'stats': stats,
+            'cached': cached
+        }
+    except Exception as e:
+        log.error(f"Error in get_product_stats: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while computing product stats'
+        })
@@ -0,0 +1,98 @@
+# aturmation_app/views/stock_views.py
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest, HTTPConflict, HTTPInternalServerError, HTTPNotFound
+from pyramid.settings import asbool
+import logging
+
+from ..batch import summarize
+from ..cache import invalidate_product_caches
+from ..stock import StockError, apply_movements
+from .batch_views import _batch_items
+from .product_views import EDIT_PERMISSION
+
+log = logging.getLogger(__name__)
+
+
+def _apply(request, items):
+    """Apply ``items`` in the request transaction, which ``db_session_tween`` commits"""
+    try:
+        created_by = int(request.authenticated_userid)
+    except (TypeError, ValueError):
+        created_by = None
+    allow_negative = asbool(request.registry.settings.get('products.stock.allow_negative', False))
+    results = apply_movements(request.dbsession.connection(), items, created_by, allow_negative)
+    invalidate_product_caches(
+        request, [result['id'] for result in results if result['status'] == 'applied']
+    )
+    return results
+
+
+@view_config(route_name='api_product_stock_movements', request_method='POST', permission=EDIT_PERMISSION, renderer='json')
+def create_stock_movement(request):
+    """Apply one stock delta to a product: ``{"delta": -2, "reason": "sale", "reference": "..."}``"""
+    try:
+        try:
+            data = request.json_body
+        except ValueError:
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': 'Invalid JSON'
+            })
+        if not isinstance(data, dict):
+            return HTTPBadRequest(json_body={
+                'status': 'error',
+                'message': 'Expected a JSON object'
+            })
+        item = dict(data, product_id=request.matchdict['id'])
+        item.pop('sku', None)
+        result = _apply(request, [item])[0]
+
+        if result['status'] == 'invalid':
+            return HTTPBadRequest(json_body={'status': 'error', 'message': result['message']})
+        if result['status'] == 'not_found':
+            return HTTPNotFound(json_body={'status': 'error', 'message': result['message']})
+        if result['status'] == 'insufficient_stock':
+            return HTTPConflict(json_body={'status': 'error', 'message': result['message']})
+        return {
+            'status': 'success',
+            'product': {'id': result['id'], 'sku': result['sku'], 'stock': result['stock']},
+            'delta': result['delta']
+        }
+    except Exception as e:
+        request.dbsession.rollback()
+        log.error(f"Error in create_stock_movement: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while adjusting stock'
+        })
+
+
+@view_config(route_name='api_products_stock_movements', request_method='POST', permission=EDIT_PERMISSION, renderer='json')
+def create_stock_movements(request):
+    """Apply many stock deltas, addressed by product_id or sku, in one transaction"""
+    try:
+        items = _batch_items(request, key='movements')
+    except ValueError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e) or 'Invalid JSON'
+        })
+    try:
+        results = _apply(request, items)
+        return {
+            'status': 'success',
+            'summary': summarize(results),
+            'results': results
+        }
+    except StockError as e:
+        return HTTPBadRequest(json_body={
+            'status': 'error',
+            'message': str(e)
+        })
+    except Exception as e:
+        request.dbsession.rollback()
+        log.error(f"Error in create_stock_movements: {e}")
+        return HTTPInternalServerError(json_body={
+            'status': 'error',
+            'message': 'Server error occurred while adjusting stock'
+        })
@@ -0,0 +1,89 @@
+# benchmarks/bench_cors.py
+"""
+Per-request CORS overhead: old three-part setup vs. the precomputed tween.
+
+    python benchmarks/bench_cors.py --requests 5000
+
+Both apps load the real route table and one trivial view on
+/api/v1/products, so only the CORS wiring differs. "legacy" is the old
+NewRequest subscriber + response callback, the tween that rebuilt the
+header dict on every response and the catch-all ``{path:.*}`` OPTIONS
+route. Timings cover --requests WSGI calls each.
+"""
+import argparse
+
+from pyramid.config import Configurator
+from pyramid.events import NewRequest
+from pyramid.response import Response
+from pyramid.tweens import INGRESS
+from webob import Request
+
+import common  # noqa: F401  (puts the app on sys.path)
+from common import measure, report
+
+ORIGIN = 'http://localhost:5173'
+LEGACY_HEADERS = {
+    'Access-Control-Allow-Origin': ORIGIN,
+    'Access-Control-Allow-Methods': 'POST,GET,DELETE,PUT,PATCH,OPTIONS',
+    'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization',
+    'Access-Control-Allow-Credentials': 'true',
+    'Access-Control-Max-Age': '1728000',
+}
+
+
+def legacy_cors_tween_factory(handler, registry):
+    def cors_tween(request):
+        if request.method == 'OPTIONS':
+            response = Response()
+            response.headers.update(dict(LEGACY_HEADERS))
+            return response
+        response = handler(request)
+        response.headers.update(dict(LEGACY_HEADERS))
+        return response
+    return cors_tween
+
+
+def products_view(request):
+    return Response(body=b'{"status": "success", "products": []}', content_type='application/json')
+
+
+def make_app(legacy):
+    config = Configurator(settings={'cors.manual.origins': ORIGIN})
+    config.include('aturmation_app.routes')
+    config.add_view(products_view, route_name='api_products_collection', request_method='GET')
+    if legacy:
+        def add_cors_headers_response_callback(event):
+            def cors_headers(request, response):
+                response.headers.update(dict(LEGACY_HEADERS))
+            event.request.add_response_callback(cors_headers)
+        config.add_subscriber(add_cors_headers_response_callback, NewRequest)
+        config.add_route('cors_preflight', '{path:.*}')
+        config.add_view(lambda request: Response(), route_name='cors_preflight', request_method='OPTIONS')
+        config.add_tween('bench_cors.legacy_cors_tween_factory', over='pyramid.tweens.excview_tween_factory')
+    else:
+        config.add_tween('aturmation_app.tweens.cors_tween_factory', under=INGRESS)
+    return config.make_wsgi_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    get = Request.blank('/api/v1/products', headers={'Origin': ORIGIN}).environ
+    preflight = Request.blank('/api/v1/products/42', method='OPTIONS', headers={
+        'Origin': ORIGIN, 'Access-Control-Request-Method': 'PUT'
+    }).environ
+
+    for label, legacy in (('legacy', True), ('tween', False)):
+        app = make_app(legacy)
+        for name, environ in (('GET', get), ('OPTIONS preflight', preflight)):
+            def run():
+                for _ in range(args.requests):
+                    b''.join(Request(dict(environ)).get_response(app).app_iter)
+            report('%-6s %s' % (label, name), measure(run, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_export.py
+"""
+Streaming export throughput and memory.
+
+    python benchmarks/bench_export.py --url postgresql://... --rows 5000000
+
+Drives the same body iterator GET /api/v1/products/export hands to the WSGI
+server and samples RSS while it runs. Peak RSS should stay flat as --rows
+grows; --legacy additionally loads every row through the ORM for contrast.
+"""
+import argparse
+import resource
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from common import DEFAULT_URL, make_engine, seed_products
+from aturmation_app.models import Product
+from aturmation_app.views.export_views import export_body
+
+
+def current_rss_mb():
+    """Resident set size from /proc (Linux); falls back to peak RSS elsewhere"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 1048576.0
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, interval=0.05):
+        super(RSSSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run(label, fn):
+    baseline = current_rss_mb()
+    sampler = RSSSampler()
+    sampler.start()
+    started = time.perf_counter()
+    rows, size = fn()
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+    print('%-18s %9d rows %9.1f MB out %7.1fs %9.0f rows/s   RSS base %6.1f MB peak %6.1f MB (+%.1f)' % (
+        label, rows, size / 1048576.0, elapsed, rows / elapsed, baseline,
+        sampler.peak, sampler.peak - baseline))
+
+
+def streamed(engine, fmt, compress, rows):
+    def consume():
+        size = 0
+        for chunk in export_body(engine, fmt, Product.FIELDS, compress):
+            size += len(chunk)
+        return rows, size
+    return consume
+
+
+def legacy(engine):
+    def consume():
+        session = sessionmaker(bind=engine)()
+        products = [product.to_dict() for product in session.query(Product).all()]
+        session.close()
+        return len(products), 0
+    return consume
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    rows = seed_products(engine, args.rows)
+
+    run('export %s%s' % (args.format, '.gz' if args.gzip else ''),
+        streamed(engine, args.format, args.gzip, rows))
+    if args.legacy:
+        run('orm list', legacy(engine))
+
+
+if __name__ == '__main__':
+    main()
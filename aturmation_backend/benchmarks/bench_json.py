@@ -0,0 +1,65 @@
+# benchmarks/bench_json.py
+"""
+Serialization cost of one product list page: to_dict loop vs. RowList.
+
+    python benchmarks/bench_json.py --per-page 500
+
+Rows are loaded once (as ORM instances and as plain result rows); only the
+rendering is timed. "legacy" is the old to_dict + try/except loop encoded
+with the stdlib like Pyramid's stock JSON renderer.
+"""
+import argparse
+import json
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from common import DEFAULT_URL, make_engine, measure, report, seed_products
+from aturmation_app.models import Product
+from aturmation_app.renderers import RowList, orjson, orjson_dumps, stdlib_dumps
+
+
+def legacy_render(products):
+    product_list = []
+    for product in products:
+        try:
+            product_list.append(product.to_dict())
+        except Exception:
+            continue
+    return json.dumps({'status': 'success', 'products': product_list}).encode('utf-8')
+
+
+def rowlist_render(dumps, rows):
+    return dumps({'status': 'success', 'products': RowList(Product, Product.FIELDS, rows)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--per-page', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    seed_products(engine, args.rows)
+    session = sessionmaker(bind=engine)()
+    instances = session.query(Product).order_by(Product.id).limit(args.per_page).all()
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(*[getattr(Product, field) for field in Product.FIELDS])
+            .order_by(Product.id).limit(args.per_page)
+        ).all()
+    assert json.loads(legacy_render(instances)) == json.loads(rowlist_render(stdlib_dumps, rows))
+    print('per page: %d, orjson: %s' % (len(rows), 'yes' if orjson else 'not installed'))
+
+    report('legacy to_dict + json', measure(lambda: legacy_render(instances), args.repeat))
+    report('RowList stdlib (ORM)', measure(lambda: rowlist_render(stdlib_dumps, instances), args.repeat))
+    report('RowList stdlib (rows)', measure(lambda: rowlist_render(stdlib_dumps, rows), args.repeat))
+    if orjson is not None:
+        report('RowList orjson (ORM)', measure(lambda: rowlist_render(orjson_dumps, instances), args.repeat))
+        report('RowList orjson (rows)', measure(lambda: rowlist_render(orjson_dumps, rows), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
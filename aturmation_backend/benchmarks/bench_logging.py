@@ -0,0 +1,123 @@
+# benchmarks/bench_logging.py
+"""
+Request throughput under the old and the new logging setup.
+
+    python benchmarks/bench_logging.py --threads 4 --duration 5
+
+Serves GET /api/v1/products?per_page=20 in-process from --threads threads
+and counts requests per second. Log output goes to a file in a temporary
+directory; --sink-latency adds a sleep per write to stand in for a
+terminal, a pipe to a log shipper or a slow disk. Modes:
+
+legacy       basicConfig(DEBUG) + sqlalchemy.engine INFO, written from the
+             request threads (the old __init__.py and development.ini)
+queued       same levels, but behind the queue listener
+production   logging.profile = production (JSON, SQL at WARNING, queued)
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from webob import Request
+
+from common import seed_products
+from aturmation_app import main as make_app
+from aturmation_app.logs import logging_stats, stop_logging
+from aturmation_app.models import User, get_engine, get_session_factory
+
+
+class SlowFile(object):
+    """File whose writes block for ``latency`` seconds"""
+
+    def __init__(self, path, latency):
+        self.file = open(path, 'a')
+        self.latency = latency
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def reset_logging(path, level, latency):
+    stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    for name in ('aturmation_app', 'sqlalchemy.engine'):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    logging.basicConfig(level=level, stream=SlowFile(path, latency))
+
+
+def run(app, token, threads, duration):
+    environ = Request.blank('/api/v1/products?per_page=20', headers={
+        'Authorization': 'Bearer ' + token
+    }).environ
+    counts = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        while time.perf_counter() < deadline:
+            Request(dict(environ)).get_response(app)
+            counts[index] += 1
+
+    workers = [threading.Thread(target=client, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--sink-latency', type=float, default=0.05, help='ms per log write')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings = {
+        'sqlalchemy.url': 'sqlite:///' + os.path.join(directory, 'logging.sqlite'),
+        'auth.hash.workers': '0',
+        'auth.bcrypt.rounds': '4',
+        'products.cache.enabled': 'false',
+    }
+    engine = get_engine(settings)
+    seed_products(engine, 1000)
+    session = get_session_factory(engine)()
+    session.add(User(name='Bench', username='bench', email='bench@example.com', role='staff',
+                     hashed_password='-'))
+    session.commit()
+    session.close()
+
+    modes = (
+        ('legacy', logging.DEBUG, {'logging.async': 'false'}),
+        ('queued', logging.DEBUG, {}),
+        ('production', logging.DEBUG, {'logging.profile': 'production'}),
+    )
+    for label, level, extra in modes:
+        path = os.path.join(directory, label + '.log')
+        reset_logging(path, level, args.sink_latency / 1000.0)
+        logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+        app = make_app({}, **dict(settings, **extra))
+        token = app.registry['token_service'].issue(1, 'bench')
+        rate = run(app, token, args.threads, args.duration)
+        stats = logging_stats()
+        stop_logging()
+        print('%-11s %8.0f req/s   log %7.1f MB   dropped %d' % (
+            label, rate, os.path.getsize(path) / 1e6, stats['dropped']))
+
+
+if __name__ == '__main__':
+    main()
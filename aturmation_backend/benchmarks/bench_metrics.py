@@ -0,0 +1,108 @@
+# benchmarks/bench_metrics.py
+"""
+Request-time overhead of the metrics tween and SQL cursor listeners.
+
+    python benchmarks/bench_metrics.py --requests 500 --repeat 15
+
+Builds the full app twice on one seeded SQLite file, with
+``metrics.enabled`` true and false, and times --requests WSGI calls per
+endpoint. Runs of the two apps alternate (swapping who goes first) and
+the fastest run of each is compared, since scheduler noise on a shared
+machine is easily larger than the 2% target.
+
+"direct" times just the work the metrics add to one request on this
+endpoint (tween bookkeeping plus the cursor listeners for the number of
+statements it ran) and gives it as a share of the request's own time.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from webob import Request
+
+from common import seed_products
+from aturmation_app import main as make_app
+from aturmation_app.models import User, get_engine, get_session_factory
+
+ENDPOINTS = (
+    ('products list', '/api/v1/products?per_page=20'),
+    ('product detail', '/api/v1/products/42'),
+    ('auth/me', '/api/v1/auth/me'),
+)
+
+
+def metrics_route(app, path):
+    request = Request.blank(path)
+    return app.routes_mapper(request)['route'].name
+
+
+def timed(app, environ, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        b''.join(Request(dict(environ)).get_response(app).app_iter)
+    return (time.perf_counter() - started) * 1000.0
+
+
+def instrumentation_ms(metrics, statements, requests):
+    """Time ``requests`` rounds of what the tween and listeners do per request"""
+    before, after = metrics._before_cursor_execute, metrics._after_cursor_execute
+    started = time.perf_counter()
+    for _ in range(requests):
+        metrics.begin()
+        for _ in range(statements):
+            before(None, None, None, None, None, False)
+            after(None, None, None, None, None, False)
+        metrics.observe('bench', 200, 0.001, 1000)
+    return (time.perf_counter() - started) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=15)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings = {
+        'sqlalchemy.url': 'sqlite:///' + os.path.join(directory, 'metrics.sqlite'),
+        'auth.hash.workers': '0',
+        'products.cache.enabled': 'false',
+        'logging.async': 'false',
+        'logging.levels': 'root:WARNING aturmation_app:WARNING sqlalchemy.engine:WARNING',
+    }
+    engine = get_engine(settings)
+    seed_products(engine, 1000)
+    session = get_session_factory(engine)()
+    session.add(User(name='Bench', username='bench', email='bench@example.com', role='staff',
+                     hashed_password='-'))
+    session.commit()
+    session.close()
+
+    apps = {
+        'off': make_app({}, **dict(settings, **{'metrics.enabled': 'false'})),
+        'on': make_app({}, **dict(settings, **{'metrics.enabled': 'true'})),
+    }
+    token = apps['on'].registry['token_service'].issue(1, 'bench')
+
+    metrics = apps['on'].registry['metrics']
+    print('%-15s %10s %10s %9s %8s %9s' % ('endpoint', 'off ms', 'on ms', 'overhead', 'sql/req', 'direct'))
+    for label, path in ENDPOINTS:
+        environ = Request.blank(path, headers={'Authorization': 'Bearer ' + token}).environ
+        for app in apps.values():
+            timed(app, environ, args.requests // 5)
+        times = {'off': [], 'on': []}
+        for run in range(args.repeat):
+            for name in (('off', 'on') if run % 2 else ('on', 'off')):
+                times[name].append(timed(apps[name], environ, args.requests))
+        off, on = min(times['off']), min(times['on'])
+
+        stats = metrics.snapshot()[metrics_route(apps['on'], path)]
+        statements = round(stats.sql_statements / float(sum(stats.statuses)))
+        direct = instrumentation_ms(metrics, statements, args.requests)
+        print('%-15s %10.1f %10.1f %8.2f%% %8d %8.2f%%' % (
+            label, off, on, (on - off) / off * 100.0, statements, direct / off * 100.0))
+
+
+if __name__ == '__main__':
+    main()
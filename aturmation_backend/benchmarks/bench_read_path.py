@@ -0,0 +1,81 @@
+# benchmarks/bench_read_path.py
+"""
+Listing read path: ORM instances vs. Core select rows.
+
+    python benchmarks/bench_read_path.py --url postgresql://... --per-request 10000
+
+Fetches one page the way get_products does and turns it into the response
+dicts, once through session.query(Product) + to_dict (the old path) and
+once through aturmation_app.queries + RowList. Reports wall time, CPU time
+per row and peak Python allocations (tracemalloc) per request.
+"""
+import argparse
+import time
+import tracemalloc
+
+from sqlalchemy import desc
+from sqlalchemy.orm import sessionmaker
+
+from common import DEFAULT_URL, make_engine, measure, report, seed_products
+from aturmation_app.models import Product
+from aturmation_app.queries import select_products
+from aturmation_app.renderers import RowList
+
+
+def orm_page(session, limit):
+    products = session.query(Product).order_by(
+        desc(Product.created_at), desc(Product.id)
+    ).limit(limit).all()
+    result = [product.to_dict() for product in products]
+    session.close()
+    return result
+
+
+def core_page(session, limit):
+    statement = select_products(None).order_by(
+        desc(Product.created_at), desc(Product.id)
+    ).limit(limit)
+    rows = session.connection().execute(statement).all()
+    result = RowList(Product, Product.FIELDS, rows).to_dicts()
+    session.close()
+    return result
+
+
+def cpu_per_row(fn, rows, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) / repeat / rows * 1e6
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1048576.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--per-request', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    seed_products(engine, args.rows)
+    session = sessionmaker(bind=engine)()
+    limit = args.per_request
+    assert orm_page(session, 50) == core_page(session, 50)
+
+    for label, fn in (('orm', lambda: orm_page(session, limit)),
+                      ('core', lambda: core_page(session, limit))):
+        report('%s %d rows' % (label, limit), measure(fn, args.repeat))
+        print('%-40s cpu %6.2f us/row   peak alloc %7.1f MB' % (
+            '', cpu_per_row(fn, limit, args.repeat), peak_memory(fn)))
+
+
+if __name__ == '__main__':
+    main()
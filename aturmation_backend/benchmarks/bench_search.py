@@ -0,0 +1,65 @@
+# benchmarks/bench_search.py
+"""
+Product search latency: indexed backend vs. the old triple ILIKE.
+
+    python benchmarks/bench_search.py --url postgresql://... --rows 1000000
+
+Seeds the catalog on first run (reused afterwards) and times one page of
+search results the way ``get_products`` builds it.
+"""
+import argparse
+
+from sqlalchemy import desc, func, or_
+from sqlalchemy.orm import sessionmaker
+
+from common import DEFAULT_URL, make_engine, measure, report, seed_products
+from aturmation_app.models import Product
+from aturmation_app.search import get_search_backend
+
+TERMS = ('SKU-0004217', 'premium', 'steel bolt', 'washer 9999')
+
+
+def indexed_page(session, backend, term, per_page=10):
+    query = backend.filter(session.query(Product), term)
+    query = query.add_columns(func.count().over().label('total_items'))
+    query = backend.order(query, term).order_by(desc(Product.created_at), desc(Product.id))
+    return query.limit(per_page + 1).all()
+
+
+def legacy_page(session, term, per_page=10):
+    query = session.query(Product).filter(
+        or_(
+            Product.name.ilike(f'%{term}%'),
+            Product.sku.ilike(f'%{term}%'),
+            Product.description.ilike(f'%{term}%')
+        )
+    ).order_by(desc(Product.created_at))
+    query.count()
+    return query.limit(per_page).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    seed_products(engine, args.rows)
+    backend = get_search_backend(engine.dialect.name)
+    session = sessionmaker(bind=engine)()
+    print('backend: %s, rows: %d' % (backend.name, args.rows))
+
+    for term in TERMS:
+        report('%s %r' % (backend.name, term),
+               measure(lambda: indexed_page(session, backend, term), args.repeat))
+        if not args.skip_legacy:
+            report('legacy ilike %r' % term,
+                   measure(lambda: legacy_page(session, term), max(3, args.repeat // 5)))
+        session.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/bench_stock.py
+"""
+Concurrent stock adjustments on one SKU: atomic deltas vs. read-modify-write.
+
+    python benchmarks/bench_stock.py --url postgresql://... --writers 50
+
+Each writer thread applies --per-writer sales (delta -1) to the same
+product. "atomic" goes through aturmation_app.stock.apply_movements in a
+short transaction per movement (what POST .../stock-movements does);
+"legacy" loads the product with the ORM and assigns an absolute stock like
+update_product. Reports movements/s and how many updates were lost.
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import sessionmaker
+
+from common import DEFAULT_URL, make_engine, seed_products
+from aturmation_app.models import Product
+from aturmation_app.stock import apply_movements
+
+START_STOCK = 1000000
+
+
+def atomic_movement(engine, sessions, product_id, delta):
+    with engine.begin() as connection:
+        result = apply_movements(connection, [{'product_id': product_id, 'delta': delta, 'reason': 'bench'}])[0]
+    if result['status'] != 'applied':
+        raise RuntimeError(result)
+
+
+def legacy_movement(engine, sessions, product_id, delta):
+    session = sessions()
+    try:
+        product = session.query(Product).filter_by(id=product_id).first()
+        product.stock = product.stock + delta
+        session.commit()
+    finally:
+        session.close()
+
+
+def run(engine, movement, product_id, writers, per_writer):
+    sessions = sessionmaker(bind=engine)
+    errors = []
+    expected = [0]
+    lock = threading.Lock()
+
+    def writer():
+        applied = 0
+        for _ in range(per_writer):
+            try:
+                movement(engine, sessions, product_id, -1)
+                applied -= 1
+            except Exception as e:
+                errors.append(e)
+        with lock:
+            expected[0] += applied
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        stock = connection.execute(select(Product.stock).where(Product.id == product_id)).scalar()
+    lost = stock - (START_STOCK + expected[0])
+    return (writers * per_writer) / elapsed, lost, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--per-writer', type=int, default=100)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url, pool_size=args.writers, max_overflow=0,
+                         connect_args={'timeout': 60} if args.url.startswith('sqlite') else {})
+    seed_products(engine, 1000)
+    with engine.connect() as connection:
+        product_id = connection.execute(select(Product.id).order_by(Product.id).limit(1)).scalar()
+
+    for label, movement in (('atomic', atomic_movement), ('legacy', legacy_movement)):
+        with engine.begin() as connection:
+            connection.execute(update(Product.__table__).where(Product.id == product_id).values(stock=START_STOCK))
+        rate, lost, errors = run(engine, movement, product_id, args.writers, args.per_writer)
+        print('%-8s %d writers x %d   %8.0f movements/s   lost updates %6d   errors %d' % (
+            label, args.writers, args.per_writer, rate, lost, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/bench_tokens.py
+"""
+Cost of verifying bearer tokens: raw pyjwt decode vs. TokenService cold/warm.
+
+    python benchmarks/bench_tokens.py --tokens 1000 --revoked 10000
+
+Each timing covers one pass over --tokens distinct tokens. "cold" clears the
+verified-token cache before every pass, so every token is HMAC-checked and
+decoded; "warm" is the steady state of a client reusing its token. The
+revocation list is seeded with --revoked jtis, so every pass also pays for
+the bloom filter check (and, rarely, a confirming query on a false positive).
+"""
+import argparse
+import datetime
+import uuid
+
+import jwt
+from sqlalchemy import delete, insert
+
+from common import DEFAULT_URL, make_engine, measure, report
+from aturmation_app.models import RevokedToken
+from aturmation_app.models.meta import Base
+from aturmation_app.tokens import JWT_ALGORITHM, RevocationList, TokenService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--tokens', type=int, default=1000)
+    parser.add_argument('--revoked', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(engine)
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(delete(RevokedToken.__table__))
+        if args.revoked:
+            connection.execute(insert(RevokedToken.__table__), [
+                {'jti': uuid.uuid4().hex, 'expires_at': expires_at, 'revoked_at': expires_at}
+                for _ in range(args.revoked)
+            ])
+
+    keys = {'main': 'bench-secret-' + 'x' * 32}
+    service = TokenService(keys, 'main', RevocationList(engine, capacity=max(args.revoked, 1)),
+                           cache_size=args.tokens * 2)
+    tokens = [service.issue(user_id, 'user%d' % user_id) for user_id in range(args.tokens)]
+
+    def raw_decode():
+        for token in tokens:
+            jwt.decode(token, keys['main'], algorithms=[JWT_ALGORITHM])
+
+    def cold():
+        service.cache.invalidate()
+        for token in tokens:
+            service.verify(token)
+
+    def warm():
+        for token in tokens:
+            service.verify(token)
+
+    def bloom():
+        for token in tokens:
+            service.revocations.is_revoked('not-a-revoked-jti')
+
+    print('%d tokens per pass, %d revoked jtis, bloom filter %d KiB / %d hashes' % (
+        args.tokens, args.revoked, len(service.revocations.filter.bits) // 1024,
+        service.revocations.filter.hashes))
+    report('pyjwt decode only', measure(raw_decode, args.repeat))
+    report('TokenService.verify, cold cache', measure(cold, args.repeat))
+    report('TokenService.verify, warm cache', measure(warm, args.repeat))
+    report('revocation check only', measure(bloom, args.repeat))
+    print('confirming queries on bloom hits: %d' % service.revocations.confirmations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/common.py
+"""Shared helpers for the benchmark scripts in this directory"""
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select  # noqa: E402
+
+from aturmation_app.models.meta import Base  # noqa: E402
+from aturmation_app.models import Product  # noqa: E402
+import aturmation_app.search  # noqa: E402,F401  (registers search DDL on create_all)
+
+DEFAULT_URL = 'sqlite:///benchmark.sqlite'
+
+WORDS = (
+    'steel', 'bolt', 'washer', 'cable', 'adapter', 'blue', 'red', 'green',
+    'large', 'small', 'premium', 'basic', 'pack', 'box', 'roll', 'sheet',
+)
+
+
+def product_row(i, now):
+    return {
+        'name': '%s %s %d' % (WORDS[i % 16].title(), WORDS[(i // 16) % 16], i),
+        'sku': 'SKU-%08d' % i,
+        'description': ' '.join(WORDS[(i * k) % 16] for k in range(1, 9)),
+        'price': float(i % 1000) + 0.99,
+        'stock': i % 50,
+        'created_at': now - datetime.timedelta(seconds=i),
+        'updated_at': now,
+    }
+
+
+def make_engine(url=DEFAULT_URL, **kwargs):
+    return create_engine(url, **kwargs)
+
+
+def seed_products(engine, count, batch=10000):
+    """Create the schema and make sure ``products`` holds at least ``count`` rows"""
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        existing = conn.execute(select(func.count()).select_from(Product.__table__)).scalar()
+    if existing >= count:
+        return existing
+    now = datetime.datetime.utcnow()
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for start in range(existing, count, batch):
+            rows = [product_row(i, now) for i in range(start, min(start + batch, count))]
+            conn.execute(insert(Product.__table__), rows)
+    print('seeded %d products in %.1fs' % (count - existing, time.perf_counter() - started))
+    return count
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Run ``fn`` and return (median, p95, max) latency in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples), p95, samples[-1]
+
+
+def report(label, stats):
+    median, p95, worst = stats
+    print('%-40s median %8.2f ms   p95 %8.2f ms   max %8.2f ms' % (label, median, p95, worst))
@@ -0,0 +1,124 @@
+# benchmarks/load_login_storm.py
+"""
+Read latency during a login storm.
+
+    python benchmarks/load_login_storm.py --hash-workers 2
+    python benchmarks/load_login_storm.py --hash-workers 0   # bcrypt on the request threads
+
+Serves the app with waitress in-process, then measures GET /api/v1/products
+latency from one client, first on an idle server and then while --storm
+clients hammer POST /api/v1/auth/login with the configured bcrypt work
+factor. With the hashing pool the read p99 should stay close to idle;
+surplus logins get 503 + Retry-After instead of taking server threads.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from waitress.server import create_server
+
+from common import seed_products
+from aturmation_app import main as make_app
+from aturmation_app.models import User, get_engine, get_session_factory
+
+
+def request(url, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers), timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def read_latencies(base, token, duration):
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        request(base + '/api/v1/products?per_page=20', token=token)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--threads', type=int, default=4, help='waitress threads')
+    parser.add_argument('--storm', type=int, default=32, help='concurrent login clients')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'storm.sqlite')
+    settings = {
+        'sqlalchemy.url': 'sqlite:///' + path,
+        'auth.hash.workers': str(args.hash_workers),
+        'auth.hash.max_pending': str(args.max_pending),
+        'auth.bcrypt.rounds': str(args.rounds),
+    }
+    app = make_app({}, **settings)
+    engine = get_engine(settings)
+    seed_products(engine, 1000)
+    session = get_session_factory(engine)()
+    user = User(name='Storm', username='storm', email='storm@example.com', role='staff')
+    user.hashed_password = app.registry['password_hasher'].hash('storm-password')
+    session.add(user)
+    session.commit()
+    session.close()
+
+    server = create_server(app, host='127.0.0.1', port=0, threads=args.threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    base = 'http://127.0.0.1:%s' % server.effective_port
+    credentials = {'username': 'storm', 'password': 'storm-password'}
+    token = json.loads(request(base + '/api/v1/auth/login', credentials)[1])['token']
+
+    idle = read_latencies(base, token, args.duration / 2)
+
+    stop = threading.Event()
+    statuses = {}
+    lock = threading.Lock()
+
+    def login_client():
+        while not stop.is_set():
+            status = request(base + '/api/v1/auth/login', credentials)[0]
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if status == 503:
+                time.sleep(0.05)
+
+    clients = [threading.Thread(target=login_client, daemon=True) for _ in range(args.storm)]
+    for client in clients:
+        client.start()
+    time.sleep(0.5)
+    storm = read_latencies(base, token, args.duration)
+    stop.set()
+    for client in clients:
+        client.join()
+    server.close()
+    app.registry['password_hasher'].shutdown()
+
+    print('hash workers %d, max pending %d, rounds %d, waitress threads %d, %d login clients' % (
+        args.hash_workers, args.max_pending, args.rounds, args.threads, args.storm))
+    for label, samples in (('idle', idle), ('login storm', storm)):
+        print('%-12s GET /api/v1/products  n=%5d  p50 %8.1f ms  p99 %8.1f ms' % (
+            label, len(samples), percentile(samples, 0.5), percentile(samples, 0.99)))
+    print('login responses: %s' % ', '.join('%s x %d' % item for item in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -37,6 +37,7 @@ setup(
         ],
         'console_scripts': [
             'initialize_aturmation_db = aturmation_app.scripts.initializedb:main',
+            'import_aturmation_products = aturmation_app.scripts.import_products:main',
         ],
     },
 )
\ No newline at end of file
@@ -1,70 +1,61 @@
 # tests/conftest.py
 import pytest
 from webtest import TestApp
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from pyramid.request import Request
 
 from aturmation_app.models.meta import Base
-from aturmation_app.models import (
-    User, UserRole, Product, # HANYA User, UserRole, Product
-    DBSession # Impor DBSession global dari models
-)
+from aturmation_app.models import User, Product, get_engine
+from aturmation_app.models.user import UserRole
 from aturmation_app import main as main_app_factory
 
-@pytest.fixture(scope='session')
-def test_settings_override():
+@pytest.fixture
+def test_settings_override(tmp_path):
+    # Satu file SQLite per tes: engine aplikasi dan sesi tes melihat data yang sama
     return {
-        'sqlalchemy.url': 'sqlite:///:memory:',
+        'sqlalchemy.url': 'sqlite:///%s' % (tmp_path / 'test.sqlite'),
         'jwt.secret': 'test-jwt-secret-for-pytest',
+        # bcrypt dijalankan di thread tes, tanpa process pool
+        'auth.hash.workers': '0',
+        # Request dengan pola N+1 atau lebih dari budget query membuat test gagal
+        'db.audit.strict': 'true',
+        'db.audit.default_budget': '8',
+        # PATCH batch: satu UPDATE plus SAVEPOINT/RELEASE per kelompok field,
+        # ditambah baca stok lama dan baris ledger untuk kelompok stok
+        'db.audit.budgets': 'api_products_collection:16',
     }
 
-@pytest.fixture(scope='session')
-def test_engine(test_settings_override):
-    return create_engine(test_settings_override['sqlalchemy.url'])
-
-@pytest.fixture(scope='session')
-def setup_database_schema(test_engine):
-    DBSession.configure(bind=test_engine)
-    Base.metadata.create_all(test_engine) # Hanya akan membuat tabel User dan Product
-    yield
-    Base.metadata.drop_all(test_engine)
-    if hasattr(DBSession, 'remove'): DBSession.remove()
+@pytest.fixture
+def pyramid_app(test_settings_override):
+    # Skema dibuat sebelum aplikasi: token yang dicabut dimuat saat startup
+    engine = get_engine(test_settings_override)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return main_app_factory({}, **test_settings_override)
 
-@pytest.fixture(scope='session')
-def pyramid_app(test_settings_override, setup_database_schema): # Bergantung pada setup_database_schema
-    # DBSession global sudah dikonfigurasi oleh setup_database_schema
-    app = main_app_factory({}, **test_settings_override)
-    return app
+@pytest.fixture
+def test_engine(pyramid_app):
+    return pyramid_app.registry['dbengine']
 
 @pytest.fixture
 def testapp(pyramid_app):
     return TestApp(pyramid_app)
 
-@pytest.fixture(scope='function')
-def dbsession(test_engine, request): # Sesi lokal untuk setup/verifikasi tes
-    connection = test_engine.connect()
-    transaction = connection.begin()
-    SessionLocal = sessionmaker(bind=connection)
-    session = SessionLocal()
-
-    def teardown():
-        session.close()
-        transaction.rollback()
-        connection.close()
-    request.addfinalizer(teardown)
+@pytest.fixture
+def dbsession(pyramid_app, request): # Sesi lokal untuk setup/verifikasi tes
+    session = pyramid_app.registry['dbsession_factory']()
+    request.addfinalizer(session.close)
     return session
 
 @pytest.fixture
 def dummy_request(dbsession, pyramid_app):
     req = Request.blank('/')
-    req.dbsession = dbsession 
+    req.dbsession = dbsession
     req.registry = pyramid_app.registry
     return req
 
 @pytest.fixture
 def create_test_user(dbsession):
-    def _create_test_user(name, username, email, password, role=UserRole.staff, commit_session=True):
+    def _create_test_user(name, username, email, password, role=UserRole.STAFF, commit_session=True):
         user = User(name=name, username=username, email=email, role=role)
         user.set_password(password)
         dbsession.add(user)
@@ -92,18 +83,18 @@ def create_test_product(dbsession): # Tidak perlu create_test_category lagi
 
 @pytest.fixture
 def auth_token_for_user(testapp, create_test_user):
-    def _auth_token_for_user(username, password, name=None, email=None, role=UserRole.staff):
+    def _auth_token_for_user(username, password, name=None, email=None, role=UserRole.STAFF):
         user_name = name if name else f"Test User {username}"
-        user_email = email if email else f"{username}_{role.value}_token_auto@example.com"
-        
+        user_email = email if email else f"{username}_{role}_token_auto@example.com"
+
         create_test_user(
             name=user_name, username=username, email=user_email,
             password=password, role=role, commit_session=True
         )
-        
+
         login_payload = {'username': username, 'password': password}
         res = testapp.post_json('/api/v1/auth/login', login_payload, expect_errors=True)
-        
+
         if res.status_code == 200:
             token = res.json.get('token')
             if token: return token
@@ -113,4 +104,9 @@ def auth_token_for_user(testapp, create_test_user):
             response_text = res.json if res.content_type == 'application/json' else res.text
             print(f"Login failed in auth_token_for_user for {username}. Status: {res.status_code}, Response: {response_text}")
             return None
-    return _auth_token_for_user
\ No newline at end of file
+    return _auth_token_for_user
+
+@pytest.fixture
+def admin_headers(auth_token_for_user):
+    token = auth_token_for_user('admin_tester', 'password123', role=UserRole.ADMIN)
+    return {'Authorization': f'Bearer {token}'}
@@ -1,5 +1,9 @@
 # tests/test_auth_api.py
-from aturmation_app.models import UserRole # Pastikan UserRole diimpor dari models Anda
+from sqlalchemy import event
+from webtest import TestApp
+
+from aturmation_app import main as main_app_factory
+from aturmation_app.models.user import UserRole
 
 # Fixtures seperti testapp, create_test_user, auth_token_for_user
 # akan otomatis tersedia jika didefinisikan dengan benar di tests/conftest.py.
@@ -18,7 +22,7 @@ def test_login_success(testapp, auth_token_for_user):
         password=test_password,
         name=user_name,
         email=user_email,
-        role=UserRole.staff # Menggunakan UserRole Enum
+        role=UserRole.STAFF # Menggunakan UserRole Enum
     )
     assert jwt_token is not None, "Token should be generated on successful login"
 
@@ -26,10 +30,10 @@ def test_login_success(testapp, auth_token_for_user):
     headers = {'Authorization': f'Bearer {jwt_token}'}
     me_res = testapp.get('/api/v1/auth/me', headers=headers, status=200)
     
-    assert me_res.json['username'] == test_username
-    assert me_res.json['name'] == user_name
-    assert me_res.json['email'] == user_email
-    assert me_res.json['role'] == UserRole.staff.value # Verifikasi role value (string)
+    assert me_res.json['user']['username'] == test_username
+    assert me_res.json['user']['name'] == user_name
+    assert me_res.json['user']['email'] == user_email
+    assert me_res.json['user']['role'] == UserRole.STAFF # Verifikasi role value (string)
 
 def test_login_failure_wrong_password(testapp, create_test_user):
     """Test login failure with wrong password."""
@@ -42,7 +46,7 @@ def test_login_failure_wrong_password(testapp, create_test_user):
         username=test_username,
         email="wrongpass_v2@example.com", # Pastikan email unik
         password=test_password,
-        role=UserRole.staff,
+        role=UserRole.STAFF,
         commit_session=True # Penting agar user ini ada di DB untuk testapp
     )
 
@@ -50,7 +54,7 @@ def test_login_failure_wrong_password(testapp, create_test_user):
     res = testapp.post_json('/api/v1/auth/login', login_payload, status=401) 
     
     assert 'message' in res.json, "Response should contain a message key"
-    assert res.json['message'] == 'Invalid username or password.'
+    assert res.json['message'] == 'Invalid username or password'
 
 def test_login_failure_user_not_found(testapp):
     """Test login failure for a non-existent user."""
@@ -58,7 +62,7 @@ def test_login_failure_user_not_found(testapp):
     res = testapp.post_json('/api/v1/auth/login', login_payload, status=401)
     
     assert 'message' in res.json, "Response should contain a message key"
-    assert res.json['message'] == 'Invalid username or password.'
+    assert res.json['message'] == 'Invalid username or password'
 
 # TODO (Tambahkan tes-tes ini selanjutnya):
 # def test_register_user_success(testapp):
@@ -95,4 +99,54 @@ def test_login_failure_user_not_found(testapp):
 #     """Test /auth/me endpoint with an invalid token."""
 #     # headers = {'Authorization': 'Bearer invalidtoken123'}
 #     # res = testapp.get('/api/v1/auth/me', headers=headers, status=[401, 403])
-#     pass
\ No newline at end of file
+#     pass
+
+def test_logout_revokes_token(testapp, auth_token_for_user):
+    """A token used for logout is refused afterwards."""
+    token = auth_token_for_user(username="logout_user", password="password123")
+    headers = {'Authorization': f'Bearer {token}'}
+    testapp.get('/api/v1/auth/me', headers=headers, status=200)
+
+    testapp.post('/api/v1/auth/logout', headers=headers, status=200)
+    testapp.get('/api/v1/auth/me', headers=headers, status=401)
+
+
+def test_me_with_warm_caches_runs_no_sql(testapp, auth_token_for_user, test_engine):
+    """Token and user snapshot are cached: a repeated /auth/me never reaches the database."""
+    token = auth_token_for_user(username="warm_user", password="password123")
+    headers = {'Authorization': f'Bearer {token}'}
+    testapp.get('/api/v1/auth/me', headers=headers, status=200)
+
+    statements = []
+    event.listen(test_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    res = testapp.get('/api/v1/auth/me', headers=headers, status=200)
+    assert res.json['user']['username'] == 'warm_user'
+    assert statements == []
+
+
+def test_rotated_key_still_accepts_old_kid(testapp, auth_token_for_user, test_settings_override):
+    token = auth_token_for_user(username="rotated_user", password="password123")
+
+    # Worker lain dengan kunci baru; kunci lama (kid main) masih diterima
+    rotated = TestApp(main_app_factory({}, **dict(
+        test_settings_override, **{'jwt.secret': 'new-secret', 'jwt.kid': 'k2',
+                                   'jwt.old_keys': 'main:test-jwt-secret-for-pytest'})))
+    rotated.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {token}'}, status=200)
+    new_token = rotated.post_json('/api/v1/auth/login', {'username': 'rotated_user', 'password': 'password123'}).json['token']
+    rotated.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {new_token}'}, status=200)
+
+    # Worker yang belum mengenal kid k2 menolak tokennya
+    testapp.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {new_token}'}, status=401)
+
+
+def test_logout_on_other_worker_revokes_token(testapp, auth_token_for_user, test_settings_override):
+    token = auth_token_for_user(username="other_worker_user", password="password123")
+    headers = {'Authorization': f'Bearer {token}'}
+    testapp.get('/api/v1/auth/me', headers=headers, status=200)
+
+    other = TestApp(main_app_factory({}, **test_settings_override))
+    other.post('/api/v1/auth/logout', headers=headers, status=200)
+
+    # Revokasi worker lain sampai ke sini saat thread latar memuat ulang daftar
+    testapp.app.registry['token_service'].revocations.reload()
+    testapp.get('/api/v1/auth/me', headers=headers, status=401)
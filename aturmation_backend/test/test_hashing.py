@@ -0,0 +1,31 @@
+# tests/test_hashing.py
+import concurrent.futures
+
+from aturmation_app.hashing import HashingBusy, PasswordHasher
+
+
+def test_verify_timeout_is_busy_and_cancelled(monkeypatch):
+    hasher = PasswordHasher(workers=1, timeout=0.01, retry_after=7)
+    pending = concurrent.futures.Future()  # Tidak pernah selesai
+    monkeypatch.setattr(hasher, '_submit', lambda *args: pending)
+
+    try:
+        hasher.verify('rahasia', 'hash')
+        assert False, 'HashingBusy expected'
+    except HashingBusy as e:
+        assert e.retry_after == 7
+    assert pending.cancelled()
+    assert hasher.timeouts == 1
+
+
+def test_login_timeout_answers_503(testapp, create_test_user, monkeypatch):
+    create_test_user('Lambat', 'slow_user', 'slow@example.com', 'password123')
+    hasher = testapp.app.registry['password_hasher']
+    monkeypatch.setattr(hasher, '_submit', lambda *args: concurrent.futures.Future())
+    monkeypatch.setattr(hasher, 'timeout', 0.01)
+
+    res = testapp.post_json('/api/v1/auth/login', {'username': 'slow_user', 'password': 'password123'}, status=503)
+    assert res.headers['Retry-After'] == str(hasher.retry_after)
+
+    metrics = testapp.get('/metrics', extra_environ={'REMOTE_ADDR': '127.0.0.1'}).text
+    assert 'aturmation_password_hash_rejected_total{reason="timeout"} 1' in metrics
@@ -0,0 +1,28 @@
+# tests/test_pooling.py
+import pytest
+
+from aturmation_app import main as main_app_factory
+from aturmation_app.pooling import server_threads
+
+
+@pytest.fixture
+def server_ini(tmp_path):
+    ini = tmp_path / 'app.ini'
+    ini.write_text('[app:main]\nuse = egg:aturmation_app\n\n'
+                   '[server:main]\nuse = egg:waitress#main\nthreads = 12\n')
+    return {'__file__': str(ini), 'here': str(tmp_path)}
+
+
+def test_server_threads(server_ini):
+    assert server_threads(server_ini) == 12
+    assert server_threads({'threads': '6'}) == 6
+    assert server_threads({}) is None
+
+
+def test_pool_size_follows_server_threads(server_ini, test_settings_override):
+    app = main_app_factory(server_ini, **test_settings_override)
+    assert app.registry['dbengine'].pool.size() == 12
+
+    # db.pool.threads tetap bisa menimpa
+    app = main_app_factory(server_ini, **dict(test_settings_override, **{'db.pool.threads': '3'}))
+    assert app.registry['dbengine'].pool.size() == 3
@@ -0,0 +1,282 @@
+# tests/test_products_api.py
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, insert
+from webob import Request
+from webtest import TestApp
+
+from aturmation_app import main as main_app_factory
+from aturmation_app.cache import LRUCache
+from aturmation_app.models import Product, StockMovement
+from aturmation_app.models.meta import Base
+from aturmation_app.product_cache import ProductCache, SQLiteBackend
+
+
+@pytest.fixture
+def products(create_test_product):
+    return [create_test_product(f"Produk {i}", f"SKU-{i}", 1000.0 + i, 10) for i in range(5)]
+
+
+def test_keyset_pages_cover_collection_once(testapp, products):
+    """Following next_cursor visits every product once, newest first."""
+    seen = []
+    params = {'cursor': '', 'per_page': 2}
+    while True:
+        res = testapp.get('/api/v1/products', params, status=200)
+        seen.extend(product['id'] for product in res.json['products'])
+        cursor = res.json['pagination']['next_cursor']
+        if cursor is None:
+            break
+        params['cursor'] = cursor
+
+    assert seen == [product.id for product in reversed(products)]
+
+
+def test_keyset_bad_cursor(testapp, products):
+    res = testapp.get('/api/v1/products', {'cursor': 'not-a-cursor'}, status=400)
+    assert res.json['message'] == 'Invalid cursor'
+
+
+def test_count_modes(testapp, products):
+    exact = testapp.get('/api/v1/products', {'count': 'exact'}).json['pagination']
+    assert (exact['total_items'], exact['count_mode']) == (5, 'exact')
+
+    none = testapp.get('/api/v1/products', {'count': 'none'}).json['pagination']
+    assert (none['total_items'], none['total_pages'], none['count_mode']) == (None, None, 'none')
+
+    # Pertama dihitung, berikutnya dari cache
+    testapp.get('/api/v1/products', {'count': 'cached'})
+    cached = testapp.get('/api/v1/products', {'count': 'cached'}).json['pagination']
+    assert (cached['total_items'], cached['count_mode']) == (5, 'cached')
+
+    # SQLite tidak punya estimasi planner, jadi jatuh ke exact
+    estimate = testapp.get('/api/v1/products', {'count': 'estimate'}).json['pagination']
+    assert (estimate['total_items'], estimate['count_mode']) == (5, 'exact')
+
+    testapp.get('/api/v1/products', {'count': 'bogus'}, status=400)
+
+
+def test_fields_narrow_response_and_select(testapp, products, test_engine):
+    statements = []
+    event.listen(test_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    res = testapp.get('/api/v1/products', {'fields': 'sku, name', 'count': 'none'}, status=200)
+
+    assert [set(product) for product in res.json['products']] == [{'name', 'sku'}] * 5
+    # Query halaman hanya memilih kolom yang diminta (plus id/created_at untuk cursor)
+    [page_sql] = [sql for sql in statements if 'LIMIT' in sql]
+    assert 'description' not in page_sql and 'price' not in page_sql
+
+    detail = testapp.get(f'/api/v1/products/{products[0].id}', {'fields': 'price'}).json['product']
+    assert detail == {'price': 1000.0}
+
+    res = testapp.get('/api/v1/products', {'fields': 'name,bogus,secret'}, status=400)
+    assert res.json['message'] == 'Unknown fields: bogus, secret'
+    testapp.get(f'/api/v1/products/{products[0].id}', {'fields': 'bogus'}, status=400)
+
+
+def test_collection_etag_revalidates(testapp, admin_headers, products):
+    etag = testapp.get('/api/v1/products').headers['ETag']
+    testapp.get('/api/v1/products', headers={'If-None-Match': etag}, status=304)
+
+    testapp.put_json(f'/api/v1/products/{products[0].id}', {'price': 5.0}, headers=admin_headers)
+    res = testapp.get('/api/v1/products', headers={'If-None-Match': etag}, status=200)
+    assert res.headers['ETag'] != etag
+
+
+def test_collection_etag_sees_other_workers_and_filters(testapp, products, dbsession):
+    etag = testapp.get('/api/v1/products').headers['ETag']
+    search_etag = testapp.get('/api/v1/products', {'search': 'SKU-1'}).headers['ETag']
+
+    # Hapus langsung di database, seperti dari worker lain
+    dbsession.delete(products[4])
+    dbsession.commit()
+    testapp.get('/api/v1/products', headers={'If-None-Match': etag}, status=200)
+    testapp.get('/api/v1/products', {'search': 'SKU-1'}, headers={'If-None-Match': search_etag}, status=304)
+
+
+def test_replica_reads_round_robin_and_pin_after_write(tmp_path, test_settings_override, admin_headers, products):
+    urls = []
+    for index in (1, 2):
+        url = 'sqlite:///%s' % (tmp_path / f'replica{index}.sqlite')
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(Product.__table__).values(
+                name=f'Replika {index}', sku=f'R-{index}', price=1.0, stock=1))
+        engine.dispose()
+        urls.append(url)
+    app = TestApp(main_app_factory({}, **dict(
+        test_settings_override, **{'sqlalchemy.replica.url': '\n'.join(urls), 'db.replica.pin_seconds': '0.5'})))
+
+    def first_name():
+        return app.get('/api/v1/products').json['products'][0]['name']
+
+    assert [first_name() for _ in range(3)] == ['Replika 1', 'Replika 2', 'Replika 1']
+
+    # Setelah menulis, klien dibaca dari primary selama pin_seconds
+    res = app.post_json('/api/v1/products', {'name': 'Baru', 'sku': 'NEW-1', 'price': 1.0, 'stock': 1},
+                        headers=admin_headers, status=200)
+    assert 'X-Last-Write' in res.headers
+    assert first_name() == 'Baru'
+    time.sleep(0.6)
+    assert first_name().startswith('Replika')
+
+
+def test_product_etag_revalidates(testapp, admin_headers, products):
+    url = f'/api/v1/products/{products[0].id}'
+    etag = testapp.get(url).headers['ETag']
+    testapp.get(url, headers={'If-None-Match': etag}, status=304)
+
+    testapp.put_json(url, {'name': 'Diganti'}, headers=admin_headers)
+    testapp.get(url, headers={'If-None-Match': etag}, status=200)
+
+
+def test_product_cache_invalidated_after_commit(testapp, admin_headers, products, test_engine):
+    url = f'/api/v1/products/{products[0].id}'
+    testapp.get(url)
+    statements = []
+    event.listen(test_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    testapp.get(url)
+    assert statements == []
+
+    testapp.put_json(url, {'price': 7.5}, headers=admin_headers)
+    assert testapp.get(url).json['product']['price'] == 7.5
+
+
+def test_shared_product_cache_version_guard(tmp_path):
+    """A reader that loaded before an invalidation cannot store the old row."""
+    path = str(tmp_path / 'cache.sqlite')
+    reader = ProductCache(LRUCache(), SQLiteBackend(path, 60))
+    writer = ProductCache(LRUCache(), SQLiteBackend(path, 60))
+
+    def racing_loader():
+        writer.invalidate([1])
+        return {'id': 1, 'price': 1.0}
+
+    assert reader.load(1, racing_loader) == {'id': 1, 'price': 1.0}
+    assert reader.shared.stats()['stale_sets'] == 1
+    assert writer.load(1, lambda: {'id': 1, 'price': 2.0}) == {'id': 1, 'price': 2.0}
+    assert ProductCache(LRUCache(), SQLiteBackend(path, 60)).load(1, lambda: None) == {'id': 1, 'price': 2.0}
+
+
+def test_batch_update_reports_partial_failure(testapp, admin_headers, products):
+    items = [
+        {'id': products[0].id, 'price': 1.5},
+        {'sku': 'SKU-1', 'name': 'Baru'},
+        {'id': 9999, 'price': 2.0},
+        {'id': products[2].id, 'name': ''},
+        {'id': products[3].id, 'stock': 3},
+    ]
+    res = testapp.patch_json('/api/v1/products', {'items': items}, headers=admin_headers, status=200)
+
+    assert [result['status'] for result in res.json['results']] == \
+        ['updated', 'updated', 'not_found', 'invalid', 'updated']
+    assert res.json['summary'] == {'updated': 3, 'not_found': 1, 'invalid': 1}
+    assert testapp.get(f'/api/v1/products/{products[1].id}').json['product']['name'] == 'Baru'
+    assert testapp.get(f'/api/v1/products/{products[3].id}').json['product']['stock'] == 3
+
+
+def test_batch_stock_take_records_ledger(testapp, admin_headers, products, dbsession):
+    items = [{'id': products[0].id, 'stock': 4}, {'sku': 'SKU-1', 'stock': 10}, {'id': products[2].id, 'stock': 25}]
+    testapp.patch_json('/api/v1/products', {'items': items}, headers=admin_headers, status=200)
+
+    movements = dbsession.query(StockMovement).order_by(StockMovement.product_id).all()
+    assert [(movement.product_id, movement.delta, movement.stock_after, movement.reason) for movement in movements] == \
+        [(products[0].id, -6, 4, 'set'), (products[2].id, 15, 25, 'set')]
+
+
+def test_stats_totals_and_top_lists(testapp, admin_headers, products, create_test_product):
+    create_test_product('Hampir habis', 'LOW-1', 5.0, 2)
+    params = {'limit': 2, 'low_stock_threshold': 5}
+    stats = testapp.get('/api/v1/products/stats', params, status=200).json['stats']
+
+    assert stats['totals'] == {
+        'total_products': 6,
+        'total_stock': 52,
+        'inventory_value': sum((1000.0 + i) * 10 for i in range(5)) + 10.0,
+        'low_stock_count': 1,
+    }
+    assert [product['sku'] for product in stats['low_stock']] == ['LOW-1']
+    assert [product['sku'] for product in stats['recent']] == ['LOW-1', 'SKU-4']
+    assert [product['sku'] for product in stats['top_priced']] == ['SKU-4', 'SKU-3']
+
+    # Cache dipakai sampai ada penulisan produk
+    assert testapp.get('/api/v1/products/stats', params).json['cached'] is True
+    testapp.put_json(f'/api/v1/products/{products[0].id}', {'price': 5000.0}, headers=admin_headers)
+    res = testapp.get('/api/v1/products/stats', params).json
+    assert res['cached'] is False
+    assert [product['sku'] for product in res['stats']['top_priced']] == ['SKU-0', 'SKU-4']
+
+    testapp.get('/api/v1/products/stats', {'limit': 'lima'}, status=400)
+
+
+def test_search_ranks_exact_sku_first(testapp, create_test_product):
+    create_test_product('Kabel data', 'KBL-100', 10.0, 1, description='kabel USB-C')
+    create_test_product('Adaptor', 'KBL', 10.0, 1)
+    res = testapp.get('/api/v1/products', {'search': 'KBL'}, status=200)
+    assert [product['sku'] for product in res.json['products']] == ['KBL', 'KBL-100']
+
+
+def test_search_without_index_falls_back_to_like(testapp, create_test_product, test_engine):
+    create_test_product('Kabel data', 'KBL-100', 10.0, 1, description='kabel USB-C')
+    with test_engine.begin() as connection:
+        for trigger in ('products_fts_ai', 'products_fts_ad', 'products_fts_au'):
+            connection.exec_driver_sql(f'DROP TRIGGER {trigger}')
+        connection.exec_driver_sql('DROP TABLE products_fts')
+
+    res = testapp.get('/api/v1/products', {'search': 'usb-c'}, status=200)
+    assert [product['sku'] for product in res.json['products']] == ['KBL-100']
+    assert testapp.app.registry['search_backend'].name == 'like'
+
+
+def test_batch_update_same_product_by_id_and_sku(testapp, admin_headers, products):
+    items = [{'id': products[0].id, 'price': 7.0}, {'sku': 'SKU-0', 'price': 8.0}]
+    res = testapp.patch_json('/api/v1/products', {'items': items}, headers=admin_headers, status=200)
+
+    assert [result['status'] for result in res.json['results']] == ['updated', 'invalid']
+    assert res.json['results'][1]['message'] == 'Duplicate item in batch'
+    assert testapp.get(f'/api/v1/products/{products[0].id}').json['product']['price'] == 7.0
+
+
+def test_import_counts_duplicate_skus(testapp, admin_headers):
+    body = 'name,sku,price,stock\nLama,DUP-1,1,1\nLain,ONE-1,2,2\nBaru,DUP-1,3,3\nRusak,,4,4\n'
+    res = testapp.post('/api/v1/products/import?format=csv', body, status=200,
+                       headers=dict(admin_headers, **{'Content-Type': 'text/csv'}))
+    report = res.json['import']
+
+    assert (report['received'], report['upserted'], report['failed'], report['duplicates']) == (4, 2, 1, 1)
+    products = testapp.get('/api/v1/products', {'search': 'DUP-1'}).json['products']
+    assert [(product['name'], product['stock']) for product in products] == [('Baru', 3)]
+
+
+
+def test_import_reports_bad_bytes_and_prices_per_row(testapp, admin_headers):
+    body = (b'name,sku,price,stock\nBaik,OK-1,1,1\nRusak\xff,BAD-1,1,1\nMahal,NAN-1,nan,1\n'
+            b'Panjang,LONG-1,' + b'9' * 140000 + b',1\nLain,OK-2,inf,1\n')
+    res = testapp.post('/api/v1/products/import?format=csv', body, status=200,
+                       headers=dict(admin_headers, **{'Content-Type': 'text/csv'}))
+    report = res.json['import']
+
+    assert (report['received'], report['upserted'], report['failed']) == (5, 1, 4)
+    assert [(error['line'], error['message']) for error in report['errors']] == [
+        (3, 'Invalid UTF-8'),
+        (4, 'Price must be a finite number'),
+        (5, 'Invalid CSV: field larger than field limit (131072)'),
+        (6, 'Price must be a finite number'),
+    ]
+
+@pytest.mark.parametrize('accept_encoding, gzipped', [
+    (None, False),
+    ('gzip, deflate', True),
+    ('gzip;q=0, identity', False),
+    ('x-gzip-custom', False),
+])
+def test_export_negotiates_gzip(testapp, admin_headers, products, accept_encoding, gzipped):
+    headers = dict(admin_headers, **({'Accept-Encoding': accept_encoding} if accept_encoding else {}))
+    # Langsung lewat webob: TestApp membuka gzip dan membuang Content-Encoding
+    res = Request.blank('/api/v1/products/export', headers=headers).get_response(testapp.app)
+    assert res.status_int == 200
+
+    assert (res.headers.get('Content-Encoding') == 'gzip') == gzipped
+    assert 'Accept-Encoding' in res.headers['Vary']
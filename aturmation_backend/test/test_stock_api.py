@@ -0,0 +1,29 @@
+# tests/test_stock_api.py
+from aturmation_app.models import StockMovement
+
+
+def test_stock_movement_applies_delta(testapp, admin_headers, create_test_product, dbsession):
+    product = create_test_product('Kopi', 'KOPI-1', 25000.0, 5)
+    res = testapp.post_json(f'/api/v1/products/{product.id}/stock-movements',
+                            {'delta': -2, 'reason': 'sale'}, headers=admin_headers, status=200)
+
+    assert res.json['product']['stock'] == 3
+    movement = dbsession.query(StockMovement).filter_by(product_id=product.id).one()
+    assert (movement.delta, movement.stock_after, movement.reason) == (-2, 3, 'sale')
+
+
+def test_stock_cannot_go_below_zero(testapp, admin_headers, create_test_product, dbsession):
+    product = create_test_product('Teh', 'TEH-1', 15000.0, 2)
+    testapp.post_json(f'/api/v1/products/{product.id}/stock-movements',
+                      {'delta': -3}, headers=admin_headers, status=409)
+
+    assert testapp.get(f'/api/v1/products/{product.id}').json['product']['stock'] == 2
+    assert dbsession.query(StockMovement).filter_by(product_id=product.id).count() == 0
+
+
+def test_stock_set_records_difference(testapp, admin_headers, create_test_product, dbsession):
+    product = create_test_product('Gula', 'GULA-1', 12000.0, 4)
+    testapp.put_json(f'/api/v1/products/{product.id}', {'stock': 9}, headers=admin_headers, status=200)
+
+    movement = dbsession.query(StockMovement).filter_by(product_id=product.id).one()
+    assert (movement.delta, movement.stock_after, movement.reason) == (5, 9, 'set')
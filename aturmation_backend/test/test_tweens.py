@@ -0,0 +1,81 @@
+# tests/test_tweens.py
+import pytest
+from sqlalchemy import event
+
+from aturmation_app.models import Product
+from aturmation_app.queryaudit import QueryAudit, QueryBudgetExceeded
+
+
+@pytest.fixture
+def test_settings_override(test_settings_override):
+    return dict(test_settings_override, **{
+        'cors.manual.origins': 'http://localhost:5173',
+        # Budget yang sengaja terlalu kecil untuk koleksi produk
+        'db.audit.budgets': 'api_products_collection:1',
+    })
+
+
+def test_cors_preflight_answered_before_routing(testapp):
+    res = testapp.options('/api/v1/products', headers={
+        'Origin': 'http://localhost:5173',
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'Authorization, Content-Type',
+    }, status=204)
+
+    assert res.headers['Access-Control-Allow-Origin'] == 'http://localhost:5173'
+    assert 'POST' in res.headers['Access-Control-Allow-Methods']
+    assert 'Authorization' in res.headers['Access-Control-Allow-Headers']
+    assert 'X-Last-Write' in res.headers['Access-Control-Allow-Headers']
+    assert 'Origin' in res.headers['Vary']
+
+
+def test_cors_exposes_last_write(testapp):
+    res = testapp.get('/api/v1/auth/me', headers={'Origin': 'http://localhost:5173'}, status=401)
+    assert 'X-Last-Write' in res.headers['Access-Control-Expose-Headers']
+
+
+def test_cors_preflight_unknown_origin(testapp):
+    res = testapp.options('/api/v1/products', headers={
+        'Origin': 'http://evil.example',
+        'Access-Control-Request-Method': 'POST',
+    }, status=204)
+
+    assert 'Access-Control-Allow-Origin' not in res.headers
+
+
+def test_strict_budget_failure_rolls_back(testapp, admin_headers, dbsession):
+    with pytest.raises(QueryBudgetExceeded):
+        testapp.post_json('/api/v1/products', {'name': 'Mahal', 'sku': 'BUDGET-1', 'price': 1.0, 'stock': 3},
+                          headers=admin_headers)
+
+    assert dbsession.query(Product).filter_by(sku='BUDGET-1').count() == 0
+
+
+def test_rolled_back_write_keeps_product_cache(testapp, admin_headers, create_test_product, test_engine):
+    product = create_test_product('Tetap', 'CACHE-1', 1.0, 3)
+    url = f'/api/v1/products/{product.id}'
+    testapp.get(url)
+
+    with pytest.raises(QueryBudgetExceeded):
+        testapp.patch_json('/api/v1/products', {'items': [{'id': product.id, 'name': 'Batal'}]},
+                           headers=admin_headers)
+
+    # Invalidasi hanya diterapkan setelah commit: entri lama tetap dipakai tanpa SQL
+    statements = []
+    event.listen(test_engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert testapp.get(url).json['product']['name'] == 'Tetap'
+    assert statements == []
+
+
+def test_query_audit_ignores_bulk_and_executemany():
+    audit = QueryAudit()
+    for chunk in range(6):
+        audit.add('SELECT sku FROM products WHERE sku IN (?)', ('SKU-%d' % chunk,), 0.0, bulk=True)
+    for _ in range(2):
+        audit.add('INSERT INTO stock_movements VALUES (?)', [(1,), (2,)], 0.0, executemany=True)
+    assert audit.problems(5) == ([], [])
+
+    for _ in range(2):
+        audit.add('SELECT * FROM products WHERE id = ?', (1,), 0.0)
+    assert audit.total == 10
+    assert audit.problems(5)[1] == [(2, 'SELECT * FROM products WHERE id = ?')]
@@ -41,42 +41,14 @@ const HomePage = () => {
     const fetchProductData = async () => {
       setLoading(true);
       try {
-        // Fetch products data
-        const productsResponse = await productService.getAllProducts({});
+        // Aggregates are computed server-side over the whole catalog
+        const response = await productService.getProductStats({ low_stock_threshold: 10, limit: 5 });
+        const stats = response?.stats || {};
         
-        // Extract products array from response based on structure
-        let products = [];
-        if (Array.isArray(productsResponse)) {
-          products = productsResponse;
-        } else if (productsResponse?.products && Array.isArray(productsResponse.products)) {
-          products = productsResponse.products;
-        } else if (productsResponse?.data && Array.isArray(productsResponse.data)) {
-          products = productsResponse.data;
-        }
-        
-        // Calculate statistics
-        const totalProducts = products.length;
-        
-        // Get low stock products (stock <= minStock or <= 10 if minStock not defined)
-        const lowStockProducts = products
-          .filter(p => p.stock <= (p.minStock || 10))
-          .sort((a, b) => a.stock - b.stock)
-          .slice(0, 5);
-        
-        // Get 5 most recent products
-        const recentProducts = [...products]
-          .sort((a, b) => {
-            if (a.createdAt && b.createdAt) {
-              return new Date(b.createdAt) - new Date(a.createdAt);
-            }
-            return b.id - a.id; // Fallback to ID if createdAt is not available
-          })
-          .slice(0, 5);
-        
-        // Get 5 highest priced products
-        const highestPricedProducts = [...products]
-          .sort((a, b) => (b.price || 0) - (a.price || 0))
-          .slice(0, 5);
+        const totalProducts = stats.totals?.total_products || 0;
+        const lowStockProducts = stats.low_stock || [];
+        const recentProducts = stats.recent || [];
+        const highestPricedProducts = stats.top_priced || [];
         
         setProductStats({
           totalProducts,
@@ -75,7 +75,9 @@ const ProductsPage = () => {
         per_page: rowsPerPage,
         sort: sortBy,
         order: sortDirection,
-        search: searchTerm
+        search: searchTerm,
+        // Only the columns the table renders
+        fields: 'id,name,sku,price,stock'
       };
 
       const response = await productService.getAllProducts(params);
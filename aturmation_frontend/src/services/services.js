@@ -74,6 +74,15 @@ export const productService = {
     }
   },
 
+  getProductStats: async (params) => {
+    try {
+      const response = await authAxios.get(`${API_URL}/products/stats`, { params });
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
   getProductById: async (id) => {
     try {
       const response = await authAxios.get(`${API_URL}/products/${id}`);